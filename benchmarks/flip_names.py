@@ -0,0 +1,176 @@
+#!/usr/bin/env python3
+"""Benchmark of flipping the bone names of a large rig.
+
+Checks that flip.name() gives the same results as the original
+implementation on a corpus of bone names, then compares the time it takes
+to flip all names of a 2000-bone rig. Run from the root of the repository:
+
+    python benchmarks/flip_names.py
+"""
+
+import itertools
+import os
+import string
+import sys
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from tests import blender_stubs  # noqa: E402
+
+blender_stubs.install()
+
+from pose_thumbnails import flip  # noqa: E402
+
+BONE_COUNT = 2000
+
+# Bone names as they occur in real rigs.
+RIG_NAMES = [
+    'root', 'hips', 'spine', 'spine.001', 'chest', 'neck', 'head', 'jaw', 'tongue.002',
+    'shoulder.L', 'upper_arm.L', 'forearm.L', 'hand.L', 'thumb.01.L', 'f_index.03.R',
+    'thigh.R', 'shin.R', 'foot.R', 'toe.R', 'heel.02.R', 'MCH-thigh_parent.L',
+    'ORG-upper_arm.R', 'DEF-forearm.L.001', 'hand_ik.L', 'thigh_fk.R', 'VIS_upper_arm_ik_pole.L',
+    'L_eyelid_upper', 'r_brow_mid', 'Left_Ear', 'RightEar', 'LEFT-cheek', 'lip_corner_RIGHT',
+    'eye_left', 'eye_Right', 'EyeLeft.004', 'Leftovers', 'lid.l', 'lid.r.12',
+    'bone.1abc2', 'L', 'R.', 'x.L', 'a', '', 'left', 'RIGHT', 'r-bone', 'spine.',
+]
+
+
+def original_name(to_flip: str, strip_number=False) -> str:
+    """flip.name() before it was memoized."""
+    import string
+
+    if len(to_flip) < 3:
+        # we don't do names like .R or .L
+        return to_flip
+
+    # TODO: define once and reuse
+    separators = set('. -_')
+    replacements = {
+        'l': 'r',
+        'L': 'R',
+        'r': 'l',
+        'R': 'L',
+    }
+
+    prefix = suffix = number = ''
+    is_set = False
+
+    # We first check the case with a .### extension, let's find the last period
+    replace = to_flip
+    if to_flip[-1] in string.digits:
+        try:
+            index = to_flip.rindex('.')
+        except ValueError:
+            pass
+        else:
+            if to_flip[index + 1] in string.digits:
+                # doesnt handle case bone.1abc2 correct..., whatever
+                if not strip_number:
+                    number = to_flip[index:]
+                replace = to_flip[:index]
+
+    # first case; separator . - _ with extensions r R l L
+    if len(replace) > 1 and replace[-2] in separators:
+        is_set = replace[-1] in replacements
+        if is_set:
+            replace = replace[:-1] + replacements[replace[-1]]
+
+    # case; beginning with r R l L, with separator after it
+    if not is_set and len(replace) > 1 and replace[1] in separators:
+        is_set = replace[0] in replacements
+        if is_set:
+            replace = replacements[replace[0]] + replace[1:]
+
+    if not is_set:
+        lower = replace.lower()
+        if lower.startswith('right'):
+            bit = replace[0:2]
+            if bit == 'Ri':
+                prefix = 'Left'
+            elif bit == 'RI':
+                prefix = 'LEFT'
+            else:
+                prefix = 'left'
+            replace = replace[5:]
+        elif lower.startswith('left'):
+            bit = replace[0:2]
+            if bit == 'Le':
+                prefix = 'Right'
+            elif bit == 'LE':
+                prefix = 'RIGHT'
+            else:
+                prefix = 'right'
+            replace = replace[4:]
+        elif lower.endswith('right'):
+            bit = replace[-5:-3]
+            if bit == 'Ri':
+                suffix = 'Left'
+            elif bit == 'RI':
+                suffix = 'LEFT'
+            else:
+                suffix = 'left'
+            replace = replace[:-5]
+        elif lower.endswith('left'):
+            bit = replace[-4:-2]
+            if bit == 'Le':
+                suffix = 'Right'
+            elif bit == 'LE':
+                suffix = 'RIGHT'
+            else:
+                suffix = 'right'
+            replace = replace[:-4]
+
+    return prefix + replace + suffix + number
+
+
+def corpus() -> list:
+    """Return real bone names plus generated variations of side indicators."""
+    sides = ['', 'L', 'R', 'l', 'r', 'left', 'right', 'Left', 'Right', 'LEFT', 'RIGHT']
+    separators = ['', '.', '_', '-', ' ']
+    numbers = ['', '.001', '.12', '.1a', '1']
+    names = list(RIG_NAMES)
+    for side, separator, number in itertools.product(sides, separators, numbers):
+        names.append('arm%s%s%s' % (separator, side, number))
+        names.append('%s%sarm%s' % (side, separator, number))
+    names.extend(string.ascii_letters)
+    return names
+
+
+def rig_names(bone_count: int) -> list:
+    """Return the names of a rig; like real rigs, most bones come in pairs."""
+    names = []
+    for index in range(bone_count // 2):
+        base = RIG_NAMES[index % len(RIG_NAMES)] or 'bone'
+        names.append('%s_%d.L' % (base, index))
+        names.append('%s_%d.R' % (base, index))
+    return names
+
+
+def best_of(func, repeat=5) -> float:
+    return min(timeit.repeat(func, number=1, repeat=repeat))
+
+
+def flip_cold(names: list):
+    flip._flip_name.cache_clear()
+    return flip.names(names)
+
+
+def main():
+    names = corpus()
+    for strip_number in (False, True):
+        for bone_name in names:
+            assert flip.name(bone_name, strip_number) == original_name(bone_name, strip_number), \
+                (bone_name, strip_number)
+    print('%d names flipped identically by both implementations' % len(names))
+
+    names = rig_names(BONE_COUNT)
+    original = best_of(lambda: [original_name(bone_name) for bone_name in names])
+    cold = best_of(lambda: flip_cold(names))
+    warm = best_of(lambda: flip.names(names))
+    print('%d bones: original %.2f ms, memoized %.2f ms cold, %.2f ms warm'
+          % (BONE_COUNT, original * 1000, cold * 1000, warm * 1000))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,68 @@
+#!/usr/bin/env python3
+"""Micro-benchmark of flipping the pixels of a thumbnail.
+
+Compares flip.pixels_per_row(), the row-by-row slice assignment used before,
+with flip.pixels(), which reads and writes all pixels at once. Run from the
+root of the repository:
+
+    python benchmarks/flip_pixels.py
+
+Outside Blender the pixels are a Python list for the per-row version and a
+NumPy-backed stand-in for bpy_prop_array for the bulk version. Slicing a
+real bpy_prop_array is slower than slicing a list, so the speedup inside
+Blender is larger than measured here.
+"""
+
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from tests import blender_stubs  # noqa: E402
+
+blender_stubs.install()
+
+import numpy  # noqa: E402
+
+from pose_thumbnails import flip  # noqa: E402
+
+SIZES = (128, 256, 512)
+
+
+class PropArray:
+    """Stand-in for the bpy_prop_array of ImagePreview.image_pixels."""
+
+    def __init__(self, values):
+        self.values = numpy.array(values, dtype=numpy.int32)
+
+    def foreach_get(self, buffer):
+        buffer[:] = self.values
+
+    def foreach_set(self, buffer):
+        self.values[:] = buffer
+
+
+def best_of(func, repeat=5) -> float:
+    return min(timeit.repeat(func, number=1, repeat=repeat))
+
+
+def main():
+    print('%6s %14s %12s %8s' % ('size', 'per row [ms]', 'bulk [ms]', 'speedup'))
+    for size in SIZES:
+        original = list(range(size * size))
+
+        per_row = list(original)
+        flip.pixels_per_row(per_row, size, size)
+        bulk = PropArray(original)
+        flip.pixels(bulk, size, size)
+        assert bulk.values.tolist() == per_row
+
+        row_time = best_of(lambda: flip.pixels_per_row(per_row, size, size))
+        bulk_time = best_of(lambda: flip.pixels(bulk, size, size))
+        print('%6d %14.3f %12.3f %7.1fx' % (size, row_time * 1000, bulk_time * 1000,
+                                            row_time / bulk_time))
+
+
+if __name__ == '__main__':
+    main()
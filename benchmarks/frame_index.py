@@ -0,0 +1,75 @@
+#!/usr/bin/env python3
+"""Benchmark of looking up the thumbnail of every pose, as rebuilding the grid does.
+
+Compares the linear scan of the original get_thumbnail_from_pose() with the
+per-action FrameIndex. Run from the root of the repository:
+
+    python benchmarks/frame_index.py
+"""
+
+import array
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from tests import blender_stubs  # noqa: E402
+
+blender_stubs.install()
+
+from pose_thumbnails import common  # noqa: E402
+
+SIZES = (500, 1000, 2000, 4000)
+
+
+class Item:
+    def __init__(self, action, frame):
+        self.id_data = action
+        self.frame = frame
+
+
+class Collection(list):
+    def foreach_get(self, name, values):
+        values[:] = array.array(values.typecode, (getattr(item, name) for item in self))
+
+
+class Action:
+    def __init__(self, pose_count: int):
+        self.pose_markers = Collection(Item(self, frame) for frame in range(pose_count))
+        self.pose_thumbnails = Collection(Item(self, frame) for frame in range(pose_count))
+
+    def as_pointer(self) -> int:
+        return id(self)
+
+
+def linear_thumbnail_from_pose(pose):
+    """get_thumbnail_from_pose() before the frame index."""
+    for thumbnail in pose.id_data.pose_thumbnails:
+        if thumbnail.frame == pose.frame:
+            return thumbnail
+
+
+def rebuild(action: Action, thumbnail_from_pose):
+    # Clearing the cached thumbnails clears the frame index as well.
+    common.thumbnail_index.clear()
+    return [thumbnail_from_pose(pose) for pose in action.pose_markers]
+
+
+def best_of(func, repeat=5) -> float:
+    return min(timeit.repeat(func, number=1, repeat=repeat))
+
+
+def main():
+    print('%6s %12s %12s %8s' % ('poses', 'linear [ms]', 'index [ms]', 'speedup'))
+    for size in SIZES:
+        action = Action(size)
+        assert rebuild(action, linear_thumbnail_from_pose) == rebuild(
+            action, common.get_thumbnail_from_pose)
+        linear = best_of(lambda: rebuild(action, linear_thumbnail_from_pose), repeat=1)
+        indexed = best_of(lambda: rebuild(action, common.get_thumbnail_from_pose))
+        print('%6d %12.2f %12.3f %7.0fx' % (size, linear * 1000, indexed * 1000, linear / indexed))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,163 @@
+"""Thumbnail atlas files, packing all thumbnails of a pose library into one file.
+
+Opening a pose library with thousands of separate thumbnail files costs
+thousands of open/stat/decode calls, which dominates on network storage. An
+atlas file contains all thumbnails as raw, fixed-size tiles in the same
+pixel format as ImagePreview.image_pixels, so it can be memory-mapped and
+the previews filled straight from the mapped buffer.
+
+Layout (little endian):
+
+- header: magic b'PTAT', version, tile size in pixels, tile count
+- index: the pose frame of each tile, as int32
+- tiles: tile count * tile size * tile size pixels, each an int32 with RGBA bytes
+
+A thumbnail refers to a tile by appending '#<tile index>' to the path of the
+atlas file, for example '//poses.thumbatlas#12'.
+"""
+
+import logging
+import mmap
+import os
+import re
+import struct
+import threading
+import typing
+
+import bpy
+
+logger = logging.getLogger(__name__)
+
+ATLAS_EXTENSION = '.thumbatlas'
+ATLAS_MAGIC = b'PTAT'
+ATLAS_VERSION = 1
+ATLAS_HEADER = struct.Struct('<4sHxxII')  # magic, version, tile size, tile count
+TILE_PATH_RE = re.compile(r'^(.*%s)#(\d+)$' % re.escape(ATLAS_EXTENSION), re.IGNORECASE)
+
+
+def split_tile_path(path: str) -> typing.Tuple[str, typing.Optional[int]]:
+    """Split a thumbnail path into the file path and the tile index.
+
+    >>> split_tile_path('//poses.thumbatlas#12')
+    ('//poses.thumbatlas', 12)
+    >>> split_tile_path('//poses/smile.png')
+    ('//poses/smile.png', None)
+    """
+    match = TILE_PATH_RE.match(path)
+    if not match:
+        return path, None
+    return match.group(1), int(match.group(2))
+
+
+def tile_path(atlas_path: str, tile_index: int) -> str:
+    """Return the thumbnail path that refers to a tile of the atlas.
+
+    >>> tile_path('//poses.thumbatlas', 3)
+    '//poses.thumbatlas#3'
+    """
+    return '%s#%d' % (atlas_path, tile_index)
+
+
+class Atlas:
+    """A memory-mapped atlas file."""
+
+    def __init__(self, path: str):
+        with open(path, 'rb') as infile:
+            self._mmap = mmap.mmap(infile.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            magic, version, self.tile_size, self.tile_count = ATLAS_HEADER.unpack_from(self._mmap)
+        except struct.error:
+            magic = version = None
+        if magic != ATLAS_MAGIC or version != ATLAS_VERSION:
+            raise ValueError('%s is not a thumbnail atlas' % path)
+
+        self._tiles_offset = ATLAS_HEADER.size + 4 * self.tile_count
+        expected_size = self._tiles_offset + self.tile_count * self.tile_bytes
+        if len(self._mmap) < expected_size:
+            raise ValueError('%s is truncated' % path)
+        self._view = memoryview(self._mmap)
+
+    @property
+    def tile_bytes(self) -> int:
+        return 4 * self.tile_size * self.tile_size
+
+    def frames(self) -> typing.List[int]:
+        """Return the pose frame of each tile."""
+        return list(struct.unpack_from('<%di' % self.tile_count, self._mmap, ATLAS_HEADER.size))
+
+    def tile(self, tile_index: int) -> memoryview:
+        """Return the pixels of the tile, as int32 view on the mapped file."""
+        if not 0 <= tile_index < self.tile_count:
+            raise IndexError('tile %d out of range' % tile_index)
+        start = self._tiles_offset + tile_index * self.tile_bytes
+        return self._view[start:start + self.tile_bytes].cast('i')
+
+
+_atlases = {}  # {path: ((mtime in ns, size), Atlas)}
+_atlases_lock = threading.Lock()
+
+
+def open_atlas(path: str, stat: os.stat_result = None) -> Atlas:
+    """Return the memory-mapped atlas, reusing the mapping while the file is unchanged.
+
+    Can be called from any thread.
+    """
+    if stat is None:
+        stat = os.stat(path)
+    key = (stat.st_mtime_ns, stat.st_size)
+    with _atlases_lock:
+        try:
+            cached_key, atlas = _atlases[path]
+        except KeyError:
+            pass
+        else:
+            if cached_key == key:
+                return atlas
+        atlas = Atlas(path)
+        # Replaced mappings are closed when the last view on them is gone.
+        _atlases[path] = (key, atlas)
+        return atlas
+
+
+def forget_atlases():
+    with _atlases_lock:
+        _atlases.clear()
+
+
+def write_atlas(path: str, tile_size: int, tiles: typing.Sequence[typing.Tuple[int, bytes]]):
+    """Write an atlas file.
+
+    :param tiles: (pose frame, pixels) for each tile, where the pixels are
+        tile_size * tile_size RGBA bytes.
+    """
+    temp_path = path + '.tmp'
+    with open(temp_path, 'wb') as outfile:
+        outfile.write(ATLAS_HEADER.pack(ATLAS_MAGIC, ATLAS_VERSION, tile_size, len(tiles)))
+        outfile.write(struct.pack('<%di' % len(tiles), *(frame for frame, _ in tiles)))
+        for frame, pixels in tiles:
+            if len(pixels) != 4 * tile_size * tile_size:
+                raise ValueError('tile for frame %d has the wrong size' % frame)
+            outfile.write(pixels)
+    os.replace(temp_path, path)
+
+
+def image_to_tile(image: bpy.types.Image, tile_size: int) -> bytes:
+    """Scale the image to a tile and return its RGBA bytes.
+
+    The image is modified, so pass a temporary copy.
+    """
+    import numpy
+
+    image.scale(tile_size, tile_size)
+    floats = numpy.empty(4 * tile_size * tile_size, dtype=numpy.float32)
+    if hasattr(image.pixels, 'foreach_get'):
+        image.pixels.foreach_get(floats)
+    else:
+        floats[:] = image.pixels[:]
+    return (numpy.clip(floats, 0.0, 1.0) * 255.0 + 0.5).astype(numpy.uint8).tobytes()
+
+
+if __name__ == '__main__':
+    import doctest
+
+    doctest.testmod()
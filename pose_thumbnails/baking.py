@@ -0,0 +1,112 @@
+"""Baking a sequence of library poses onto the timeline.
+
+Blocking a shot means placing dozens of library poses at given frames.
+Instead of applying and auto-keying every pose at its frame, which needs a
+frame change per pose, all poses are evaluated from the pose library (see
+posetable.py) and their keyframes are written to the active action of the
+armature in one pass per F-Curve.
+
+Poses that are baked with a mix factor below 1 are mixed over the action
+as it was before baking, evaluated at the frame of the pose. Bones that
+aren't animated by the action are mixed over their current pose.
+"""
+
+import collections
+import logging
+import typing
+
+import bpy
+
+from . import blending, common, evaluation, keying, posetable, profiling, snapshot
+
+logger = logging.getLogger(__name__)
+
+# A pose to bake: the frame to key it on, the index or name of the pose
+# marker, whether to mirror it over the YZ-plane, and the mix factor (1.0
+# bakes the pose as-is).
+BakeEntry = collections.namedtuple('BakeEntry', ['frame', 'pose', 'flipped', 'factor'])
+
+
+def _bones_of_pose(armature_ob: bpy.types.Object, layout: evaluation.LibraryLayout,
+                   index: int, flipped: bool) -> typing.List[bpy.types.PoseBone]:
+    """Return the pose bones that the pose moves."""
+    all_pose_bones = armature_ob.pose.bones
+    bone_names = layout.pose_masks[index]
+    if flipped:
+        bone_indices = snapshot.mirrored_indices(armature_ob, bone_names)
+    else:
+        bone_indices = snapshot.bone_indices(armature_ob, bone_names)
+    return [all_pose_bones[bone_index] for bone_index in bone_indices]
+
+
+def _action_fcurves(armature_ob: bpy.types.Object, action: typing.Optional[bpy.types.Action]) \
+        -> typing.List[typing.Tuple[bpy.types.FCurve, str, str]]:
+    """Return (F-Curve, bone name, channel) of the unmuted bone F-Curves of the action.
+
+    The action is parsed directly instead of through
+    evaluation.library_layout(), as it isn't a pose library and baking
+    changes it anyway.
+    """
+    if action is None:
+        return []
+    all_bone_names = snapshot.skeleton(armature_ob)
+    fcurves = []
+    for fcurve in action.fcurves:
+        if fcurve.mute:
+            continue
+        parsed = evaluation.split_bone_path(fcurve.data_path)
+        if parsed is None:
+            continue
+        bone_name, bone_index, channel = parsed
+        if bone_name is None:
+            if bone_index >= len(all_bone_names):
+                continue
+            bone_name = all_bone_names[bone_index]
+        fcurves.append((fcurve, bone_name, channel))
+    return fcurves
+
+
+def _action_values(action_fcurves: typing.Iterable[typing.Tuple[bpy.types.FCurve, str, str]],
+                   frame: float, bone_names: typing.AbstractSet[str]) -> evaluation.PoseValues:
+    """Evaluate the F-Curves of the bones, see _action_fcurves()."""
+    entries = [(bone_name, channel, fcurve.array_index, fcurve.evaluate(frame))
+               for fcurve, bone_name, channel in action_fcurves
+               if bone_name in bone_names]
+    return evaluation.PoseValues.from_entries(entries)
+
+
+@profiling.timed('baking.bake_poses')
+def bake_poses(armature_ob: bpy.types.Object,
+               entries: typing.Iterable[BakeEntry]) -> int:
+    """Key the poses of the armature's pose library at their frames.
+
+    Keyframes are written to the active action of the armature, which is
+    created when necessary. The armature itself isn't changed.
+
+    :returns: the number of inserted keyframes.
+    :raises ValueError: when an entry refers to a pose that doesn't exist.
+    """
+    poselib = armature_ob.pose_library
+    layout = evaluation.library_layout(poselib, armature_ob)
+    anim_data = armature_ob.animation_data
+    action = anim_data.action if anim_data is not None else None
+    # Parsed once per bake, instead of once per mixed pose.
+    action_fcurves = _action_fcurves(armature_ob, action)
+
+    sequence = []
+    for entry in entries:
+        index = common.pose_index(poselib, entry.pose)
+        pose_bones = _bones_of_pose(armature_ob, layout, index, entry.flipped)
+        pose_values = posetable.pose_tables.pose_values(poselib, index, armature_ob)
+        pose = snapshot.capture(armature_ob, pose_bones, flipped=entry.flipped,
+                                pose_values=pose_values)
+        if entry.factor < 1.0:
+            action_values = _action_values(action_fcurves, entry.frame,
+                                           {pose_bone.name for pose_bone in pose_bones})
+            base = snapshot.capture(armature_ob, pose_bones, pose_values=action_values)
+            pose = blending.PoseMix(base, pose)(entry.factor)
+        sequence.append((entry.frame, keying.pose_keyframes(pose)))
+
+    inserted = keying.insert_keyframe_sequence(armature_ob, sequence)
+    logger.debug('Baked %d poses into %d keyframes', len(sequence), inserted)
+    return inserted
@@ -0,0 +1,309 @@
+"""Mixing of pose snapshots, vectorized over all bones.
+
+Blending matrices element by element shears and shrinks the rotation at
+intermediate factors, so poses are mixed per channel instead: locations and
+scales are interpolated linearly and rotations with a spherical linear
+interpolation of their quaternions. This is what Matrix.lerp() does per
+bone, but here it is done for all bones at once with numpy.
+
+While the mix factor slider is dragged, the same two poses are mixed over
+and over again. PoseMix does all the work that doesn't depend on the factor
+(matching bones and properties, the angles between the rotations) once.
+
+PoseBlend blends any number of poses over a base pose, each with its own
+weight, for building expressions out of several partial poses. Rotations
+are averaged as quaternions: they are flipped to the hemisphere of the base
+rotation, summed with their weights and normalized. For weights that don't
+differ too much this is very close to repeated slerps, and it doesn't
+depend on the order of the poses.
+"""
+
+import collections
+import logging
+import typing
+
+import numpy
+
+from . import snapshot
+
+logger = logging.getLogger(__name__)
+
+SLERP_LINEAR_THRESHOLD = 0.9995
+"""Above this dot product, quaternions are so close that slerp is replaced by nlerp."""
+
+
+def slerp(quats_a: numpy.ndarray, quats_b: numpy.ndarray, factor: float) -> numpy.ndarray:
+    """Spherical linear interpolation of (N, 4) arrays of unit quaternions.
+
+    Takes the shortest path, just like mathutils.Quaternion.slerp().
+
+    >>> a = numpy.array([[1.0, 0.0, 0.0, 0.0]])
+    >>> b = numpy.array([[0.0, 0.0, 0.0, 1.0]])
+    >>> numpy.round(slerp(a, b, 0.5), 4).tolist()
+    [[0.7071, 0.0, 0.0, 0.7071]]
+    >>> c = numpy.array([[-0.7071, 0.0, 0.0, -0.7071]])  # same rotation as q = -c
+    >>> numpy.round(slerp(a, c, 1.0), 4).tolist()
+    [[0.7071, 0.0, 0.0, 0.7071]]
+    >>> numpy.round(slerp(a, a, 0.3), 4).tolist()
+    [[1.0, 0.0, 0.0, 0.0]]
+    """
+    return QuaternionSlerp(quats_a, quats_b)(factor)
+
+
+class QuaternionSlerp:
+    """Slerp between two (N, 4) arrays of quaternions, for any factor."""
+
+    def __init__(self, quats_a: numpy.ndarray, quats_b: numpy.ndarray):
+        quats_a = numpy.asarray(quats_a, dtype=numpy.float64)
+        quats_b = numpy.array(quats_b, dtype=numpy.float64)
+        dots = numpy.einsum('ij,ij->i', quats_a, quats_b)
+        # q and -q are the same rotation; take the shortest path.
+        negative = dots < 0
+        quats_b[negative] *= -1
+        dots = numpy.abs(dots)
+
+        self.quats_a = quats_a
+        self.quats_b = quats_b
+        self.linear = dots > SLERP_LINEAR_THRESHOLD
+        self.angles = numpy.arccos(numpy.clip(dots, -1.0, 1.0))
+        self.sin_angles = numpy.sin(self.angles)
+        self.sin_angles[self.linear] = 1.0  # unused, prevents division by zero
+
+    def __call__(self, factor: float) -> numpy.ndarray:
+        weights_a = numpy.sin((1.0 - factor) * self.angles) / self.sin_angles
+        weights_b = numpy.sin(factor * self.angles) / self.sin_angles
+        weights_a[self.linear] = 1.0 - factor
+        weights_b[self.linear] = factor
+
+        result = weights_a[:, None] * self.quats_a + weights_b[:, None] * self.quats_b
+        if self.linear.any():
+            lengths = numpy.linalg.norm(result[self.linear], axis=1)
+            result[self.linear] /= lengths[:, None]
+        return result
+
+
+class PoseMix:
+    """Mixes pose_b over pose_a, for any mix factor.
+
+    Bones and properties that are only in pose_a keep their value. Float
+    custom properties are interpolated; other custom properties switch from
+    pose_a to pose_b at factor 0.5.
+    """
+
+    def __init__(self, pose_a: snapshot.PoseSnapshot, pose_b: snapshot.PoseSnapshot):
+        self.pose_a = pose_a
+        self.pose_b = pose_b
+        self.mixed = pose_a.copy()
+
+        rows_a, rows_b = pose_a.rows_matching(pose_b)
+        self.rows = rows_a
+        self.location_a = pose_a.location[rows_a]
+        self.location_delta = pose_b.location[rows_b] - self.location_a
+        self.scale_a = pose_a.scale[rows_a]
+        self.scale_delta = pose_b.scale[rows_b] - self.scale_a
+        self.rotation = QuaternionSlerp(pose_a.rotation[rows_a], pose_b.rotation[rows_b])
+
+        props_b = {(pose_b.bone_indices[row], key): index
+                   for index, (row, key) in enumerate(pose_b.prop_keys)}
+        pairs = [(index, props_b[pose_a.bone_indices[row], key])
+                 for index, (row, key) in enumerate(pose_a.prop_keys)
+                 if (pose_a.bone_indices[row], key) in props_b]
+        matched_a = numpy.array([index_a for index_a, _ in pairs], dtype=numpy.intp)
+        matched_b = numpy.array([index_b for _, index_b in pairs], dtype=numpy.intp)
+        is_float = pose_a.prop_is_float[matched_a]
+        self.float_props = matched_a[is_float]
+        self.float_values_a = pose_a.prop_values[self.float_props]
+        self.float_values_delta = pose_b.prop_values[matched_b[is_float]] - self.float_values_a
+        self.stepped_props = matched_a[~is_float]
+        self.stepped_values_b = pose_b.prop_values[matched_b[~is_float]]
+
+        others_b = {(pose_b.bone_indices[row], key): value
+                    for row, key, value in pose_b.other_props}
+        self.other_props_b = [
+            (row, key, others_b.get((pose_a.bone_indices[row], key), value))
+            for row, key, value in pose_a.other_props
+        ]
+
+    def __call__(self, factor: float) -> snapshot.PoseSnapshot:
+        """Return the mixed pose.
+
+        The returned snapshot is reused by the next call.
+        """
+        mixed = self.mixed
+        mixed.location[self.rows] = self.location_a + factor * self.location_delta
+        mixed.scale[self.rows] = self.scale_a + factor * self.scale_delta
+        mixed.rotation[self.rows] = self.rotation(factor)
+
+        mixed.prop_values[self.float_props] = (self.float_values_a +
+                                               factor * self.float_values_delta)
+        if factor >= 0.5:
+            mixed.prop_values[self.stepped_props] = self.stepped_values_b
+            mixed.other_props = self.other_props_b
+        else:
+            mixed.prop_values[self.stepped_props] = self.pose_a.prop_values[self.stepped_props]
+            mixed.other_props = self.pose_a.other_props
+        return mixed
+
+
+class PoseBlend:
+    """Blends several poses over a base pose, for any combination of weights.
+
+    Each pose gets a weight from 0 to 1; the base pose gets what is left of
+    1. When the weights of the poses add up to more than 1, they are scaled
+    down so that the base pose gets none. This is done per bone, only
+    counting the poses that apply to the bone: poses only apply to the bones
+    they share with the base pose, and with a mask, only to the bones in
+    the mask.
+
+    Float custom properties are blended like the transforms; other custom
+    properties take the value of the pose with the largest weight on the
+    bone.
+
+    Masks are given per pose, as the indices in armature.pose.bones of the
+    bones that the pose applies to, or None to apply to all bones.
+    """
+
+    def __init__(self, base: snapshot.PoseSnapshot,
+                 poses: typing.Sequence[snapshot.PoseSnapshot],
+                 masks: typing.Sequence[typing.Optional[typing.Iterable[int]]] = None):
+        count = len(poses) + 1  # the base pose is the first one
+        self.base = base
+        self.blended = base.copy()
+
+        # (pose, bone, channel) arrays with the values of the base pose for
+        # bones that a pose doesn't have.
+        self.location = numpy.repeat(base.location[None], count, axis=0)
+        self.scale = numpy.repeat(base.scale[None], count, axis=0)
+        self.rotation = numpy.repeat(base.rotation[None], count, axis=0).astype(numpy.float64)
+        self.applies = numpy.zeros((count - 1, len(base)), dtype=bool)
+
+        self.prop_values = numpy.repeat(base.prop_values[None], count, axis=0)
+        self.prop_applies = numpy.zeros((count - 1, len(base.prop_keys)), dtype=bool)
+        self.other_props = []  # type: typing.List[typing.Dict[typing.Tuple[int, str], typing.Any]]
+
+        for index, pose in enumerate(poses):
+            rows, pose_rows = base.rows_matching(pose)
+            if masks is not None and masks[index] is not None:
+                mask = set(masks[index])
+                in_mask = numpy.array([bone_index in mask
+                                       for bone_index in base.bone_indices[rows].tolist()],
+                                      dtype=bool)
+                rows, pose_rows = rows[in_mask], pose_rows[in_mask]
+            self.location[index + 1, rows] = pose.location[pose_rows]
+            self.scale[index + 1, rows] = pose.scale[pose_rows]
+            self.rotation[index + 1, rows] = pose.rotation[pose_rows]
+            self.applies[index, rows] = True
+
+            prop_indices = {(pose.bone_indices[row], key): prop_index
+                            for prop_index, (row, key) in enumerate(pose.prop_keys)}
+            for prop_index, (row, key) in enumerate(base.prop_keys):
+                pose_prop_index = prop_indices.get((base.bone_indices[row], key))
+                if pose_prop_index is not None and self.applies[index, row]:
+                    self.prop_values[index + 1, prop_index] = pose.prop_values[pose_prop_index]
+                    self.prop_applies[index, prop_index] = True
+            self.other_props.append({(pose.bone_indices[row], key): value
+                                     for row, key, value in pose.other_props})
+
+        # q and -q are the same rotation; average them on the side of the base.
+        dots = numpy.einsum('pbi,bi->pb', self.rotation, self.rotation[0])
+        self.rotation[dots < 0] *= -1
+
+    @staticmethod
+    def _pose_weights(weights: numpy.ndarray, applies: numpy.ndarray) -> numpy.ndarray:
+        """Return (pose, column) weights, including the base pose, that add up to 1."""
+        pose_weights = weights[:, None] * applies
+        totals = pose_weights.sum(axis=0)
+        overweight = totals > 1.0
+        pose_weights[:, overweight] /= totals[overweight]
+        base_weights = 1.0 - pose_weights.sum(axis=0)
+        return numpy.vstack((base_weights[None], pose_weights))
+
+    def __call__(self, weights: typing.Sequence[float]) -> snapshot.PoseSnapshot:
+        """Return the blended pose, for the weights of the poses.
+
+        The returned snapshot is reused by the next call.
+        """
+        weights = numpy.clip(numpy.asarray(weights, dtype=numpy.float64), 0.0, None)
+        blended = self.blended
+        if not len(blended):
+            return blended
+
+        bone_weights = self._pose_weights(weights, self.applies)
+        blended.location[:] = numpy.einsum('pb,pbc->bc', bone_weights, self.location)
+        blended.scale[:] = numpy.einsum('pb,pbc->bc', bone_weights, self.scale)
+        rotation = numpy.einsum('pb,pbc->bc', bone_weights, self.rotation)
+        lengths = numpy.linalg.norm(rotation, axis=1)
+        # Opposite rotations with equal weights cancel out; keep the base rotation.
+        degenerate = lengths < 1e-6
+        rotation[degenerate] = self.rotation[0, degenerate]
+        lengths[degenerate] = 1.0
+        blended.rotation[:] = rotation / lengths[:, None]
+
+        if len(blended.prop_keys):
+            prop_weights = self._pose_weights(weights, self.prop_applies)
+            is_float = self.base.prop_is_float
+            blended.prop_values[is_float] = numpy.einsum(
+                'pn,pn->n', prop_weights[:, is_float], self.prop_values[:, is_float])
+            strongest = prop_weights[:, ~is_float].argmax(axis=0)
+            blended.prop_values[~is_float] = self.prop_values[:, ~is_float][
+                strongest, numpy.arange(len(strongest))]
+
+        strongest = bone_weights.argmax(axis=0)
+        bone_indices = self.base.bone_indices
+        blended.other_props = [
+            (row, key, self.other_props[strongest[row] - 1].get((bone_indices[row], key), value)
+             if strongest[row] else value)
+            for row, key, value in self.base.other_props
+        ]
+        return blended
+
+
+def blend(base: snapshot.PoseSnapshot,
+          poses: typing.Sequence[snapshot.PoseSnapshot],
+          weights: typing.Sequence[float],
+          masks: typing.Sequence[typing.Optional[typing.Iterable[int]]] = None) \
+        -> snapshot.PoseSnapshot:
+    """Return the poses blended over the base pose with the given weights.
+
+    See PoseBlend, which should be used instead when blending the same poses
+    with different weights.
+    """
+    return PoseBlend(base, poses, masks)(weights).copy()
+
+
+MIX_CACHE_SIZE = 256
+"""Number of PoseMix objects kept; one per armature that is being mixed."""
+
+_mixes = collections.OrderedDict()  # {(id(pose_a), id(pose_b)): PoseMix}
+
+
+def mix(pose_a: snapshot.PoseSnapshot,
+        pose_b: snapshot.PoseSnapshot,
+        factor: float) -> snapshot.PoseSnapshot:
+    """Return pose_b mixed over pose_a with the given factor.
+
+    The PoseMix of recently mixed poses is kept, so that repeatedly mixing
+    the same poses with different factors (the mix slider) is cheap, also
+    when the poses of several armatures are mixed at once.
+    """
+    # The PoseMix holds on to both poses, so their ids aren't reused while cached.
+    key = (id(pose_a), id(pose_b))
+    pose_mix = _mixes.get(key)
+    if pose_mix is None:
+        pose_mix = _mixes[key] = PoseMix(pose_a, pose_b)
+        if len(_mixes) > MIX_CACHE_SIZE:
+            _mixes.popitem(last=False)
+    else:
+        _mixes.move_to_end(key)
+    return pose_mix(factor)
+
+
+def forget_mixes():
+    """Release the poses of all kept PoseMix objects."""
+    _mixes.clear()
+
+
+if __name__ == '__main__':
+    import doctest
+
+    doctest.testmod()
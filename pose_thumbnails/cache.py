@@ -1,5 +1,8 @@
+import collections
 import functools
 
+from . import profiling
+
 
 def pyside_cache(propname):
     """Decorator, stores the result of the decorated callable in Python-managed memory.
@@ -18,6 +21,8 @@ def pyside_cache(propname):
         https://www.blender.org/api/blender_python_api_master/bpy.props.html#bpy.props.EnumProperty
         """
 
+        counter_name = 'pyside_cache.%s' % wrapped.__name__
+
         @functools.wraps(wrapped)
         # We can't use (*args, **kwargs), because EnumProperty explicitly checks
         # for the number of fixed positional arguments.
@@ -28,6 +33,10 @@ def pyside_cache(propname):
                 return result
             finally:
                 rna_type, rna_info = getattr(self.bl_rna, propname)
+                if profiling.enabled:
+                    # A hit means the callable returned the same object as last time.
+                    reused = rna_info.get('_cached_result') is result
+                    profiling.count('%s.%s' % (counter_name, 'hits' if reused else 'misses'))
                 rna_info['_cached_result'] = result
 
         return wrapper
@@ -35,40 +44,73 @@ def pyside_cache(propname):
     return decorator
 
 
-def lru_cache_1arg(wrapped):
-    """Decorator, caches return value as long as the 1st arg doesn't change.
+def lru_cache_datablock(maxsize=8):
+    """Decorator, caches return values keyed on the 1st arg and the keyword args.
 
     The 1st arg MUST be a DNA datablock (e.g. have an as_pointer() function).
+    Keyword arguments are part of the cache key and must be hashable; other
+    positional arguments are not. At most `maxsize` results are kept, the least
+    recently used one is evicted first.
     """
 
-    cached_value = ...
-    cached_arg = ...
-
-    def cache_clear():
-        nonlocal cached_value, cached_arg
-        cached_value = ...
-        cached_arg = ...
+    if callable(maxsize):
+        raise TypeError('Usage: lru_cache_datablock(maxsize)')
 
-    @functools.wraps(wrapped)
-    def wrapper(*args, **kwargs):
-        nonlocal cached_value, cached_arg
+    def decorator(wrapped):
+        cached = collections.OrderedDict()
+        limit = maxsize
+        hits_name = 'lru_cache_datablock.%s.hits' % wrapped.__name__
+        misses_name = 'lru_cache_datablock.%s.misses' % wrapped.__name__
 
-        if cached_value is not ... and len(args) and args[0].as_pointer() == cached_arg:
-            return cached_value
+        def cache_clear():
+            cached.clear()
 
-        try:
-            result = wrapped(*args, **kwargs)
-        except:
-            cache_clear()
-            raise
+        def cache_resize(new_maxsize: int):
+            nonlocal limit
+            limit = max(1, new_maxsize)
+            while len(cached) > limit:
+                cached.popitem(last=False)
 
-        if len(args):
-            cached_value = result
-            cached_arg = args[0].as_pointer()
-        else:
-            cache_clear()
+        @functools.wraps(wrapped)
+        def wrapper(datablock, *args, **kwargs):
+            key = (datablock.as_pointer(), tuple(sorted(kwargs.items())))
+            try:
+                result = cached[key]
+            except KeyError:
+                profiling.count(misses_name)
+            else:
+                profiling.count(hits_name)
+                cached.move_to_end(key)
+                return result
 
-        return result
+            result = wrapped(datablock, *args, **kwargs)
+            cached[key] = result
+            while len(cached) > limit:
+                cached.popitem(last=False)
+            return result
+
+        def cache_entries(datablock) -> list:
+            """Return [(kwargs, result), ...] of the cached results for the datablock."""
+            pointer = datablock.as_pointer()
+            return [(dict(kwargs), result)
+                    for (key_pointer, kwargs), result in cached.items()
+                    if key_pointer == pointer]
+
+        def cache_values() -> list:
+            """Return all cached results, least recently used first."""
+            return list(cached.values())
+
+        def cache_discard(datablock):
+            """Forget all cached results for the datablock."""
+            pointer = datablock.as_pointer()
+            for key in [key for key in cached if key[0] == pointer]:
+                del cached[key]
+
+        wrapper.cache_clear = cache_clear
+        wrapper.cache_entries = cache_entries
+        wrapper.cache_values = cache_values
+        wrapper.cache_discard = cache_discard
+        wrapper.cache_resize = cache_resize
+        return wrapper
 
-    wrapper.cache_clear = cache_clear
-    return wrapper
+    return decorator
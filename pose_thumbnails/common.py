@@ -1,9 +1,124 @@
 """Code used both by creation.py and pose_thumbnails.py"""
 
+import array
+import logging
 import os.path
+import typing
 
 import bpy
 
+logger = logging.getLogger(__name__)
+
+
+class FrameIndex:
+    """Per-action mapping from frame number to position in a collection.
+
+    Works for any collection property of an Action whose items have a 'frame'
+    property (pose_markers, pose_thumbnails). When several items share a
+    frame, the first one wins, just like a linear scan would.
+
+    The mapping is rebuilt when the length of the collection changes. Every
+    hit is verified against the actual item, and on a miss the frames of
+    all items are read in one go and compared with the indexed ones, so
+    adding, removing or re-framing items can never return the wrong item.
+    """
+
+    def __init__(self, collection_name: str):
+        self.collection_name = collection_name
+        # {action pointer: (frames of the items, {frame: index})}
+        self._indices = {}  # type: typing.Dict[int, typing.Tuple[array.array, dict]]
+
+    def _read_frames(self, action: bpy.types.Action) -> array.array:
+        collection = getattr(action, self.collection_name)
+        frames = array.array('i', [0]) * len(collection)
+        collection.foreach_get('frame', frames)
+        return frames
+
+    def _rebuild(self, action: bpy.types.Action, frames: array.array = None) -> dict:
+        if frames is None:
+            frames = self._read_frames(action)
+        positions = {}
+        for index, frame in enumerate(frames):
+            positions.setdefault(frame, index)
+        self._indices[action.as_pointer()] = (frames, positions)
+        return positions
+
+    def _positions(self, action: bpy.types.Action) -> dict:
+        collection = getattr(action, self.collection_name)
+        try:
+            frames, positions = self._indices[action.as_pointer()]
+        except KeyError:
+            return self._rebuild(action)
+        if len(frames) != len(collection):
+            return self._rebuild(action)
+        return positions
+
+    def index(self, action: bpy.types.Action, frame: int):
+        """Return the index of the item with the given frame, or None."""
+        if action is None:
+            return None
+        collection = getattr(action, self.collection_name)
+        index = self._positions(action).get(frame)
+        if index is not None:
+            if collection[index].frame != frame:
+                index = self._rebuild(action).get(frame)
+            return index
+
+        # Re-framed items don't change the length of the collection.
+        indexed_frames = self._indices[action.as_pointer()][0]
+        frames = self._read_frames(action)
+        if frames != indexed_frames:
+            index = self._rebuild(action, frames).get(frame)
+        return index
+
+    def get(self, action: bpy.types.Action, frame: int):
+        """Return the item with the given frame, or None."""
+        index = self.index(action, frame)
+        if index is None:
+            return None
+        return getattr(action, self.collection_name)[index]
+
+    def item_added(self, action: bpy.types.Action):
+        """Update the index after an item was appended to the collection.
+
+        The frame of the new item should already be set. This keeps batch
+        additions linear instead of rebuilding the index for every item.
+        """
+        collection = getattr(action, self.collection_name)
+        try:
+            frames, positions = self._indices[action.as_pointer()]
+        except KeyError:
+            return
+        if len(frames) != len(collection) - 1:
+            del self._indices[action.as_pointer()]
+            return
+        frame = collection[len(frames)].frame
+        positions.setdefault(frame, len(frames))
+        frames.append(frame)
+
+    def clear(self):
+        self._indices.clear()
+
+
+thumbnail_index = FrameIndex('pose_thumbnails')
+pose_marker_index = FrameIndex('pose_markers')
+
+
+def pose_index(poselib: bpy.types.Action, pose: typing.Union[int, str]) -> int:
+    """Return the index of the pose, given its index or name.
+
+    :raises ValueError: when the pose library has no such pose.
+    """
+    pose_markers = poselib.pose_markers
+    if isinstance(pose, int):
+        if not 0 <= pose < len(pose_markers):
+            raise ValueError('Pose library %r has no pose %d' % (poselib.name, pose))
+        return pose
+    index = pose_markers.find(pose)
+    if index < 0:
+        raise ValueError('Pose library %r has no pose %r' % (poselib.name, pose))
+    return index
+
 
 def get_thumbnail_from_pose(pose: bpy.types.TimelineMarker):
     """Get the thumbnail that belongs to the pose.
@@ -16,10 +131,23 @@ def get_thumbnail_from_pose(pose: bpy.types.TimelineMarker):
     """
     if pose is None:
         return
+    return thumbnail_index.get(pose.id_data, pose.frame)
+
+
+def set_thumbnail(pose: bpy.types.TimelineMarker, filepath: str):
+    """Create or update the thumbnail of the pose.
+
+    Returns:
+        thumbnail PropertyGroup
+    """
     poselib = pose.id_data
-    for thumbnail in poselib.pose_thumbnails:
-        if thumbnail.frame == pose.frame:
-            return thumbnail
+    thumbnail = get_thumbnail_from_pose(pose)
+    if thumbnail is None:
+        thumbnail = poselib.pose_thumbnails.add()
+        thumbnail.frame = pose.frame
+        thumbnail_index.item_added(poselib)
+    thumbnail.filepath = filepath
+    return thumbnail
 
 
 def get_no_thumbnail_path() -> str:
@@ -32,12 +160,90 @@ def get_no_thumbnail_path() -> str:
     return no_thumbnail_path
 
 
+def get_thumbnail_abspath(poselib: bpy.types.Action, filepath: str) -> str:
+    """Get the normalized absolute path of a thumbnail of the pose library."""
+    from .manifest import for_poselib
+
+    return for_poselib(poselib).abspath(poselib, filepath)
+
+
+def update_cached_pose_thumbnails(poselib: bpy.types.Action,
+                                  frames: typing.Iterable[int],
+                                  *, reload_paths: typing.Iterable[str] = ()):
+    """Update the cached thumbnails of the poses at the given frames.
+
+    Images at reload_paths that changed on disk are reloaded first.
+    """
+    from .atlas import split_tile_path
+    from .core import preview_collections, reload_image, update_enum_items
+    from .manifest import forget_stat
+    from .watcher import thumbnail_watcher
+
+    thumbnail_watcher.forget()
+    pcoll = preview_collections['pose_library']
+    for filepath in set(reload_paths):
+        abspath = get_thumbnail_abspath(poselib, filepath)
+        forget_stat(split_tile_path(abspath)[0])
+        reload_image(pcoll, abspath)
+    update_enum_items(poselib, frames)
+
+
+def refresh_cached_pose_thumbnails(poselib: bpy.types.Action):
+    """Reload the changed images of the pose library and rebuild its enum items."""
+    from .atlas import split_tile_path
+    from .core import get_enum_items, preview_collections, reload_image
+    from .manifest import forget_stat
+    from .watcher import thumbnail_watcher
+
+    thumbnail_watcher.forget()
+    pcoll = preview_collections['pose_library']
+    abspaths = {get_thumbnail_abspath(poselib, thumbnail.filepath)
+                for thumbnail in poselib.pose_thumbnails}
+    # The images that aren't loaded yet are checked again when they are loaded.
+    for abspath in abspaths:
+        forget_stat(split_tile_path(abspath)[0])
+    reloaded = sum(reload_image(pcoll, abspath) for abspath in abspaths)
+    get_enum_items.cache_discard(poselib)
+    logger.debug('Reloaded %d of %d images of %s', reloaded, len(abspaths), poselib.name)
+
+
+def discard_cached_pose_thumbnails(poselib: bpy.types.Action):
+    """Forget the cached enum items of the pose library."""
+    from .core import get_enum_items, get_shown_poses
+    from .watcher import thumbnail_watcher
+
+    thumbnail_watcher.forget()
+    get_shown_poses.cache_discard(poselib)
+    get_enum_items.cache_discard(poselib)
+
+
 def clear_cached_pose_thumbnails(*, full_clear=False):
     """Clear the cache of get_enum_items()."""
-    from .core import get_enum_items, preview_collections
+    from .atlas import forget_atlases
+    from .core import get_enum_items, get_shown_poses, loaded_image_stats, preview_collections
+    from .evaluation import forget_layouts
+    from .loader import thumbnail_loader
+    from .manifest import forget_manifests, save_manifests
+    from .posetable import pose_tables
+    from .snapshot import forget_skeletons
+    from .store import preview_store
+
+    # Pending loads would patch enum items that are about to be discarded.
+    thumbnail_loader.cancel()
 
     if full_clear:
         pcoll = preview_collections['pose_library']
         pcoll.clear()
+        loaded_image_stats.clear()
+        forget_atlases()
+        preview_store.clear()
+        save_manifests()
+        forget_manifests()
+        pose_tables.clear()
+        forget_layouts()
+        forget_skeletons()
 
+    thumbnail_index.clear()
+    pose_marker_index.clear()
+    get_shown_poses.cache_clear()
     get_enum_items.cache_clear()
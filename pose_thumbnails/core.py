@@ -1,8 +1,9 @@
 """This module does the actual work for the pose thumbnails addon."""
 
+import array
+import collections
 import logging
 import os
-import re
 import typing
 
 if 'bpy' in locals():
@@ -11,24 +12,47 @@ if 'bpy' in locals():
     if 'prefs' in locals():
         importlib.reload(prefs)
         cache = importlib.reload(cache)
+        atlas = importlib.reload(atlas)
+        manifest = importlib.reload(manifest)
+        evaluation = importlib.reload(evaluation)
+        posetable = importlib.reload(posetable)
+        snapshot = importlib.reload(snapshot)
+        keying = importlib.reload(keying)
+        baking = importlib.reload(baking)
+        blending = importlib.reload(blending)
+        proxies = importlib.reload(proxies)
+        loader = importlib.reload(loader)
+        watcher = importlib.reload(watcher)
+        store = importlib.reload(store)
+        profiling = importlib.reload(profiling)
         flip = importlib.reload(flip)
         creation = importlib.reload(creation)
         common = importlib.reload(common)
 else:
-    from . import prefs, cache, flip, creation, common
+    from . import (prefs, cache, flip, creation, common, proxies, loader, watcher, atlas, store,
+                   profiling, manifest, snapshot, blending, evaluation, posetable,
+                   keying, baking)
 import bpy
 import bpy.utils.previews
+from bpy_extras.io_utils import ExportHelper
 
 logger = logging.getLogger(__name__)
 preview_collections = {}
-bone_name_re = re.compile(r'^pose.bones\[([^\]]+)\]')
+FLIPPED_SUFFIX = '@flipped'
+MIX_UPDATE_INTERVAL = 1 / 60
+"""Seconds between updates of the armature while the mix factor is dragged."""
+MIX_FACTOR_EPSILON = 0.001
+"""Changes of the mix factor smaller than this are not applied while dragging."""
+RELOAD_SUFFIX = '@reload'
+
+# {absolute path: (mtime in ns, size)} of the images in the preview collection,
+# at the moment they were loaded.
+loaded_image_stats = {}
 
 
 def get_pose_index_from_frame(poselib, frame):
     """Get the pose index of the pose with the specified frame."""
-    for i, pose in enumerate(poselib.pose_markers):
-        if pose.frame == frame:
-            return i
+    return common.pose_marker_index.index(poselib, frame)
 
 
 def get_no_thumbnail_image(pcoll):
@@ -63,38 +87,173 @@ def get_placeholder_image(pcoll):
     return placeholder
 
 
-@cache.lru_cache_1arg
+@cache.lru_cache_datablock(maxsize=10)
+def get_shown_poses(poselib: bpy.types.Action, *, show_all_poses: bool) -> typing.List[int]:
+    """Return the indices of the poses that are shown in the thumbnail grid.
+
+    This is cheap compared to get_enum_items(), as no images are loaded, and
+    is used to determine which poses are on which page.
+    """
+    return [pose_index for pose_index, pose in enumerate(poselib.pose_markers)
+            if show_all_poses or common.get_thumbnail_from_pose(pose)]
+
+
+def get_page_count(poselib: bpy.types.Action, ui_settings) -> int:
+    """Return the number of thumbnail pages, which is 1 when paging is disabled."""
+    if not ui_settings.page_size:
+        return 1
+    shown_poses = get_shown_poses(poselib, show_all_poses=ui_settings.options.show_all_poses)
+    return max(1, -(-len(shown_poses) // ui_settings.page_size))
+
+
+@cache.lru_cache_datablock(maxsize=10)
+@profiling.timed('get_enum_items')
 def get_enum_items(poselib: bpy.types.Action,
-                   pcoll: bpy.utils.previews.ImagePreviewCollection):
-    """Return the enum items for the thumbnail previews."""
+                   pcoll: bpy.utils.previews.ImagePreviewCollection,
+                   *, show_all_poses: bool, flipped: bool, page: int, page_size: int):
+    """Return the enum items for the thumbnail previews.
+
+    When page_size is non-zero, only the items of that page are returned
+    and the images of the next page are prefetched.
+
+    Cached per pose library and option state, see PoseThumbnailsPreferences.enum_cache_size.
+    """
 
     enum_items = []
-    wm = bpy.context.window_manager
-    pose_thumbnail_options = wm.pose_thumbnails.options
-    show_all_poses = pose_thumbnail_options.show_all_poses
-    for i, pose in enumerate(poselib.pose_markers):
+    _fill_enum_items(poselib, pcoll, enum_items, show_all_poses=show_all_poses,
+                     flipped=flipped, page=page, page_size=page_size)
+    return enum_items
+
+
+def _fill_enum_items(poselib: bpy.types.Action,
+                     pcoll: bpy.utils.previews.ImagePreviewCollection,
+                     enum_items: list,
+                     *, show_all_poses: bool, flipped: bool, page: int, page_size: int):
+    """Replace the contents of enum_items with the items of the page."""
+
+    shown_poses = get_shown_poses(poselib, show_all_poses=show_all_poses)
+    if page_size:
+        start = page * page_size
+        page_poses = shown_poses[start:start + page_size]
+    else:
+        page_poses = shown_poses
+
+    enum_items[:] = [None] * len(page_poses)
+    for position, pose_index in enumerate(page_poses):
+        pose = poselib.pose_markers[pose_index]
         thumbnail = common.get_thumbnail_from_pose(pose)
+        _fill_enum_item(poselib, pcoll, enum_items, position,
+                        pose, pose_index, thumbnail, flipped)
+
+    if page_size:
+        next_page_poses = shown_poses[start + page_size:start + 2 * page_size]
+        _prefetch_images(poselib, pcoll, next_page_poses)
+
+
+def _prefetch_images(poselib: bpy.types.Action,
+                     pcoll: bpy.utils.previews.ImagePreviewCollection,
+                     pose_indices: typing.Iterable[int]):
+    """Load the thumbnail images of the poses in the background."""
+    if not loader.thumbnail_loader.enabled:
+        return
+    for pose_index in pose_indices:
+        thumbnail = common.get_thumbnail_from_pose(poselib.pose_markers[pose_index])
         if thumbnail:
-            image = _load_image(poselib, pcoll, thumbnail.filepath)
-        elif show_all_poses:
-            image = get_placeholder_image(pcoll)
-        else:
-            image = None
-        if image is not None:
-            enum_items.append((
-                str(pose.frame),
-                pose.name,
-                '',
-                image.icon_id,
-                i,
-            ))
-    return enum_items
+            abspath = common.get_thumbnail_abspath(poselib, thumbnail.filepath)
+            loader.thumbnail_loader.prefetch(pcoll, abspath)
+
+
+def _fill_enum_item(poselib: bpy.types.Action,
+                    pcoll: bpy.utils.previews.ImagePreviewCollection,
+                    enum_items: list,
+                    position: int,
+                    pose: bpy.types.TimelineMarker,
+                    pose_index: int,
+                    thumbnail,
+                    flipped: bool):
+    """Set enum_items[position] to the item of the pose."""
+
+    ident = str(pose.frame)
+    # The item has to exist before loading the image, because background
+    # loading patches the icon into it later.
+    enum_items[position] = (ident, pose.name, '', 0, pose_index)
+    if thumbnail:
+        image = _load_image(poselib, pcoll, thumbnail.filepath, flipped,
+                            enum_items, position)
+    else:
+        image = get_placeholder_image(pcoll)
+    enum_items[position] = (ident, pose.name, '', image.icon_id, pose_index)
+
 
+def update_enum_items(poselib: bpy.types.Action, frames: typing.Iterable[int]):
+    """Update the cached enum items of the poses at the given frames.
 
+    Instead of rebuilding the enum items of the entire pose library, only
+    the items of the given poses are replaced, added or removed. This is
+    done for all cached option states of the pose library.
+    """
+    pcoll = preview_collections['pose_library']
+    changed_poses = {}
+    for frame in frames:
+        pose_index = common.pose_marker_index.index(poselib, frame)
+        if pose_index is not None:
+            changed_poses[pose_index] = poselib.pose_markers[pose_index]
+    if not changed_poses:
+        return
+
+    thumbnails = {pose_index: common.get_thumbnail_from_pose(pose)
+                  for pose_index, pose in changed_poses.items()}
+    for options, shown_poses in get_shown_poses.cache_entries(poselib):
+        shown = {pose_index for pose_index, thumbnail in thumbnails.items()
+                 if thumbnail or options['show_all_poses']}
+        merged = [pose_index for pose_index in shown_poses if pose_index not in changed_poses]
+        merged.extend(shown)
+        merged.sort()
+        shown_poses[:] = merged
+
+    for options, enum_items in get_enum_items.cache_entries(poselib):
+        if options['page_size']:
+            # Adding or removing a pose shifts the following poses to other
+            # pages, so just rebuild the page; that is cheap enough.
+            _fill_enum_items(poselib, pcoll, enum_items, **options)
+            continue
+
+        # First put the items in the right place, then fill them, so that
+        # background loading gets the final positions.
+        shown = {pose_index for pose_index, thumbnail in thumbnails.items()
+                 if thumbnail or options['show_all_poses']}
+        merged = [item for item in enum_items if item[4] not in changed_poses]
+        merged.extend((str(changed_poses[pose_index].frame), '', '', 0, pose_index)
+                      for pose_index in shown)
+        merged.sort(key=lambda item: item[4])
+        enum_items[:] = merged
+
+        for position, item in enumerate(enum_items):
+            pose_index = item[4]
+            if pose_index not in shown:
+                continue
+            _fill_enum_item(poselib, pcoll, enum_items, position,
+                            changed_poses[pose_index], pose_index,
+                            thumbnails[pose_index], options['flipped'])
+    logger.debug('Updated %d enum items of %s', len(changed_poses), poselib.name)
+
+
+@profiling.timed('_load_image')
 def _load_image(poselib: bpy.types.Action,
                 pcoll: bpy.utils.previews.ImagePreviewCollection,
-                filepath: str):
-    abspath = os.path.normpath(bpy.path.abspath(filepath, library=poselib.library))
+                filepath: str,
+                flipped: bool = False,
+                enum_items: list = None,
+                position: int = None):
+    """Return the preview image for the thumbnail file.
+
+    When flipped is True, the mirrored variant of the image is returned.
+
+    When background loading is enabled and enum_items is given, the
+    placeholder image is returned for images that are not loaded yet, and
+    enum_items[position] gets its icon swapped once the image is loaded.
+    """
+    abspath = common.get_thumbnail_abspath(poselib, filepath)
 
     log = logger.getChild('get_enum_items')
     log.debug("Thumbnail path: %s", filepath)
@@ -102,20 +261,154 @@ def _load_image(poselib: bpy.types.Action,
 
     image = pcoll.get(abspath)
     if image is not None:
-        return image
+        return get_flipped_image(pcoll, abspath, image) if flipped else image
+
+    if enum_items is not None and loader.thumbnail_loader.enabled:
+        loader.thumbnail_loader.request(pcoll, abspath, flipped, enum_items, position)
+        return get_placeholder_image(pcoll)
+
+    image = _load_image_now(pcoll, abspath)
+    if flipped and abspath in pcoll:
+        return get_flipped_image(pcoll, abspath, image)
+    return image
 
-    if not os.path.isfile(abspath):
+
+def _load_image_now(pcoll: bpy.utils.previews.ImagePreviewCollection,
+                    abspath: str):
+    """Load the image from its proxy, atlas or the file itself, on the main thread."""
+    source_path, _ = atlas.split_tile_path(abspath)
+    stat, proxy = loader.read_thumbnail(abspath, prefetch=False,
+                                        known_stat=manifest.known_stat(source_path))
+    if stat is None:
         return get_no_thumbnail_image(pcoll)
+    if proxy is not None:
+        return load_proxy(pcoll, abspath, proxy, stat)
+    return load_preview(pcoll, abspath, stat)
+
 
+def load_preview(pcoll: bpy.utils.previews.ImagePreviewCollection,
+                 abspath: str,
+                 stat: os.stat_result):
+    """Load the image file into the preview collection.
+
+    Also stores a proxy of the image, if the proxy cache is enabled.
+    Must be called from the main thread.
+    """
     image = pcoll.load(abspath, abspath, 'IMAGE')
+    _remember_loaded(abspath, stat)
+    store.preview_store.add(abspath, abspath, image)
 
-    pose_thumbnail_options = bpy.context.window_manager.pose_thumbnails.options
-    if pose_thumbnail_options.flipped:
-        flip.pixels(image.image_pixels, *image.image_size)
+    if proxies.proxy_cache.enabled:
+        _store_proxy(abspath, _proxy_from_image(image))
 
     return image
 
 
+def load_proxy(pcoll: bpy.utils.previews.ImagePreviewCollection,
+               abspath: str,
+               proxy: proxies.Proxy,
+               stat: os.stat_result):
+    """Create a preview from the proxy of the image file.
+
+    Must be called from the main thread.
+    """
+    image = pcoll.new(abspath)
+    image.image_size = (proxy.width, proxy.height)
+    image.image_pixels = proxy.pixels
+    _remember_loaded(abspath, stat)
+    store.preview_store.add(abspath, abspath, image)
+    return image
+
+
+def _remember_loaded(abspath: str, stat: os.stat_result):
+    """Remember the state of the image file, to detect changes later."""
+    loaded_image_stats[abspath] = (stat.st_mtime_ns, stat.st_size)
+    source_path, _ = atlas.split_tile_path(abspath)
+    manifest.remember_stat(source_path, stat)
+
+
+def _proxy_from_image(image) -> proxies.Proxy:
+    width, height = image.image_size
+    return proxies.Proxy(width, height, array.array('i', image.image_pixels))
+
+
+def _store_proxy(abspath: str, proxy: proxies.Proxy):
+    loader.thumbnail_loader.run_in_background(proxies.proxy_cache.write, abspath, proxy)
+
+
+def reload_image(pcoll: bpy.utils.previews.ImagePreviewCollection,
+                 abspath: str,
+                 *, force=False) -> bool:
+    """Reload an image that is in the preview collection, if it changed on disk.
+
+    The pixels are replaced in the existing preview (and its mirrored
+    variant), so the icon stays the same and no enum items have to change.
+    Must be called from the main thread.
+
+    Returns:
+        whether the image was reloaded.
+    """
+    image = pcoll.get(abspath)
+    if image is None:
+        return False
+    source_path, _ = atlas.split_tile_path(abspath)
+    try:
+        stat = os.stat(source_path)
+    except FileNotFoundError:
+        # Keep showing the last known version of the image.
+        return False
+    if not force and loaded_image_stats.get(abspath) == (stat.st_mtime_ns, stat.st_size):
+        return False
+
+    stat, proxy = loader.read_thumbnail(abspath, prefetch=False)
+    if stat is None:
+        return False
+    if proxy is None:
+        temp_name = abspath + RELOAD_SUFFIX
+        temp_image = pcoll.load(temp_name, abspath, 'IMAGE', force_reload=True)
+        try:
+            proxy = _proxy_from_image(temp_image)
+        finally:
+            del pcoll[temp_name]
+        if proxies.proxy_cache.enabled:
+            _store_proxy(abspath, proxy)
+
+    image.image_size = (proxy.width, proxy.height)
+    image.image_pixels = proxy.pixels
+    _remember_loaded(abspath, stat)
+    store.preview_store.add(abspath, abspath, image)
+
+    flipped_name = abspath + FLIPPED_SUFFIX
+    flipped_image = pcoll.get(flipped_name)
+    if flipped_image is not None:
+        flipped_image.image_size = (proxy.width, proxy.height)
+        flip.copy_mirrored(image.image_pixels, flipped_image.image_pixels,
+                           proxy.width, proxy.height)
+        store.preview_store.add(abspath, flipped_name, flipped_image)
+    return True
+
+
+def get_flipped_image(pcoll: bpy.utils.previews.ImagePreviewCollection,
+                      abspath: str,
+                      image):
+    """Return the mirrored variant of a loaded image, creating it if necessary.
+
+    The variant is a separate preview, so that toggling the Flipped option
+    only has to switch icons instead of flipping pixels.
+    """
+    name = abspath + FLIPPED_SUFFIX
+    flipped_image = pcoll.get(name)
+    if flipped_image is not None:
+        return flipped_image
+
+    width, height = image.image_size
+    flipped_image = pcoll.new(name)
+    flipped_image.image_size = (width, height)
+    flip.copy_mirrored(image.image_pixels, flipped_image.image_pixels, width, height)
+    store.preview_store.add(abspath, name, flipped_image)
+    return flipped_image
+
+
 @cache.pyside_cache('active')
 def get_pose_thumbnails(self, context):
     """Get the pose thumbnails and add them to the preview collection."""
@@ -125,100 +418,84 @@ def get_pose_thumbnails(self, context):
             not poselib.pose_thumbnails):
         return []
     pcoll = preview_collections['pose_library']
-    pcoll.pose_thumbnails = get_enum_items(poselib, pcoll)
+    watcher.thumbnail_watcher.watch(poselib)
+    ui_settings = context.window_manager.pose_thumbnails
+    pose_thumbnail_options = ui_settings.options
+    if ui_settings.page_size:
+        page = min(ui_settings.page, get_page_count(poselib, ui_settings) - 1)
+    else:
+        page = 0
+    pcoll.pose_thumbnails = get_enum_items(
+        poselib, pcoll,
+        show_all_poses=pose_thumbnail_options.show_all_poses,
+        flipped=pose_thumbnail_options.flipped,
+        page=page,
+        page_size=ui_settings.page_size,
+    )
+    store.preview_store.touch(pcoll.pose_thumbnails)
     return pcoll.pose_thumbnails
 
 
-def get_current_pose(*, flipped=False) -> dict:
-    """Copies all pose bone matrices (matrix_basis) and custom props.
+def bones_to_pose(armature_ob: bpy.types.Object, *, flipped=False, pose_index=-1,
+                  layout: evaluation.LibraryLayout = None) \
+        -> typing.List[bpy.types.PoseBone]:
+    """Determine the bones that are changed by applying a library pose.
 
-    Returns a dictionary {bone: {'matrix_basis': m44, …}, …}
+    These are the bones in the pose library, and if any bones are selected,
+    only those.
+
+    :param flipped: flip the bone names before looking them up.
+    :param pose_index: when given, only include the bones that are keyed in
+        this pose of the library.
+    :param layout: the layout of the pose library, see bones_in_poselib().
     """
-    log = logger.getChild('get_current_pose')
-    arm_ob = bpy.context.object
+    bones_in_lib = bones_in_poselib(armature_ob, flipped=flipped, pose_index=pose_index,
+                                    layout=layout)
+    if not bpy.context.selected_pose_bones:
+        return list(bones_in_lib)
+    lib_bone_names = {pb.name for pb in bones_in_lib}
+    return [pb for pb in bpy.context.selected_pose_bones if pb.name in lib_bone_names]
 
-    # Figure out the names of the bones in the pose library,
-    # so that we won't have to iterate over all bones.
-    bones_in_lib = bones_in_poselib(arm_ob, flipped=flipped)
 
-    if bpy.context.selected_pose_bones:
-        pose_bones = {pb for pb in bpy.context.selected_pose_bones
-                      if pb in bones_in_lib}
-    else:
-        pose_bones = bones_in_lib
-    pose = {}
-
-    def store_bone(pb, mat):
-        pose[pb] = {k: v for k, v in pb.items() if k != '_RNA_UI'}
-        pose[pb]['matrix_basis'] = mat
-
-    # The selected bones are assumed to be the bones that should move,
-    # and not the bones we should obtain the matrix from and flip.
-    for target_pb in pose_bones:
-        if flipped:
-            name = flip.name(target_pb.name)
-            try:
-                source_pb = arm_ob.pose.bones[name]
-            except KeyError:
-                # This bone doesn't have a flipped version, so just ignore it.
-                continue
-            store_bone(target_pb, flip.matrix(source_pb.matrix_basis))
-        else:
-            store_bone(target_pb, target_pb.matrix_basis.copy())
+def armatures_to_pose(context, *, all_selected=False) -> typing.List[bpy.types.Object]:
+    """Determine the armatures to apply a library pose to.
 
-    return pose
+    This is the active armature, followed by the other selected armatures
+    when all_selected is True.
+    """
+    armature_obs = [context.object]
+    if all_selected:
+        armature_obs.extend(ob for ob in context.selected_objects
+                            if ob.type == 'ARMATURE' and ob != context.object)
+    return armature_obs
 
 
-def bones_in_poselib(armature_ob: bpy.types.Object, flipped=False) \
+def bones_in_poselib(armature_ob: bpy.types.Object, flipped=False, pose_index=-1,
+                     layout: evaluation.LibraryLayout = None) \
         -> typing.Set[bpy.types.PoseBone]:
     """Determine bones used in current pose library.
 
     :param armature_ob:
     :param flipped: flip the bone names before looking them up.
+    :param pose_index: when given, only return the bones that are keyed in
+        this pose of the library.
+    :param layout: the layout of the pose library, when the caller already
+        has it; looked up when None.
     """
-
-    bone_names = set()
-    all_pose_bones = armature_ob.pose.bones
-    logger.debug('Finding actual pose bones in pose lib')
-
-    for fc in armature_ob.pose_library.fcurves:
-        # Strip off the last '.location', '["idprop"]' etc.
-        m = bone_name_re.match(fc.data_path)
-        if not m:
-            continue
-
-        # the 'name' can be an index or a quoted name.
-        bone_name = m.group(1)
-        try:
-            bone_idx = int(bone_name)
-        except ValueError:
-            # Not a number, strip the quotes.
-            bone_names.add(bone_name[1:-1])
-        else:
-            # It was a number, use it to look up the bone name.
-            bone_names.add(all_pose_bones[bone_idx].name)
-
-    if flipped:
-        bone_names = {flip.name(name) for name in bone_names}
+    if layout is None:
+        layout = evaluation.library_layout(armature_ob.pose_library, armature_ob)
+    if pose_index < 0:
+        bone_names = layout.bone_names
+    else:
+        bone_names = layout.pose_masks[pose_index].keys()
 
     # From the set of bone names, get the actual pose bones.
     # Ignore non-existing bones.
-    return {all_pose_bones[bone_name] for bone_name in bone_names
-            if bone_name in all_pose_bones}
-
-
-def flip_selection():
-    """Flip selection, so if bone_L was selected, now bone_R is selected."""
-    pose_bones = bpy.context.object.pose.bones
-    selections = {
-        flip.name(pb.name): pb.bone.select
-        for pb in pose_bones
-    }
-    for name, select in selections.items():
-        try:
-            pose_bones[name].bone.select = select
-        except KeyError:
-            pass  # this happens when a bone exists only on one side
+    all_pose_bones = armature_ob.pose.bones
+    if not flipped:
+        return {all_pose_bones[bone_name] for bone_name in bone_names
+                if bone_name in all_pose_bones}
+    return {all_pose_bones[index] for index in snapshot.mirrored_indices(armature_ob, bone_names)}
 
 
 def select_pose_bones(bones: typing.Iterable[bpy.types.PoseBone],
@@ -228,13 +505,71 @@ def select_pose_bones(bones: typing.Iterable[bpy.types.PoseBone],
         pose_bone.bone.select = select
 
 
-def auto_keyframe(pose_bones: typing.List[bpy.types.PoseBone]):
-    """Set automatic keyframes (for the current armature)."""
-    auto_insert = bpy.context.scene.tool_settings.use_keyframe_insert_auto
+@profiling.timed('auto_keyframe')
+def auto_keyframe(pose: snapshot.PoseSnapshot, original: snapshot.PoseSnapshot = None):
+    """Set automatic keyframes (for the current armature).
+
+    Only the channels of the applied pose that differ from the original pose
+    are keyed, respecting the active keying set and 'Only Insert Available'.
+
+    :param pose: the pose that was just applied.
+    :param original: the pose before it was applied; when None, all
+        channels of the pose are keyed.
+    """
+    scene = bpy.context.scene
+    auto_insert = scene.tool_settings.use_keyframe_insert_auto
     if not auto_insert:
         logger.debug('Auto-keying disabled')
         return
 
+    edit_prefs = bpy.context.user_preferences.edit
+    use_active_keying_set = scene.tool_settings.use_keyframe_insert_keyingset
+    active_keying_set = scene.keying_sets_all.active if use_active_keying_set else None
+    armature_ob = pose.armature_ob
+    anim_data = armature_ob.animation_data
+    if (edit_prefs.use_visual_keying or
+            not keying.is_supported(active_keying_set) or
+            (anim_data is not None and anim_data.use_tweak_mode)):
+        if armature_ob != bpy.context.object:
+            # The operator only keys the bones of the active armature.
+            logger.warning('Unable to auto-key %s, it is not the active object',
+                           armature_ob.name)
+            return
+        _auto_keyframe_with_operator(pose.pose_bones(), active_keying_set)
+        return
+
+    only_available = edit_prefs.use_keyframe_insert_available
+    kinds = keying.ALL_KINDS
+    if active_keying_set is not None and not active_keying_set.is_path_absolute:
+        kinds = keying.BUILTIN_KEYING_SETS[active_keying_set.bl_idname]
+        only_available = only_available or active_keying_set.bl_idname == 'Available'
+
+    keyframes = keying.pose_keyframes(pose, original, kinds)
+    if active_keying_set is not None and active_keying_set.is_path_absolute:
+        keyframes = keying.filter_by_keying_set(keyframes, active_keying_set, armature_ob)
+    inserted = keying.insert_keyframes(armature_ob, keyframes, scene.frame_current,
+                                       only_available=only_available,
+                                       only_needed=edit_prefs.use_keyframe_insert_needed)
+    logger.debug('Auto-keyed %d of %d changed channels', inserted, len(keyframes))
+    if inserted:
+        redraw_animation_editors(bpy.context)
+
+
+def redraw_animation_editors(context):
+    """Redraw the editors that show keyframes, after inserting keyframes directly."""
+    if not context.screen:
+        return
+    for area in context.screen.areas:
+        if area.type in {'DOPESHEET_EDITOR', 'GRAPH_EDITOR', 'NLA_EDITOR', 'TIMELINE'}:
+            area.tag_redraw()
+
+
+def _auto_keyframe_with_operator(pose_bones: typing.List[bpy.types.PoseBone],
+                                 active_keying_set: typing.Optional[bpy.types.KeyingSet]):
+    """Set automatic keyframes with the keyframe_insert_menu operator.
+
+    Used for what keying.insert_keyframes() can't do, such as visual keying.
+    """
     selected_pose_bones = bpy.context.selected_pose_bones
     if not selected_pose_bones:
         select_pose_bones(pose_bones)
@@ -243,13 +578,8 @@ def auto_keyframe(pose_bones: typing.List[bpy.types.PoseBone]):
         logger.debug('Auto-keying %d bones (pre-selected), got passed %d bones',
                      len(bpy.context.selected_pose_bones), len(pose_bones))
 
-    scene = bpy.context.scene
-    user_preferences = bpy.context.user_preferences
-    use_active_keying_set = scene.tool_settings.use_keyframe_insert_keyingset
-    only_insert_available = user_preferences.edit.use_keyframe_insert_available
-
-    active_keying_set = scene.keying_sets_all.active
-    if use_active_keying_set and active_keying_set is not None:
+    only_insert_available = bpy.context.user_preferences.edit.use_keyframe_insert_available
+    if active_keying_set is not None:
         logger.debug('Auto-keying %r', active_keying_set.bl_idname)
         bpy.ops.anim.keyframe_insert_menu(type=active_keying_set.bl_idname)
     elif only_insert_available:
@@ -263,44 +593,86 @@ def auto_keyframe(pose_bones: typing.List[bpy.types.PoseBone]):
         select_pose_bones(pose_bones, select=False)
 
 
-def set_pose(pose_a, auto_key=True):
-    """Set the pose, same as mixing with factor=0."""
+def set_pose(pose_a: snapshot.PoseSnapshot, auto_key=True,
+             original: snapshot.PoseSnapshot = None):
+    """Set the pose, same as mixing with factor=0.
+
+    :param original: the pose before it was set; when given, only the
+        channels that differ from it are keyed.
+    """
 
     log = logger.getChild('set_pose')
-    log.debug('setting pose')
-    log_all = len(pose_a) < 10
-
-    for pose_bone, pose_a_props in pose_a.items():
-        if log_all:
-            log.debug('    - %s', pose_bone.name)
-        for prop, pose_a_value in pose_a_props.items():
-            if prop == 'matrix_basis':
-                pose_bone.matrix_basis = pose_a_value
-            else:
-                pose_bone[prop] = pose_a_value
+    log.debug('setting pose of %d bones', len(pose_a))
+    snapshot.apply(pose_a, original)
 
     if auto_key:
-        auto_keyframe(pose_a.keys())
+        auto_keyframe(pose_a, original)
+
 
+@profiling.timed('mix_to_pose')
+def mix_to_pose(pose_a: snapshot.PoseSnapshot,
+                pose_b: snapshot.PoseSnapshot,
+                factor: float,
+                auto_key=True,
+                previous: snapshot.PoseSnapshot = None) -> snapshot.PoseSnapshot:
+    """Mixes pose_b over pose_a with the given factor.
 
-def mix_to_pose(pose_a, pose_b, factor, auto_key=True):
-    """Mixes pose_b over pose_a with the given factor."""
+    :param previous: the pose that is currently on the armature; only values
+        that differ from it are written.
+    :returns: the mixed pose, which is reused by the next mix of the same poses.
+    """
 
-    for pose_bone, pose_a_props in pose_a.items():
-        for prop, pose_a_value in pose_a_props.items():
-            pose_b_value = pose_b[pose_bone][prop]
-            if prop == 'matrix_basis':
-                pose_bone.matrix_basis = pose_a_value.lerp(pose_b_value, factor)
-            else:
-                if isinstance(pose_a_value, float):
-                    pose_bone[prop] = pose_a_value * (1 - factor) + pose_b_value * factor
-                elif factor < 0.5:
-                    pose_bone[prop] = pose_a_value
-                else:
-                    pose_bone[prop] = pose_b_value
+    mixed = blending.mix(pose_a, pose_b, factor)
+    snapshot.apply(mixed, previous)
 
     if auto_key:
-        auto_keyframe(pose_a.keys())
+        auto_keyframe(mixed, pose_a)
+    return mixed
+
+
+@profiling.timed('library_pose_blend')
+def library_pose_blend(armature_ob: bpy.types.Object,
+                       poses: typing.Sequence[typing.Union[int, str]],
+                       *, flipped=False,
+                       bone_groups: typing.Sequence[str] = None) -> blending.PoseBlend:
+    """Prepare blending library poses over the current pose of the armature.
+
+    Call the returned PoseBlend with the weights of the poses to get the
+    blended pose, then apply it with set_pose().
+
+    Each pose only applies to the bones that are keyed in it, and if any
+    bones are selected, only to those.
+
+    :param poses: the indices or names of the poses in the pose library.
+    :param bone_groups: per pose, the name of a bone group to limit the pose
+        to, or '' for no limit.
+    :raises ValueError: when the pose library doesn't have one of the poses.
+    """
+    poselib = armature_ob.pose_library
+    pose_indices = [common.pose_index(poselib, pose) for pose in poses]
+    bone_groups = bone_groups or [''] * len(pose_indices)
+
+    layout = evaluation.library_layout(poselib, armature_ob)
+    all_bone_names = collections.OrderedDict()  # {bone name: None} of all poses
+    masks = []
+    for pose_index, bone_group in zip(pose_indices, bone_groups):
+        pose_bones = bones_to_pose(armature_ob, flipped=flipped, pose_index=pose_index,
+                                   layout=layout)
+        if bone_group:
+            pose_bones = [pose_bone for pose_bone in pose_bones
+                          if pose_bone.bone_group and pose_bone.bone_group.name == bone_group]
+        bone_names = [pose_bone.name for pose_bone in pose_bones]
+        masks.append(snapshot.bone_indices(armature_ob, bone_names))
+        all_bone_names.update((bone_name, None) for bone_name in bone_names)
+
+    bone_indices = snapshot.bone_indices(armature_ob, all_bone_names)
+    base = snapshot.capture_indices(armature_ob, bone_indices)
+    targets = []
+    for pose_index in pose_indices:
+        pose_values = posetable.pose_tables.pose_values(poselib, pose_index, armature_ob)
+        targets.append(snapshot.capture_indices(armature_ob, bone_indices, flipped=flipped,
+                                                pose_values=pose_values))
+    return blending.PoseBlend(base, targets, masks)
 
 
 def update_pose(self, context):
@@ -314,13 +686,17 @@ def update_pose(self, context):
     Returns:
         None
     """
+    if POSELIB_OT_blend_poses.is_running:
+        # Mixing a pose while blending poses would mess up both.
+        return
     pose_frame = int(self.active)
     poselib = context.object.pose_library
     pose_index = get_pose_index_from_frame(poselib, pose_frame)
     pose_thumbnail_options = context.window_manager.pose_thumbnails.options
 
     bpy.ops.poselib.mix_pose('INVOKE_DEFAULT', pose_index=pose_index,
-                             flipped=pose_thumbnail_options.flipped)
+                             flipped=pose_thumbnail_options.flipped,
+                             all_selected=pose_thumbnail_options.all_selected)
 
 
 def character_name(ob_name: str, context) -> str:
@@ -365,6 +741,7 @@ def pose_library_name_prefix(ob_name: str, context) -> str:
 pose_libs_for_current_char = []
 
 
+@profiling.timed_callback('generate_pose_lib_for_char_items')
 def generate_pose_lib_for_char_items(self, context) -> list:
     """Generate list of items for Object.pose_libs_for_char."""
 
@@ -402,6 +779,7 @@ def pose_lib_for_char_set(self, index):
     self.pose_library = action
 
 
+@profiling.timed_callback('pose_thumbnails_draw')
 def pose_thumbnails_draw(self, context):
     """Draw the thumbnail enum in the Pose Library panel."""
     if not context.object:
@@ -431,6 +809,7 @@ def pose_thumbnails_draw(self, context):
         creation.draw_creation(col, pose_thumbnail_options, poselib)
 
 
+@profiling.timed('draw_thumbnails')
 def draw_thumbnails(context, layout, pose_thumbnail_options):
     if context.object.mode != 'POSE':
         layout.enabled = False
@@ -445,7 +824,17 @@ def draw_thumbnails(context, layout, pose_thumbnail_options):
         show_labels=show_labels,
         scale=thumbnail_size,
     )
-    if POSELIB_OT_apply_mix_pose.poll(context):
+    ui_settings = context.window_manager.pose_thumbnails
+    if ui_settings.page_size:
+        page_count = get_page_count(context.object.pose_library, ui_settings)
+        page = min(ui_settings.page, page_count - 1)
+        row = layout.row(align=True)
+        row.operator(POSELIB_OT_thumbnail_page.bl_idname, text='',
+                     icon='TRIA_LEFT').offset = -1
+        row.label('Page {page} of {count}'.format(page=page + 1, count=page_count))
+        row.operator(POSELIB_OT_thumbnail_page.bl_idname, text='',
+                     icon='TRIA_RIGHT').offset = 1
+    if POSELIB_OT_mix_pose.is_running is not None and POSELIB_OT_apply_mix_pose.poll(context):
         container = layout.box()
         split = container.row(align=True).split(0.8, align=True)
         split.prop(context.window_manager, 'pose_mix_factor')
@@ -457,6 +846,59 @@ def draw_thumbnails(context, layout, pose_thumbnail_options):
     row.prop(pose_thumbnail_options, 'flipped')
     row.prop(pose_thumbnail_options, 'show_labels')
     row.prop(pose_thumbnail_options, 'show_all_poses', text='All Poses')
+    draw_advanced_options(context, layout, pose_thumbnail_options)
+
+
+def draw_advanced_options(context, layout, pose_thumbnail_options):
+    """Draw the collapsible box with the paging, pose blending and baking options."""
+    box = layout.box()
+    if pose_thumbnail_options.show_advanced_options:
+        expand_icon = 'TRIA_DOWN'
+    else:
+        expand_icon = 'TRIA_RIGHT'
+    box.prop(
+        pose_thumbnail_options,
+        'show_advanced_options',
+        icon=expand_icon,
+        toggle=True,
+    )
+    if not pose_thumbnail_options.show_advanced_options:
+        # The Apply and Cancel buttons of a running blend must stay reachable.
+        if POSELIB_OT_blend_poses.is_running is not None:
+            draw_pose_blend(context, box, pose_thumbnail_options)
+        return
+    box.prop(context.window_manager.pose_thumbnails, 'page_size')
+    box.prop(pose_thumbnail_options, 'all_selected')
+    draw_pose_blend(context, box, pose_thumbnail_options)
+    box.operator(POSELIB_OT_bake_pose_markers.bl_idname,
+                 icon='MARKER_HLT').flipped = pose_thumbnail_options.flipped
+
+
+def draw_pose_blend(context, layout, pose_thumbnail_options):
+    """Draw the list of poses to blend, with their weights."""
+    container = layout.box()
+    row = container.row(align=True)
+    row.label('Pose Blend')
+    row.operator(POSELIB_OT_add_blend_pose.bl_idname, text='', icon='ZOOMIN')
+    pose = context.object.pose
+    for index, entry in enumerate(context.window_manager.pose_thumbnails.blend_entries):
+        row = container.row(align=True)
+        row.prop(entry, 'weight', text=entry.name)
+        row.prop_search(entry, 'bone_group', pose, 'bone_groups', text='')
+        row.operator(POSELIB_OT_remove_blend_pose.bl_idname, text='', icon='X').index = index
+
+    if POSELIB_OT_blend_poses.is_running is not None:
+        split = container.row(align=True).split(0.5, align=True)
+        split.operator(POSELIB_OT_apply_mix_pose.bl_idname, icon='FILE_TICK')
+        split.operator(POSELIB_OT_cancel_mix_pose.bl_idname, icon='PANEL_CLOSE')
+    else:
+        container.operator(POSELIB_OT_blend_poses.bl_idname,
+                           icon='POSE_DATA').flipped = pose_thumbnail_options.flipped
+
+
+def running_mix_operator():
+    """Return the running modal operator that mixes or blends poses, if any."""
+    return POSELIB_OT_mix_pose.is_running or POSELIB_OT_blend_poses.is_running
 
 
 def apply_mix_factor(_, context):
@@ -466,35 +908,68 @@ def apply_mix_factor(_, context):
     POSELIB_OT_mix_pose.is_running.execute(context)
 
 
+def apply_blend_weights(_, context):
+    """Apply the blend weights from PoselibBlendEntry property updates."""
+    if not POSELIB_OT_blend_poses.is_running:
+        return
+    POSELIB_OT_blend_poses.is_running.weights_changed()
+
+
 class POSELIB_OT_apply_mix_pose(bpy.types.Operator):
-    """Apply the currently mixed-in pose"""
+    """Apply the currently mixed-in or blended pose"""
     bl_idname = 'poselib.apply_mix_pose'
     bl_label = 'Apply'
 
     @classmethod
     def poll(cls, context):
-        return POSELIB_OT_mix_pose.poll(context) and POSELIB_OT_mix_pose.is_running is not None
+        return POSELIB_OT_mix_pose.poll(context) and running_mix_operator() is not None
 
     def execute(self, context):
-        if not POSELIB_OT_mix_pose.is_running:
+        if not running_mix_operator():
             return
-        POSELIB_OT_mix_pose.is_running.apply_and_finish()
+        running_mix_operator().apply_and_finish()
         return {'FINISHED'}
 
 
 class POSELIB_OT_cancel_mix_pose(bpy.types.Operator):
-    """Cancels the currently mixed-in pose"""
+    """Cancels the currently mixed-in or blended pose"""
     bl_idname = 'poselib.cancel_mix_pose'
     bl_label = 'Cancel'
 
     @classmethod
     def poll(cls, context):
-        return POSELIB_OT_mix_pose.poll(context) and POSELIB_OT_mix_pose.is_running is not None
+        return POSELIB_OT_mix_pose.poll(context) and running_mix_operator() is not None
 
     def execute(self, context):
-        if not POSELIB_OT_mix_pose.is_running:
+        if not running_mix_operator():
             return
-        POSELIB_OT_mix_pose.is_running.cancel_and_finish()
+        running_mix_operator().cancel_and_finish()
+        return {'FINISHED'}
+
+
+class POSELIB_OT_thumbnail_page(bpy.types.Operator):
+    """Show another page of pose thumbnails"""
+    bl_idname = 'poselib.thumbnail_page'
+    bl_label = 'Change Thumbnail Page'
+    bl_options = {'INTERNAL'}
+
+    offset = bpy.props.IntProperty(
+        name='Offset',
+        description='Number of pages to move forward; negative to move back',
+        default=1,
+    )
+
+    @classmethod
+    def poll(cls, context):
+        return (context.object and
+                context.object.pose_library and
+                context.window_manager.pose_thumbnails.page_size)
+
+    def execute(self, context):
+        ui_settings = context.window_manager.pose_thumbnails
+        page_count = get_page_count(context.object.pose_library, ui_settings)
+        page = min(ui_settings.page, page_count - 1) + self.offset
+        ui_settings.page = max(0, min(page, page_count - 1))
         return {'FINISHED'}
 
 
@@ -517,14 +992,24 @@ class POSELIB_OT_mix_pose(bpy.types.Operator):
         description='Apply the pose mirrored over the YZ-plane',
         default=False,
     )
+    all_selected = bpy.props.BoolProperty(
+        name='All Selected Armatures',
+        description='Also apply the pose to the other selected armatures, '
+                    'to the bones that have the same names',
+        default=False,
+    )
 
     # Default values for instance variables.
     mouse_x_ref = 0
     mouse_x = 0
     just_clicked = False
-    current_pose = {}
-    target_pose = {}
+    current_poses = ()  # per armature, the pose before mixing
+    target_poses = ()  # per armature, the library pose
     _target_state = ''
+    _timer = None
+    _pending_factor = None  # the mix factor to apply on the next timer tick
+    _applied_factor = 0.0
+    _applied_poses = ()  # copies of the poses that were last written to the armatures
 
     @classmethod
     def poll(cls, context):
@@ -538,6 +1023,10 @@ class POSELIB_OT_mix_pose(bpy.types.Operator):
         :param context:
         """
         POSELIB_OT_mix_pose.is_running = None
+        blending.forget_mixes()
+        if self._timer is not None:
+            context.window_manager.event_timer_remove(self._timer)
+            self._timer = None
         context.area.tag_redraw()
 
     def apply_and_finish(self):
@@ -549,26 +1038,53 @@ class POSELIB_OT_mix_pose(bpy.types.Operator):
         self._target_state = 'CANCELLED'
 
     def execute(self, context):
+        # While running modal, this is called for every change of the mix
+        # factor. Only the latest factor is applied, on the next timer tick,
+        # so that a burst of slider changes results in a single update of
+        # the armature.
+        self._pending_factor = context.window_manager.pose_mix_factor / 100
+        if POSELIB_OT_mix_pose.is_running is not self:
+            # Not running modal, so apply and key the pose right away.
+            self._determine_poses()
+            self._applied_poses = list(self.current_poses)
+            factor, self._pending_factor = self._pending_factor, None
+            self._mix(factor, auto_key=True)
+        return {'FINISHED'}
+
+    def _apply_pending_factor(self):
+        factor = self._pending_factor
+        self._pending_factor = None
+        if factor is None or abs(factor - self._applied_factor) < MIX_FACTOR_EPSILON:
+            return
         # Prevent creating keyframes while we're still mixing. This is only
         # done when applying the pose.
-        self._execute(context, auto_key=False)
+        self._mix(factor, auto_key=False)
 
-    def _execute(self, context, auto_key: bool):
-        mix_factor = context.window_manager.pose_mix_factor / 100
-        mix_to_pose(self.current_pose, self.target_pose, mix_factor, auto_key=auto_key)
-        return {'FINISHED'}
+    def _mix(self, factor: float, auto_key: bool):
+        self._applied_poses = [
+            mix_to_pose(current_pose, target_pose, factor,
+                        auto_key=auto_key, previous=applied_pose).copy()
+            for current_pose, target_pose, applied_pose
+            in zip(self.current_poses, self.target_poses, self._applied_poses)
+        ]
+        self._applied_factor = factor
 
     def modal(self, context, event):
+        if event.type == 'TIMER' and self._timer is not None:
+            self._apply_pending_factor()
+            return {'PASS_THROUGH'}
+
         if ((event.type == 'LEFTMOUSE' and event.value == 'CLICK')
                 or event.type == 'RET' or self._target_state == 'FINISHED'):
             logger.debug('Finishing modal application')
-            self._execute(context, auto_key=True)
+            self._mix(context.window_manager.pose_mix_factor / 100, auto_key=True)
             self._finish(context)
             return {'FINISHED'}
 
         if event.type in {'RIGHTMOUSE', 'ESC'} or self._target_state == 'CANCELLED':
             logger.debug('Cancelling modal application')
-            set_pose(self.current_pose, auto_key=False)
+            for current_pose in self.current_poses:
+                set_pose(current_pose, auto_key=False)
             self._finish(context)
             return {'CANCELLED'}
 
@@ -578,49 +1094,267 @@ class POSELIB_OT_mix_pose(bpy.types.Operator):
         self._determine_poses()
         if not event.shift:
             logger.debug('Applying pose at 100%')
-            set_pose(self.target_pose)
+            for current_pose, target_pose in zip(self.current_poses, self.target_poses):
+                set_pose(target_pose, original=current_pose)
             self._finish(context)
             return {'FINISHED'}
 
         logger.debug('Running modal')
         POSELIB_OT_mix_pose.is_running = self
+        # The armatures still have the current pose.
+        self._applied_poses = list(self.current_poses)
+        self._applied_factor = 0.0
         context.window_manager.pose_mix_factor = 0
 
         wm = context.window_manager
+        self._timer = wm.event_timer_add(MIX_UPDATE_INTERVAL, context.window)
         wm.modal_handler_add(self)
 
         return {'RUNNING_MODAL'}
 
+    @profiling.timed('POSELIB_OT_mix_pose._determine_poses')
     def _determine_poses(self):
-        """Set self.current_pose and self.target_pose.
+        """Set self.current_poses and self.target_poses.
+
+        These are the poses we have to mix between, one pair per armature.
+        The target pose is evaluated from the F-Curves of the pose library
+        of the active armature, without applying it to the armature first.
+        When flipped, the pose is taken from the opposite bones, as if it
+        were applied to those.
 
-        These are the two poses we have to mix between.
+        The pose is evaluated once, and applied to the bones of the same
+        name on each armature; armatures without any of those bones are
+        skipped.
         """
+        arm_ob = bpy.context.object
+        poselib = arm_ob.pose_library
+        # Just like poselib.apply_pose does.
+        poselib.pose_markers.active_index = self.pose_index
+
+        # Only the bones keyed in the pose are captured, mixed and keyed.
+        layout = evaluation.library_layout(poselib, arm_ob)
+        pose_bones = bones_to_pose(arm_ob, flipped=self.flipped, pose_index=self.pose_index,
+                                   layout=layout)
+        bone_names = [pose_bone.name for pose_bone in pose_bones]
+        pose_values = posetable.pose_tables.pose_values(poselib, self.pose_index, arm_ob)
+
+        self.current_poses = []
+        self.target_poses = []
+        for armature_ob in armatures_to_pose(bpy.context, all_selected=self.all_selected):
+            bone_indices = snapshot.bone_indices(armature_ob, bone_names)
+            if not bone_indices:
+                logger.debug('Skipping %s, it has none of the posed bones', armature_ob.name)
+                continue
+            self.current_poses.append(snapshot.capture_indices(armature_ob, bone_indices))
+            self.target_poses.append(snapshot.capture_indices(
+                armature_ob, bone_indices, flipped=self.flipped, pose_values=pose_values))
 
-        # Temporarily turn off auto-keying. We don't want to create
-        # keyframes here, we just want to inspect the resulting pose.
-        auto_insert = bpy.context.scene.tool_settings.use_keyframe_insert_auto
-        try:
-            bpy.context.scene.tool_settings.use_keyframe_insert_auto = False
-            if self.flipped:
-                self.current_pose = get_current_pose(flipped=False)
-
-                # To get the target pose, we have to look at the opposite bones.
-                flip_selection()
-                orig_nonflipped = get_current_pose(flipped=False)
-                bpy.ops.poselib.apply_pose(pose_index=self.pose_index)
-                flip_selection()
-
-                self.target_pose = get_current_pose(flipped=True)
-                set_pose(orig_nonflipped)
-                return
-
-            # Non-flipped is much simpler.
-            self.current_pose = get_current_pose(flipped=False)
-            bpy.ops.poselib.apply_pose(pose_index=self.pose_index)
-            self.target_pose = get_current_pose(flipped=False)
-        finally:
-            bpy.context.scene.tool_settings.use_keyframe_insert_auto = auto_insert
+
+class POSELIB_OT_blend_poses(bpy.types.Operator):
+    """Blend the poses of the Pose Blend list over the current pose, with their weights"""
+    bl_idname = 'poselib.blend_poses'
+    bl_label = 'Blend Poses'
+
+    is_running = None
+    """The instance of the running modal operator, if any."""
+
+    flipped = bpy.props.BoolProperty(
+        name='Apply Flipped',
+        description='Blend the poses mirrored over the YZ-plane',
+        default=False,
+    )
+
+    # Default values for instance variables.
+    pose_blend = None
+    _entry_indices = ()  # the blend entries of the poses in pose_blend
+    _target_state = ''
+    _timer = None
+    _weights_changed = False  # whether to blend again on the next timer tick
+    _applied_pose = None  # copy of the pose that was last written to the armature
+
+    @classmethod
+    def poll(cls, context):
+        return (POSELIB_OT_mix_pose.poll(context) and
+                context.object.pose_library and
+                len(context.window_manager.pose_thumbnails.blend_entries) > 0 and
+                running_mix_operator() is None)
+
+    def _finish(self, context):
+        POSELIB_OT_blend_poses.is_running = None
+        if self._timer is not None:
+            context.window_manager.event_timer_remove(self._timer)
+            self._timer = None
+        context.area.tag_redraw()
+
+    def apply_and_finish(self):
+        """Apply the currently blended pose and finish running the operator."""
+        self._target_state = 'FINISHED'
+
+    def cancel_and_finish(self):
+        """Revert the currently blended pose and aborts the operator."""
+        self._target_state = 'CANCELLED'
+
+    def weights_changed(self):
+        # Like the mix factor, changed weights are applied on the next timer tick.
+        self._weights_changed = True
+
+    def _blend(self, context, auto_key: bool):
+        entries = context.window_manager.pose_thumbnails.blend_entries
+        weights = [entries[index].weight for index in self._entry_indices]
+        blended = self.pose_blend(weights)
+        snapshot.apply(blended, self._applied_pose)
+        if auto_key:
+            auto_keyframe(blended, self.pose_blend.base)
+        self._applied_pose = blended.copy()
+
+    def execute(self, context):
+        if not self._determine_blend(context):
+            return {'CANCELLED'}
+        self._blend(context, auto_key=True)
+        return {'FINISHED'}
+
+    def modal(self, context, event):
+        if event.type == 'TIMER' and self._timer is not None:
+            if self._weights_changed:
+                self._weights_changed = False
+                self._blend(context, auto_key=False)
+            return {'PASS_THROUGH'}
+
+        if event.type == 'RET' or self._target_state == 'FINISHED':
+            logger.debug('Finishing modal blending')
+            self._blend(context, auto_key=True)
+            self._finish(context)
+            return {'FINISHED'}
+
+        if event.type == 'ESC' or self._target_state == 'CANCELLED':
+            logger.debug('Cancelling modal blending')
+            set_pose(self.pose_blend.base, auto_key=False)
+            self._finish(context)
+            return {'CANCELLED'}
+
+        return {'PASS_THROUGH'}
+
+    def invoke(self, context, event):
+        if not self._determine_blend(context):
+            return {'CANCELLED'}
+
+        logger.debug('Running modal')
+        POSELIB_OT_blend_poses.is_running = self
+        # The armature still has the current pose.
+        self._applied_pose = self.pose_blend.base
+        self._blend(context, auto_key=False)
+
+        wm = context.window_manager
+        self._timer = wm.event_timer_add(MIX_UPDATE_INTERVAL, context.window)
+        wm.modal_handler_add(self)
+
+        return {'RUNNING_MODAL'}
+
+    def _determine_blend(self, context) -> bool:
+        """Set self.pose_blend, returning False when there is nothing to blend."""
+        poselib = context.object.pose_library
+        entries = context.window_manager.pose_thumbnails.blend_entries
+        self._entry_indices = [index for index, entry in enumerate(entries)
+                               if entry.name in poselib.pose_markers]
+        if not self._entry_indices:
+            self.report({'WARNING'}, 'None of the poses to blend are in %s' % poselib.name)
+            return False
+        self.pose_blend = library_pose_blend(
+            context.object,
+            [entries[index].name for index in self._entry_indices],
+            flipped=self.flipped,
+            bone_groups=[entries[index].bone_group for index in self._entry_indices])
+        return True
+
+
+class POSELIB_OT_add_blend_pose(bpy.types.Operator):
+    """Add the active library pose to the Pose Blend list"""
+    bl_idname = 'poselib.add_blend_pose'
+    bl_label = 'Add Pose to Blend'
+
+    @classmethod
+    def poll(cls, context):
+        return (context.object and
+                context.object.pose_library and
+                context.object.pose_library.pose_markers.active and
+                POSELIB_OT_blend_poses.is_running is None)
+
+    def execute(self, context):
+        pose = context.object.pose_library.pose_markers.active
+        entry = context.window_manager.pose_thumbnails.blend_entries.add()
+        entry.name = pose.name
+        return {'FINISHED'}
+
+
+class POSELIB_OT_remove_blend_pose(bpy.types.Operator):
+    """Remove the pose from the Pose Blend list"""
+    bl_idname = 'poselib.remove_blend_pose'
+    bl_label = 'Remove Pose from Blend'
+
+    index = bpy.props.IntProperty(
+        name='Index',
+        description='The index of the pose in the Pose Blend list',
+        default=0,
+        min=0,
+    )
+
+    @classmethod
+    def poll(cls, context):
+        return POSELIB_OT_blend_poses.is_running is None
+
+    def execute(self, context):
+        blend_entries = context.window_manager.pose_thumbnails.blend_entries
+        if self.index >= len(blend_entries):
+            return {'CANCELLED'}
+        blend_entries.remove(self.index)
+        return {'FINISHED'}
+
+
+class POSELIB_OT_bake_pose_markers(bpy.types.Operator):
+    """Key the library poses named by the timeline markers at the frames of those markers"""
+    bl_idname = 'poselib.bake_pose_markers'
+    bl_label = 'Bake Poses from Markers'
+    bl_options = {'REGISTER', 'UNDO'}
+
+    flipped = bpy.props.BoolProperty(
+        name='Apply Flipped',
+        description='Bake the poses mirrored over the YZ-plane',
+        default=False,
+    )
+    mix_factor = bpy.props.FloatProperty(
+        name='Mix Factor',
+        description='Mix the poses over the existing animation',
+        default=1.0,
+        min=0.0,
+        max=1.0,
+        subtype='FACTOR',
+    )
+    only_selected = bpy.props.BoolProperty(
+        name='Only Selected Markers',
+        description='Only bake the poses of the selected timeline markers',
+        default=False,
+    )
+
+    @classmethod
+    def poll(cls, context):
+        return POSELIB_OT_mix_pose.poll(context) and context.object.pose_library
+
+    def execute(self, context):
+        poselib = context.object.pose_library
+        entries = [
+            baking.BakeEntry(marker.frame, marker.name, self.flipped, self.mix_factor)
+            for marker in context.scene.timeline_markers
+            if (marker.select or not self.only_selected) and marker.name in poselib.pose_markers
+        ]
+        if not entries:
+            self.report({'WARNING'}, 'No timeline markers are named after poses in %s'
+                        % poselib.name)
+            return {'CANCELLED'}
+
+        inserted = baking.bake_poses(context.object, entries)
+        redraw_animation_editors(context)
+        self.report({'INFO'}, 'Baked %d poses into %d keyframes' % (len(entries), inserted))
+        return {'FINISHED'}
 
 
 class POSELIB_OT_rename_for_character(bpy.types.Operator):
@@ -669,6 +1403,11 @@ class POSELIB_OT_rename_for_character(bpy.types.Operator):
         return {'FINISHED'}
 
 
+def page_size_updated(self, context):
+    """Go back to the first page, as the current page may no longer exist."""
+    self.page = 0
+
+
 class PoselibThumbnail(bpy.types.PropertyGroup):
     """A property to hold the thumbnail info for a pose"""
     frame = bpy.props.IntProperty(
@@ -684,18 +1423,6 @@ class PoselibThumbnail(bpy.types.PropertyGroup):
     )
 
 
-def show_all_poses_updated(self, context):
-    """Refresh thumbnails when changing the show all poses toggle"""
-    bpy.ops.poselib.refresh_thumbnails()
-
-
-def on_flipped_updated(self, context):
-    common.clear_cached_pose_thumbnails()
-
-    for img in preview_collections['pose_library'].values():
-        flip.pixels(img.image_pixels, *img.image_size)
-
-
 class PoselibThumbnailsOptions(bpy.types.PropertyGroup):
     """A property to hold the option info for the thumbnail UI"""
     show_creation_options = bpy.props.BoolProperty(
@@ -703,6 +1430,11 @@ class PoselibThumbnailsOptions(bpy.types.PropertyGroup):
         description='Show or hide the thumbnail creation options',
         default=False,
     )
+    show_advanced_options = bpy.props.BoolProperty(
+        name='Advanced Options',
+        description='Show or hide paging, pose blending and baking',
+        default=False,
+    )
     show_labels = bpy.props.BoolProperty(
         name='Show Labels',
         description='Show the labels (pose names) underneath the thumbnails',
@@ -712,18 +1444,36 @@ class PoselibThumbnailsOptions(bpy.types.PropertyGroup):
         name='Show All Poses',
         description='Also show poses that don\'t have a thumbnail',
         default=False,
-        update=show_all_poses_updated,
     )
     flipped = bpy.props.BoolProperty(
         name='Apply Flipped',
         description='Apply the pose mirrored over the YZ-plane',
         default=False,
-        update=on_flipped_updated,
-        # This option shouldn't be saved, because the on_flipped_update()
-        # dumbly flips the pixels of the images. It assumes that the loaded
-        # images are consistent with this `flipped` property, whereas Blender
-        # will start up with the images loaded as on-disk (i.e. flipped=False).
-        options={'SKIP_SAVE'},
+    )
+    all_selected = bpy.props.BoolProperty(
+        name='All Selected Armatures',
+        description='Also apply the pose to the other selected armatures, '
+                    'to the bones that have the same names',
+        default=False,
+    )
+
+
+class PoselibBlendEntry(bpy.types.PropertyGroup):
+    """A pose in the Pose Blend list; its name is the name of the pose"""
+    weight = bpy.props.FloatProperty(
+        name='Weight',
+        description='How much of the pose to blend in',
+        default=1.0,
+        min=0.0,
+        max=1.0,
+        subtype='FACTOR',
+        update=apply_blend_weights,
+    )
+    bone_group = bpy.props.StringProperty(
+        name='Bone Group',
+        description='Only blend the bones of this bone group; leave empty to blend '
+                    'all bones of the pose',
+        default='',
     )
 
 
@@ -736,6 +1486,24 @@ class PoselibUiSettings(bpy.types.PropertyGroup):
     options = bpy.props.PointerProperty(
         type=PoselibThumbnailsOptions,
     )
+    page_size = bpy.props.IntProperty(
+        name='Page Size',
+        description='Number of thumbnails shown at once; only the images of the shown page '
+                    'are loaded. Set to 0 to show all thumbnails',
+        default=0,
+        min=0,
+        soft_max=500,
+        update=page_size_updated,
+    )
+    page = bpy.props.IntProperty(
+        name='Page',
+        description='The page of thumbnails that is shown',
+        default=0,
+        min=0,
+    )
+    blend_entries = bpy.props.CollectionProperty(
+        type=PoselibBlendEntry,
+    )
 
 
 class POSELIB_PT_pose_previews(bpy.types.Panel):
@@ -753,6 +1521,7 @@ class POSELIB_PT_pose_previews(bpy.types.Panel):
         return (obj and obj.type == 'ARMATURE' and
                 addon_prefs.add_3dview_prop_panel)
 
+    @profiling.timed_callback('POSELIB_PT_pose_previews.draw')
     def draw(self, context):
         addon_prefs = prefs.for_addon(context)
         obj = context.object
@@ -776,6 +1545,53 @@ class POSELIB_PT_pose_previews(bpy.types.Panel):
         col.template_ID(obj, "pose_library", unlink="poselib.unlink")
 
 
+class POSELIB_OT_export_profile(bpy.types.Operator, ExportHelper):
+    """Export the recorded profiling data"""
+    bl_idname = 'poselib.export_profile'
+    bl_label = 'Export Profile'
+
+    filename_ext = '.json'
+    filter_glob = bpy.props.StringProperty(
+        default='*.json;*.prof',
+        options={'HIDDEN'},
+    )
+    export_format = bpy.props.EnumProperty(
+        name='Format',
+        items=[
+            ('JSON', 'JSON', 'Timers and counters of the add-on'),
+            ('CPROFILE', 'cProfile', 'cProfile dump, for use with pstats or snakeviz'),
+        ],
+        default='JSON',
+    )
+
+    def execute(self, context):
+        if self.export_format == 'CPROFILE':
+            if not profiling.has_cprofile_data():
+                self.report({'ERROR'}, "Set Profiling to 'Timers and cProfile' first")
+                return {'CANCELLED'}
+            filepath = os.path.splitext(self.filepath)[0] + '.prof'
+            profiling.export_cprofile(filepath)
+        else:
+            from . import __version__
+            filepath = bpy.path.ensure_ext(self.filepath, '.json')
+            profiling.export_json(filepath, {
+                'addon_version': __version__,
+                'blender_version': bpy.app.version_string,
+            })
+        self.report({'INFO'}, 'Profile exported to %s' % filepath)
+        return {'FINISHED'}
+
+
+class POSELIB_OT_reset_profile(bpy.types.Operator):
+    """Forget the recorded profiling data"""
+    bl_idname = 'poselib.reset_profile'
+    bl_label = 'Reset Profile'
+
+    def execute(self, context):
+        profiling.reset()
+        return {'FINISHED'}
+
+
 class POSELIB_OT_help_regexp(bpy.types.Operator):
     """Open Regular Expression explanation in a webbrowser"""
     bl_label = 'Help'
@@ -790,13 +1606,21 @@ class POSELIB_OT_help_regexp(bpy.types.Operator):
 classes = [
     PoselibThumbnail,
     PoselibThumbnailsOptions,
+    PoselibBlendEntry,
     PoselibUiSettings,
     POSELIB_PT_pose_previews,
+    POSELIB_OT_thumbnail_page,
     POSELIB_OT_mix_pose,
     POSELIB_OT_apply_mix_pose,
     POSELIB_OT_cancel_mix_pose,
+    POSELIB_OT_blend_poses,
+    POSELIB_OT_add_blend_pose,
+    POSELIB_OT_remove_blend_pose,
     POSELIB_OT_help_regexp,
+    POSELIB_OT_bake_pose_markers,
     POSELIB_OT_rename_for_character,
+    POSELIB_OT_export_profile,
+    POSELIB_OT_reset_profile,
 ]
 
 
@@ -806,6 +1630,15 @@ def register():
     for cls in classes:
         bpy.utils.register_class(cls)
     bpy.utils.register_class(prefs.PoseThumbnailsPreferences)
+    evaluation.register()
+    snapshot.register()
+    try:
+        addon_prefs = prefs.for_addon()
+    except KeyError:
+        # The add-on is being enabled for the first time, so there are no
+        # stored preferences yet.
+        addon_prefs = prefs.default_preferences()
+    prefs.configure(addon_prefs)
 
     bpy.types.WindowManager.pose_mix_factor = bpy.props.FloatProperty(
         name='Mix Factor',
@@ -837,6 +1670,12 @@ def register():
 def unregister():
     """Unregister all pose thumbnails related things."""
     bpy.types.DATA_PT_pose_library.remove(pose_thumbnails_draw)
+    watcher.thumbnail_watcher.stop()
+    manifest.save_manifests()
+    loader.unregister()
+    evaluation.unregister()
+    snapshot.unregister()
+    profiling.set_enabled(False)
     for pcoll in preview_collections.values():
         bpy.utils.previews.remove(pcoll)
     preview_collections.clear()
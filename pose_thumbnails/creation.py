@@ -7,9 +7,9 @@ import os
 import re
 
 import bpy
-from bpy_extras.io_utils import ImportHelper
+from bpy_extras.io_utils import ExportHelper, ImportHelper
 
-from . import common
+from . import atlas, common, profiling
 
 logger = logging.getLogger(__name__)
 IMAGE_EXTENSIONS = {
@@ -44,11 +44,10 @@ def get_pose_from_thumbnail(thumbnail):
     if thumbnail is None:
         return
     poselib = bpy.context.object.pose_library
-    for pose in poselib.pose_markers:
-        if pose.frame == thumbnail.frame:
-            return pose
+    return common.pose_marker_index.get(poselib, thumbnail.frame)
 
 
+@profiling.timed('draw_creation')
 def draw_creation(layout, pose_thumbnail_options, poselib):
     if poselib.library:
         layout.label('Not showing creation options for linked pose libraries')
@@ -86,7 +85,7 @@ def draw_creation(layout, pose_thumbnail_options, poselib):
         row = sub_col.row(align=True)
         row_col = row.column(align=True)
         row_col.operator(POSELIB_OT_remove_pose_thumbnail.bl_idname, text='Remove')
-        if common.get_thumbnail_from_pose(poselib.pose_markers.active):
+        if thumbnail:
             row_col.enabled = True
         else:
             row_col.enabled = False
@@ -102,6 +101,11 @@ def draw_creation(layout, pose_thumbnail_options, poselib):
             icon='FILE_REFRESH',
             text='Refresh',
         )
+        sub_col.operator(
+            POSELIB_OT_pack_thumbnails.bl_idname,
+            icon='PACKAGE',
+            text='Pack into Atlas',
+        )
 
 
 class POSELIB_OT_add_thumbnail(bpy.types.Operator, ImportHelper):
@@ -148,11 +152,8 @@ class POSELIB_OT_add_thumbnail(bpy.types.Operator, ImportHelper):
                 os.path.basename(filepath)))
         poselib = context.object.pose_library
         pose = poselib.pose_markers.active
-        thumbnail = (common.get_thumbnail_from_pose(pose) or
-                     poselib.pose_thumbnails.add())
-        thumbnail.frame = pose.frame
-        thumbnail.filepath = filepath
-        common.clear_cached_pose_thumbnails()
+        common.set_thumbnail(pose, filepath)
+        common.update_cached_pose_thumbnails(poselib, [pose.frame], reload_paths=[filepath])
         return {'FINISHED'}
 
     def draw(self, context):
@@ -262,13 +263,12 @@ class POSELIB_OT_add_thumbnails_from_dir(bpy.types.Operator, ImportHelper):
 
     def create_thumbnail(self, pose, image):
         """Create or update the thumbnail for a pose."""
-        if not self.overwrite_existing and common.get_thumbnail_from_pose(pose):
+        thumbnail = common.get_thumbnail_from_pose(pose)
+        if thumbnail and (not self.overwrite_existing or thumbnail.filepath == image):
             return
-        poselib = self.poselib
-        thumbnail = (common.get_thumbnail_from_pose(pose) or
-                     poselib.pose_thumbnails.add())
-        thumbnail.frame = pose.frame
-        thumbnail.filepath = image
+        common.set_thumbnail(pose, image)
+        self.changed_frames.append(pose.frame)
+        self.assigned_images.append(image)
 
     def get_image_by_number(self, number):
         """Return a the image file if it contains the number.
@@ -341,8 +341,11 @@ class POSELIB_OT_add_thumbnails_from_dir(bpy.types.Operator, ImportHelper):
     def execute(self, context):
         self.poselib = context.object.pose_library
         self.image_files = self.get_images_from_dir()
+        self.changed_frames = []
+        self.assigned_images = []
         self.match_thumbnails()
-        common.clear_cached_pose_thumbnails()
+        common.update_cached_pose_thumbnails(
+            self.poselib, self.changed_frames, reload_paths=self.assigned_images)
         return {'FINISHED'}
 
     def draw(self, context):
@@ -374,11 +377,10 @@ class POSELIB_OT_remove_pose_thumbnail(bpy.types.Operator):
     def execute(self, context):
         poselib = context.object.pose_library
         pose = poselib.pose_markers.active
-        common.clear_cached_pose_thumbnails()
-        for i, thumbnail in enumerate(poselib.pose_thumbnails):
-            if pose.frame == thumbnail.frame:
-                poselib.pose_thumbnails.remove(i)
-                break
+        index = common.thumbnail_index.index(poselib, pose.frame)
+        if index is not None:
+            poselib.pose_thumbnails.remove(index)
+        common.update_cached_pose_thumbnails(poselib, [pose.frame])
         return {'FINISHED'}
 
 
@@ -391,7 +393,7 @@ class POSELIB_OT_remove_all_thumbnails(bpy.types.Operator):
     def execute(self, context):
         poselib = context.object.pose_library
         poselib.pose_thumbnails.clear()
-        common.clear_cached_pose_thumbnails()
+        common.discard_cached_pose_thumbnails(poselib)
         return {'FINISHED'}
 
 
@@ -432,11 +434,134 @@ class POSELIB_OT_refresh_thumbnails(bpy.types.Operator):
         self.poselib = context.object.pose_library
         self.remove_unused_thumbnails()
         self.remove_double_thumbnails()
-        common.clear_cached_pose_thumbnails(full_clear=True)
+        common.refresh_cached_pose_thumbnails(self.poselib)
         return {'FINISHED'}
 
 
+class POSELIB_OT_pack_thumbnails(bpy.types.Operator, ExportHelper):
+    """Pack all thumbnails of the pose library into a single atlas file"""
+    bl_idname = 'poselib.pack_thumbnails'
+    bl_label = 'Pack Thumbnails into Atlas'
+    bl_options = {'PRESET', 'UNDO'}
+
+    filename_ext = atlas.ATLAS_EXTENSION
+    filter_glob = bpy.props.StringProperty(
+        default='*' + atlas.ATLAS_EXTENSION,
+        options={'HIDDEN'},
+    )
+    tile_size = bpy.props.IntProperty(
+        name='Tile Size',
+        description='Width and height in pixels of each thumbnail in the atlas',
+        default=128,
+        min=16,
+        max=1024,
+    )
+    use_atlas = bpy.props.BoolProperty(
+        name='Use Atlas',
+        description='Let the thumbnails refer to the atlas instead of the separate image files',
+        default=True,
+    )
+    use_relative_path = bpy.props.BoolProperty(
+        name='Relative Path',
+        description='Refer to the atlas relative to the blend file',
+        default=True,
+    )
+
+    @classmethod
+    def poll(cls, context):
+        return (context is not None and
+                context.object and
+                context.object.pose_library and
+                not context.object.pose_library.library and
+                context.object.pose_library.pose_thumbnails)
+
+    def invoke(self, context, event):
+        poselib = context.object.pose_library
+        filename = bpy.path.clean_name(poselib.name) + atlas.ATLAS_EXTENSION
+        if bpy.data.filepath:
+            self.filepath = os.path.join(os.path.dirname(bpy.data.filepath), filename)
+        else:
+            # Let the file browser pick the directory, instead of the current
+            # working directory.
+            self.filepath = filename
+        context.window_manager.fileselect_add(self)
+        return {'RUNNING_MODAL'}
+
+    def read_tile(self, abspath):
+        """Return the image as tile pixels, or None if it can't be read."""
+        source_path, tile_index = atlas.split_tile_path(abspath)
+        try:
+            if tile_index is None:
+                image = bpy.data.images.load(abspath, check_existing=False)
+            else:
+                image = self.image_from_tile(source_path, tile_index)
+        except (RuntimeError, OSError, ValueError, IndexError) as ex:
+            logger.warning('Not packing %s: %s', abspath, ex)
+            return None
+        try:
+            return atlas.image_to_tile(image, self.tile_size)
+        finally:
+            bpy.data.images.remove(image)
+
+    def image_from_tile(self, atlas_path, tile_index):
+        """Create a temporary image from a tile of an existing atlas."""
+        import numpy
+
+        tile_atlas = atlas.open_atlas(atlas_path)
+        size = tile_atlas.tile_size
+        pixels = numpy.frombuffer(tile_atlas.tile(tile_index), dtype=numpy.uint8)
+        image = bpy.data.images.new('pose-thumbnail-tile', size, size, alpha=True)
+        image.pixels = (pixels.astype(numpy.float32) / 255.0).tolist()
+        return image
+
+    def execute(self, context):
+        poselib = context.object.pose_library
+        filepath = bpy.path.ensure_ext(self.filepath, atlas.ATLAS_EXTENSION)
+
+        tiles = []
+        packed_thumbnails = []
+        for thumbnail in poselib.pose_thumbnails:
+            abspath = common.get_thumbnail_abspath(poselib, thumbnail.filepath)
+            pixels = self.read_tile(abspath)
+            if pixels is None:
+                continue
+            tiles.append((thumbnail.frame, pixels))
+            packed_thumbnails.append(thumbnail)
+        if not tiles:
+            self.report({'ERROR'}, 'None of the thumbnails could be read')
+            return {'CANCELLED'}
+
+        # Release our mapping of the atlas, in case we are overwriting it.
+        atlas.forget_atlases()
+        atlas.write_atlas(filepath, self.tile_size, tiles)
+        self.report({'INFO'}, 'Packed %d thumbnails into %s' % (len(tiles), filepath))
+
+        if self.use_atlas:
+            if self.use_relative_path and not bpy.data.filepath:
+                self.report({'WARNING'}, 'The blend file is not saved, so the thumbnails '
+                                         'refer to the atlas by its absolute path')
+            elif self.use_relative_path:
+                try:
+                    filepath = bpy.path.relpath(filepath)
+                except ValueError:
+                    # On Windows, when the atlas is on another drive.
+                    pass
+            for tile_index, thumbnail in enumerate(packed_thumbnails):
+                thumbnail.filepath = atlas.tile_path(filepath, tile_index)
+            common.update_cached_pose_thumbnails(
+                poselib, [thumbnail.frame for thumbnail in packed_thumbnails])
+        return {'FINISHED'}
+
+    def draw(self, context):
+        layout = self.layout
+        col = layout.column()
+        col.prop(self, 'tile_size')
+        col.prop(self, 'use_atlas')
+        col.prop(self, 'use_relative_path')
+
+
 classes = [
+    POSELIB_OT_pack_thumbnails,
     POSELIB_OT_refresh_thumbnails,
     POSELIB_OT_remove_all_thumbnails,
     POSELIB_OT_remove_pose_thumbnail,
@@ -0,0 +1,387 @@
+"""Evaluation of poses straight from the F-Curves of the pose library.
+
+Applying a library pose with bpy.ops.poselib.apply_pose() to find out what
+it looks like costs an operator call, a depsgraph update and a restore of
+the original pose. Instead, the F-Curves of the pose library are evaluated
+at the frame of the pose marker, and the values are put into the pose
+snapshot directly (see snapshot.capture()). The armature is only written
+when the mixed or final pose is applied.
+
+Which F-Curves belong to which bone, and which bones are keyed in which
+pose, is parsed once per pose library into a LibraryLayout. Just like
+poselib.apply_pose, a pose only changes the bones that have a keyframe at
+the frame of its pose marker, so applying a hand pose from a full-body
+library only touches the hand bones.
+
+Layouts are rebuilt when the pose library changes, without looking at its
+keyframes on every lookup: a scene_update_post handler invalidates the
+layouts of actions that Blender marks as updated, and the add-on calls
+invalidate() after changing an action itself. Added or removed F-Curves and
+pose markers are noticed on every lookup as well, as they are cheap to
+count. All layouts are forgotten on undo, redo and when a file is loaded.
+"""
+
+import collections
+import logging
+import re
+import typing
+
+import bpy
+import numpy
+
+logger = logging.getLogger(__name__)
+
+# Matches 'pose.bones["name"].location', 'pose.bones["name"]["prop"]' and
+# 'pose.bones[3].location', which refers to the bone by its index.
+fcurve_path_re = re.compile(r'^pose\.bones\[(?:"((?:[^"\\]|\\.)*)"|(\d+))\]\.?(.+)$')
+ROTATION_CHANNELS = {
+    'QUATERNION': 'rotation_quaternion',
+    'AXIS_ANGLE': 'rotation_axis_angle',
+}
+"""The rotation channel per rotation mode; all others are Euler modes."""
+
+
+def _escape(name: str) -> str:
+    return re.sub(r'(["\\])', r'\\\1', name)
+
+
+def _unescape(name: str) -> str:
+    return re.sub(r'\\(.)', r'\1', name)
+
+
+def bone_path(bone_name: str, channel: str) -> str:
+    """Return the F-Curve data path of a channel of a bone.
+
+    >>> bone_path('arm.L', 'location')
+    'pose.bones["arm.L"].location'
+    >>> bone_path('eye.L', '["blink"]')
+    'pose.bones["eye.L"]["blink"]'
+    """
+    if channel.startswith('['):
+        return 'pose.bones["%s"]%s' % (_escape(bone_name), channel)
+    return 'pose.bones["%s"].%s' % (_escape(bone_name), channel)
+
+
+def split_bone_path(data_path: str) \
+        -> typing.Optional[typing.Tuple[typing.Optional[str], typing.Optional[int], str]]:
+    """Split the F-Curve data path of a bone channel, the inverse of bone_path().
+
+    Returns (bone name, None, channel), or (None, bone index, channel) for
+    paths that refer to the bone by index, or None for other paths.
+
+    >>> split_bone_path('pose.bones["arm.L"].location')
+    ('arm.L', None, 'location')
+    >>> split_bone_path('pose.bones[3]["blink"]')
+    (None, 3, '["blink"]')
+    >>> split_bone_path('location')
+    """
+    match = fcurve_path_re.match(data_path)
+    if not match:
+        return None
+    bone_name, bone_index, channel = match.groups()
+    if bone_name is not None:
+        return _unescape(bone_name), None, channel
+    return None, int(bone_index), channel
+
+
+def property_channel(key: str) -> str:
+    """Return the channel of a custom property, the inverse of custom_property_key().
+
+    >>> property_channel('blink')
+    '["blink"]'
+    """
+    return '["%s"]' % _escape(key)
+
+
+def rotation_channel(rotation_mode: str) -> str:
+    """Return the name of the property that holds the rotation of a bone.
+
+    >>> rotation_channel('QUATERNION')
+    'rotation_quaternion'
+    >>> rotation_channel('XYZ')
+    'rotation_euler'
+    """
+    return ROTATION_CHANNELS.get(rotation_mode, 'rotation_euler')
+
+
+def custom_property_key(channel: str) -> typing.Optional[str]:
+    """Return the key of a custom property channel, or None for other channels.
+
+    >>> custom_property_key('["eyelid"]')
+    'eyelid'
+    >>> custom_property_key('location')
+    """
+    if channel.startswith('["') and channel.endswith('"]'):
+        return _unescape(channel[2:-2])
+    return None
+
+
+class LibraryLayout:
+    """The parsed F-Curves of a pose library.
+
+    F-Curves are referred to by their index in poselib.fcurves, as
+    references to Blender data don't survive undo.
+    """
+
+    def __init__(self):
+        self.fcurves = []  # type: typing.List[typing.Tuple[int, str, str]]
+        """(F-Curve index, bone name, channel) of the unmuted F-Curves of bones."""
+        self.bone_names = frozenset()  # type: typing.FrozenSet[str]
+        """All bones with F-Curves."""
+        self.pose_masks = []  # type: typing.List[typing.Dict[str, typing.FrozenSet[str]]]
+        """Per pose marker {bone name: channels with a keyframe} of the bones keyed in the pose."""
+        self.armature_pointer = 0
+        """The armature that bone indices in F-Curve paths were resolved with, if any."""
+        self.has_bone_indices = False
+        """Whether any F-Curve path refers to its bone by index."""
+        self.signature = ()
+
+    def pose_fcurves(self, pose_index: int) -> typing.Iterator[typing.Tuple[int, str, str]]:
+        """Yield (F-Curve index, bone name, channel) of the F-Curves applied by the pose.
+
+        These are all F-Curves of the bones that are keyed in the pose.
+        """
+        mask = self.pose_masks[pose_index]
+        return (entry for entry in self.fcurves if entry[1] in mask)
+
+    def resolves_with(self, armature_ob: typing.Optional[bpy.types.Object]) -> bool:
+        """Whether the bone indices in F-Curve paths are resolved for this armature."""
+        if not self.has_bone_indices or armature_ob is None:
+            return True
+        return self.armature_pointer == armature_ob.as_pointer()
+
+
+def _read_keyframes(keyframe_points, name: str) -> numpy.ndarray:
+    values = numpy.empty(len(keyframe_points) * 2, dtype=numpy.float32)
+    keyframe_points.foreach_get(name, values)
+    return values
+
+
+def _keyed_poses(frames: numpy.ndarray, key_frames: numpy.ndarray) -> numpy.ndarray:
+    """Return the indices of the frames that have a keyframe within half a frame.
+
+    Like poselib.apply_pose, a keyframe within half a frame counts. The key
+    frames must be sorted, as they are in an F-Curve.
+
+    >>> _keyed_poses(numpy.array([0.0, 5.0, 10.0, 20.0]), numpy.array([4.6, 10.0, 30.0]))
+    array([1, 2])
+    """
+    if not len(key_frames) or not len(frames):
+        return numpy.empty(0, dtype=numpy.intp)
+    right = numpy.searchsorted(key_frames, frames).clip(0, len(key_frames) - 1)
+    left = (right - 1).clip(0, None)
+    distances = numpy.minimum(numpy.abs(frames - key_frames[left]),
+                              numpy.abs(frames - key_frames[right]))
+    return numpy.flatnonzero(distances < 0.5)
+
+
+def _parse(poselib: bpy.types.Action,
+           armature_ob: typing.Optional[bpy.types.Object]) -> LibraryLayout:
+    layout = LibraryLayout()
+    frames = numpy.array([marker.frame for marker in poselib.pose_markers], dtype=numpy.float32)
+    pose_masks = [{} for _ in frames]
+    bone_names = set()
+    all_pose_bones = armature_ob.pose.bones if armature_ob is not None else None
+    for fcurve_index, fcurve in enumerate(poselib.fcurves):
+        if fcurve.mute:
+            continue
+        parsed = split_bone_path(fcurve.data_path)
+        if parsed is None:
+            continue
+        bone_name, bone_index, channel = parsed
+        if bone_name is None:
+            layout.has_bone_indices = True
+            if all_pose_bones is None or bone_index >= len(all_pose_bones):
+                logger.debug('Unable to resolve bone index of F-Curve %r', fcurve.data_path)
+                continue
+            bone_name = all_pose_bones[bone_index].name
+        layout.fcurves.append((fcurve_index, bone_name, channel))
+        bone_names.add(bone_name)
+
+        key_frames = _read_keyframes(fcurve.keyframe_points, 'co')[0::2]
+        for pose_index in _keyed_poses(frames, key_frames):
+            pose_masks[pose_index].setdefault(bone_name, set()).add(channel)
+
+    if layout.has_bone_indices and armature_ob is not None:
+        layout.armature_pointer = armature_ob.as_pointer()
+    layout.bone_names = frozenset(bone_names)
+    layout.pose_masks = [{bone_name: frozenset(channels) for bone_name, channels in mask.items()}
+                         for mask in pose_masks]
+    return layout
+
+
+_layouts = {}  # {poselib pointer: LibraryLayout}
+_update_stamps = collections.Counter()  # {poselib pointer: number of invalidations}
+
+
+def _signature(poselib: bpy.types.Action, key: int) -> tuple:
+    return len(poselib.fcurves), len(poselib.pose_markers), _update_stamps[key]
+
+
+def library_layout(poselib: bpy.types.Action,
+                   armature_ob: bpy.types.Object = None) -> LibraryLayout:
+    """Return the up to date layout of the pose library, parsing it when needed.
+
+    :param armature_ob: the armature to resolve F-Curve paths with for
+        bones that are referred to by index. Without it, such paths are
+        resolved with the armature of the cached layout, if any.
+    """
+    key = poselib.as_pointer()
+    signature = _signature(poselib, key)
+    layout = _layouts.get(key)
+    if (layout is not None and layout.signature == signature
+            and layout.resolves_with(armature_ob)):
+        return layout
+
+    logger.debug('Parsing F-Curves of pose library %s', poselib.name)
+    layout = _parse(poselib, armature_ob)
+    layout.signature = signature
+    _layouts[key] = layout
+    return layout
+
+
+def invalidate(action: bpy.types.Action):
+    """Mark the layout of the action as outdated, after changing its F-Curves or poses."""
+    _update_stamps[action.as_pointer()] += 1
+
+
+def invalidate_updated(actions: typing.Iterable[bpy.types.Action]):
+    """Invalidate the layouts of the actions that Blender marked as updated."""
+    for action in actions:
+        if action.is_updated or action.is_updated_data:
+            invalidate(action)
+
+
+def forget_layouts():
+    _layouts.clear()
+    _update_stamps.clear()
+
+
+class PoseValues:
+    """The values of the channels keyed in a library pose.
+
+    Stored as a (bones x columns) array, where each column is a channel
+    ('location', or '["prop"]' for custom properties) and array index. The
+    rows and columns of the poses of a pose table are shared.
+    """
+
+    def __init__(self, bone_rows: typing.Mapping[str, int],
+                 columns: typing.Mapping[typing.Tuple[str, int], int],
+                 values: numpy.ndarray, keyed: numpy.ndarray):
+        self.bone_rows = bone_rows  # {bone name: row}
+        self.columns = columns  # {(channel, array index): column}
+        self.values = values
+        self.keyed = keyed  # whether each value is keyed in the pose
+
+    @classmethod
+    def from_entries(cls, entries: typing.Iterable[typing.Tuple[str, str, int, float]]) \
+            -> 'PoseValues':
+        """Collect (bone name, channel, array index, value) entries."""
+        bone_rows = collections.OrderedDict()
+        columns = collections.OrderedDict()
+        cells = []
+        for bone_name, channel, array_index, value in entries:
+            row = bone_rows.setdefault(bone_name, len(bone_rows))
+            column = columns.setdefault((channel, array_index), len(columns))
+            cells.append((row, column, value))
+        values = numpy.zeros((len(bone_rows), len(columns)), dtype=numpy.float32)
+        keyed = numpy.zeros(values.shape, dtype=bool)
+        if cells:
+            rows, cell_columns, cell_values = zip(*cells)
+            values[rows, cell_columns] = cell_values
+            keyed[rows, cell_columns] = True
+        return cls(bone_rows, columns, values, keyed)
+
+    def rows(self, bone_names: typing.Iterable[str]) -> numpy.ndarray:
+        """Return the row of each bone, or -1 for bones without values."""
+        return numpy.array([self.bone_rows.get(bone_name, -1) for bone_name in bone_names],
+                           dtype=numpy.intp)
+
+    def put(self, target: numpy.ndarray, rows: numpy.ndarray, channel: str):
+        """Replace values in target by the keyed values of the channel.
+
+        :param target: (bones x array indices) values of the channel.
+        :param rows: the row of each bone of target, see rows().
+        """
+        has_row = rows >= 0
+        for array_index in range(target.shape[1]):
+            column = self.columns.get((channel, array_index))
+            if column is None:
+                continue
+            replaced = has_row.copy()
+            replaced[has_row] = self.keyed[rows[has_row], column]
+            target[replaced, array_index] = self.values[rows[replaced], column]
+
+    def channel(self, row: int, channel: str) -> typing.Dict[int, float]:
+        """Return {array index: value} of the keyed values of a channel of one bone."""
+        if row < 0:
+            return {}
+        keyed = {}
+        for (column_channel, array_index), column in self.columns.items():
+            if column_channel == channel and self.keyed[row, column]:
+                keyed[array_index] = float(self.values[row, column])
+        return keyed
+
+    def properties(self, row: int) -> typing.Dict[str, float]:
+        """Return {key: value} of the keyed numeric custom properties of one bone."""
+        if row < 0:
+            return {}
+        keyed = {}
+        for (channel, array_index), column in self.columns.items():
+            key = custom_property_key(channel)
+            if key and array_index == 0 and self.keyed[row, column]:
+                keyed[key] = float(self.values[row, column])
+        return keyed
+
+
+def evaluate_pose(poselib: bpy.types.Action, pose_index: int,
+                  armature_ob: bpy.types.Object = None) -> PoseValues:
+    """Evaluate the F-Curves of a pose of the pose library.
+
+    Like poselib.apply_pose, only F-Curves of the bones that are keyed in
+    the pose are used, and channels that are not keyed are left out.
+    """
+    frame = poselib.pose_markers[pose_index].frame
+    fcurves = poselib.fcurves
+    layout = library_layout(poselib, armature_ob)
+    entries = []
+    for fcurve_index, bone_name, channel in layout.pose_fcurves(pose_index):
+        fcurve = fcurves[fcurve_index]
+        entries.append((bone_name, channel, fcurve.array_index, fcurve.evaluate(frame)))
+    return PoseValues.from_entries(entries)
+
+
+@bpy.app.handlers.persistent
+def _forget_layouts_handler(*args):
+    # Undo and loading a file replace the actions, and a new action can
+    # get the address of an old one.
+    forget_layouts()
+
+
+@bpy.app.handlers.persistent
+def _scene_update_handler(scene):
+    actions = bpy.data.actions
+    if _layouts and actions.is_updated:
+        invalidate_updated(actions)
+
+
+_handler_lists = ('load_post', 'undo_post', 'redo_post')
+
+
+def register():
+    for name in _handler_lists:
+        handlers = getattr(bpy.app.handlers, name)
+        if _forget_layouts_handler not in handlers:
+            handlers.append(_forget_layouts_handler)
+    if _scene_update_handler not in bpy.app.handlers.scene_update_post:
+        bpy.app.handlers.scene_update_post.append(_scene_update_handler)
+
+
+def unregister():
+    for name in _handler_lists:
+        handlers = getattr(bpy.app.handlers, name)
+        if _forget_layouts_handler in handlers:
+            handlers.remove(_forget_layouts_handler)
+    if _scene_update_handler in bpy.app.handlers.scene_update_post:
+        bpy.app.handlers.scene_update_post.remove(_scene_update_handler)
+    forget_layouts()
@@ -1,5 +1,6 @@
 """Pose flipping stuff."""
 
+import functools
 import typing
 
 # We import 'bpy' to make 'import mathutils' work when running outside
@@ -8,11 +9,34 @@ import typing
 import bpy
 import mathutils
 
+try:
+    import numpy
+except ImportError:
+    # Blender ships with NumPy, but this allows running the doctests without it.
+    numpy = None
+
+
+SEPARATORS = frozenset('. -_')
+DIGITS = frozenset('0123456789')
+SIDE_REPLACEMENTS = {
+    'l': 'r',
+    'L': 'R',
+    'r': 'l',
+    'R': 'L',
+}
+# Prefixes and suffixes of the long side names, and what they flip to.
+# Everything that is not 'Ri'/'RI' ('Le'/'LE') flips to lower case.
+LONG_RIGHT = {'Ri': 'Left', 'RI': 'LEFT'}
+LONG_LEFT = {'Le': 'Right', 'LE': 'RIGHT'}
+NAME_CACHE_SIZE = 8192
+"""Number of flipped names that are remembered."""
+
 
 def name(to_flip: str, strip_number=False) -> str:
     """Flip left and right indicators in the name.
 
     Basically a Python implementation of BLI_string_flip_side_name.
+    Results are memoized, as the same bone names are flipped over and over.
 
     >>> name('bone_L.004')
     'bone_R.004'
@@ -39,92 +63,76 @@ def name(to_flip: str, strip_number=False) -> str:
     >>> name('some.bone-Left.004')
     'some.bone-Right.004'
     """
-    import string
+    return _flip_name(to_flip, strip_number)
+
+
+def names(to_flip: typing.Iterable[str], strip_number=False) -> typing.List[str]:
+    """Flip left and right indicators in all names.
+
+    >>> names(['arm.L', 'spine', 'Right_hand'])
+    ['arm.R', 'spine', 'Left_hand']
+    """
+    return [_flip_name(bone_name, strip_number) for bone_name in to_flip]
+
 
+@functools.lru_cache(maxsize=NAME_CACHE_SIZE)
+def _flip_name(to_flip: str, strip_number: bool) -> str:
     if len(to_flip) < 3:
         # we don't do names like .R or .L
         return to_flip
 
-    # TODO: define once and reuse
-    separators = set('. -_')
-    replacements = {
-        'l': 'r',
-        'L': 'R',
-        'r': 'l',
-        'R': 'L',
-    }
-
     prefix = suffix = number = ''
-    is_set = False
 
     # We first check the case with a .### extension, let's find the last period
     replace = to_flip
-    if to_flip[-1] in string.digits:
-        try:
-            index = to_flip.rindex('.')
-        except ValueError:
-            pass
-        else:
-            if to_flip[index + 1] in string.digits:
-                # doesnt handle case bone.1abc2 correct..., whatever
-                if not strip_number:
-                    number = to_flip[index:]
-                replace = to_flip[:index]
+    if to_flip[-1] in DIGITS:
+        index = to_flip.rfind('.')
+        if index >= 0 and to_flip[index + 1] in DIGITS:
+            # doesnt handle case bone.1abc2 correct..., whatever
+            if not strip_number:
+                number = to_flip[index:]
+            replace = to_flip[:index]
 
     # first case; separator . - _ with extensions r R l L
-    if len(replace) > 1 and replace[-2] in separators:
-        is_set = replace[-1] in replacements
-        if is_set:
-            replace = replace[:-1] + replacements[replace[-1]]
+    if len(replace) > 1 and replace[-2] in SEPARATORS and replace[-1] in SIDE_REPLACEMENTS:
+        return replace[:-1] + SIDE_REPLACEMENTS[replace[-1]] + number
 
     # case; beginning with r R l L, with separator after it
-    if not is_set and len(replace) > 1 and replace[1] in separators:
-        is_set = replace[0] in replacements
-        if is_set:
-            replace = replacements[replace[0]] + replace[1:]
-
-    if not is_set:
-        lower = replace.lower()
-        if lower.startswith('right'):
-            bit = replace[0:2]
-            if bit == 'Ri':
-                prefix = 'Left'
-            elif bit == 'RI':
-                prefix = 'LEFT'
-            else:
-                prefix = 'left'
-            replace = replace[5:]
-        elif lower.startswith('left'):
-            bit = replace[0:2]
-            if bit == 'Le':
-                prefix = 'Right'
-            elif bit == 'LE':
-                prefix = 'RIGHT'
-            else:
-                prefix = 'right'
-            replace = replace[4:]
-        elif lower.endswith('right'):
-            bit = replace[-5:-3]
-            if bit == 'Ri':
-                suffix = 'Left'
-            elif bit == 'RI':
-                suffix = 'LEFT'
-            else:
-                suffix = 'left'
-            replace = replace[:-5]
-        elif lower.endswith('left'):
-            bit = replace[-4:-2]
-            if bit == 'Le':
-                suffix = 'Right'
-            elif bit == 'LE':
-                suffix = 'RIGHT'
-            else:
-                suffix = 'right'
-            replace = replace[:-4]
+    if len(replace) > 1 and replace[1] in SEPARATORS and replace[0] in SIDE_REPLACEMENTS:
+        return SIDE_REPLACEMENTS[replace[0]] + replace[1:] + number
+
+    lower = replace.lower()
+    if lower.startswith('right'):
+        prefix = LONG_RIGHT.get(replace[0:2], 'left')
+        replace = replace[5:]
+    elif lower.startswith('left'):
+        prefix = LONG_LEFT.get(replace[0:2], 'right')
+        replace = replace[4:]
+    elif lower.endswith('right'):
+        suffix = LONG_RIGHT.get(replace[-5:-3], 'left')
+        replace = replace[:-5]
+    elif lower.endswith('left'):
+        suffix = LONG_LEFT.get(replace[-4:-2], 'right')
+        replace = replace[:-4]
 
     return prefix + replace + suffix + number
 
 
+@functools.lru_cache(maxsize=16)
+def mirror_indices(bone_names: typing.Tuple[str, ...]) -> typing.Tuple[int, ...]:
+    """Return, for each bone, the index of the bone on the other side.
+
+    Bones without a bone on the other side get -1; bones in the center are
+    their own mirror. Cached by the bone names, so this is only computed once
+    per armature (or once for several armatures of the same rig).
+
+    >>> mirror_indices(('spine', 'arm.L', 'arm.R', 'hand.L'))
+    (0, 2, 1, -1)
+    """
+    indices = {bone_name: index for index, bone_name in enumerate(bone_names)}
+    return tuple(indices.get(flipped_name, -1) for flipped_name in names(bone_names))
+
+
 def matrix(m44: mathutils.Matrix) -> mathutils.Matrix:
     """Flips the matrix around the X-axis.
 
@@ -190,7 +198,68 @@ def _round(m44: mathutils.Matrix):
 
 
 def pixels(values: typing.MutableSequence, width: int, height: int):
-    """In-place flips the pixels of an image."""
+    """In-place flips the pixels of an image.
+
+    The pixels are read and written in one go when NumPy is available.
+
+    >>> values = list(range(6))
+    >>> pixels(values, 3, 2)
+    >>> values
+    [2, 1, 0, 5, 4, 3]
+    """
+    if numpy is None:
+        pixels_per_row(values, width, height)
+        return
+    _write_pixels(values, mirrored_pixels(values, width, height))
+
+
+def copy_mirrored(source: typing.Sequence, target: typing.MutableSequence,
+                  width: int, height: int):
+    """Write the flipped pixels of source into target.
+
+    >>> target = [0] * 6
+    >>> copy_mirrored(range(6), target, 3, 2)
+    >>> target
+    [2, 1, 0, 5, 4, 3]
+    """
+    if numpy is None:
+        values = list(source)
+        pixels_per_row(values, width, height)
+        target[:] = values
+        return
+    _write_pixels(target, mirrored_pixels(source, width, height))
+
+
+def mirrored_pixels(values: typing.Sequence, width: int, height: int) -> 'numpy.ndarray':
+    """Return a flipped copy of the pixels as a flat NumPy array.
+
+    The values are read with a single foreach_get() call when they are a
+    bpy_prop_array that supports it. The mirroring itself is a strided view,
+    so only the final contiguous copy is made.
+    """
+    buffer = numpy.empty(width * height, dtype=numpy.int32)
+    if hasattr(values, 'foreach_get'):
+        values.foreach_get(buffer)
+    else:
+        buffer[:] = values
+    return numpy.ascontiguousarray(buffer.reshape(height, width)[:, ::-1]).ravel()
+
+
+def _write_pixels(target: typing.MutableSequence, buffer: 'numpy.ndarray'):
+    if hasattr(target, 'foreach_set'):
+        target.foreach_set(buffer)
+    else:
+        target[:] = buffer.tolist()
+
+
+def pixels_per_row(values: typing.MutableSequence, width: int, height: int):
+    """In-place flips the pixels of an image, one row at a time.
+
+    >>> values = list(range(6))
+    >>> pixels_per_row(values, 3, 2)
+    >>> values
+    [2, 1, 0, 5, 4, 3]
+    """
 
     start = 0
     end = width
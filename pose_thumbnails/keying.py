@@ -0,0 +1,299 @@
+"""Direct insertion of keyframes for applied poses.
+
+Auto-keying through bpy.ops.anim.keyframe_insert_menu() requires the bones
+to be selected, and keys every channel of every selected bone ('Whole
+Character'). Instead, keyframes are only inserted for the channels that
+applying the pose actually changed, straight into the F-Curves of the
+active action of the armature.
+
+The active keying set is respected when it is an absolute keying set (its
+paths are known) or one of the built-in keying sets in BUILTIN_KEYING_SETS.
+Other keying sets, and visual keying, can't be evaluated without the
+operator; is_supported() returns False for those.
+"""
+
+import collections
+import logging
+import typing
+
+import bpy
+import mathutils
+import numpy
+
+from . import evaluation, snapshot
+
+logger = logging.getLogger(__name__)
+
+ALL_KINDS = frozenset({'location', 'rotation', 'scale', 'properties'})
+BUILTIN_KEYING_SETS = {
+    'Location': frozenset({'location'}),
+    'Rotation': frozenset({'rotation'}),
+    'Scaling': frozenset({'scale'}),
+    'LocRot': frozenset({'location', 'rotation'}),
+    'LocScale': frozenset({'location', 'scale'}),
+    'LocRotScale': frozenset({'location', 'rotation', 'scale'}),
+    'RotScale': frozenset({'rotation', 'scale'}),
+    'Available': ALL_KINDS,
+    'WholeCharacter': ALL_KINDS,
+    'WholeCharacterSelected': ALL_KINDS,
+}
+"""The kinds of channels keyed by the built-in keying sets, by bl_idname."""
+
+KEYFRAME_THRESHOLD = 0.01
+"""Keyframes closer than this many frames are the same keyframe, like in Blender."""
+NEEDED_THRESHOLD = 1e-6
+"""With 'Only Insert Needed', values that differ less than this are not keyed."""
+NEW_KEYFRAME_DEFAULTS = ('BEZIER', 'AUTO_CLAMPED')
+"""Interpolation and handle type of keyframes created by keyframe_points.add()."""
+
+# (data path, array index, value, group name)
+Keyframe = typing.Tuple[str, int, float, str]
+
+
+def is_supported(keying_set: typing.Optional[bpy.types.KeyingSet]) -> bool:
+    """Return whether keys for the keying set can be inserted directly."""
+    if keying_set is None or keying_set.is_path_absolute:
+        return True
+    return keying_set.bl_idname in BUILTIN_KEYING_SETS
+
+
+def _changed_rows(pose: snapshot.PoseSnapshot, rows: numpy.ndarray,
+                  original: snapshot.PoseSnapshot, original_rows: numpy.ndarray,
+                  name: str) -> numpy.ndarray:
+    """Return a boolean array that is True for the rows of pose that differ from original."""
+    changed = numpy.ones(len(pose), dtype=bool)
+    changed[rows] = (getattr(pose, name)[rows] != getattr(original, name)[original_rows]).any(
+        axis=1)
+    return changed
+
+
+def pose_keyframes(pose: snapshot.PoseSnapshot,
+                   original: snapshot.PoseSnapshot = None,
+                   kinds: typing.AbstractSet[str] = ALL_KINDS) -> typing.List[Keyframe]:
+    """Return the keyframes for the channels of the pose that differ from the original.
+
+    :param original: the pose before applying; when None, all channels of
+        the pose are keyed.
+    :param kinds: which kinds of channels to key, see ALL_KINDS.
+    """
+    all_pose_bones = pose.armature_ob.pose.bones
+    if original is None:
+        changed = {name: numpy.ones(len(pose), dtype=bool)
+                   for name in ('location', 'rotation', 'scale')}
+        original_props = {}
+    else:
+        rows, original_rows = pose.rows_matching(original)
+        changed = {name: _changed_rows(pose, rows, original, original_rows, name)
+                   for name in ('location', 'rotation', 'scale')}
+        original_props = {(original.bone_indices[row], key): value
+                          for (row, key), value in zip(original.prop_keys,
+                                                       original.prop_values.tolist())}
+
+    keyframes = []
+    for row, bone_index in enumerate(pose.bone_indices.tolist()):
+        pose_bone = all_pose_bones[bone_index]
+        if 'location' in kinds and changed['location'][row]:
+            keyframes.extend(_channel_keyframes(pose_bone, 'location', pose.location[row]))
+        if 'rotation' in kinds and changed['rotation'][row]:
+            channel = evaluation.rotation_channel(pose_bone.rotation_mode)
+            if pose.is_quaternion[row]:
+                values = pose.rotation[row]
+            else:
+                quaternion = mathutils.Quaternion(pose.rotation[row])
+                values = snapshot.rotation_values(pose_bone, quaternion)
+            keyframes.extend(_channel_keyframes(pose_bone, channel, values))
+        if 'scale' in kinds and changed['scale'][row]:
+            keyframes.extend(_channel_keyframes(pose_bone, 'scale', pose.scale[row]))
+
+    if 'properties' in kinds:
+        for (row, key), value in zip(pose.prop_keys, pose.prop_values.tolist()):
+            bone_index = pose.bone_indices[row]
+            if original_props.get((bone_index, key)) == value:
+                continue
+            bone_name = all_pose_bones[bone_index].name
+            data_path = evaluation.bone_path(bone_name, evaluation.property_channel(key))
+            keyframes.append((data_path, 0, value, bone_name))
+    return keyframes
+
+
+def _channel_keyframes(pose_bone: bpy.types.PoseBone, channel: str,
+                       values: typing.Iterable[float]) -> typing.Iterator[Keyframe]:
+    data_path = evaluation.bone_path(pose_bone.name, channel)
+    for array_index, value in enumerate(values):
+        yield data_path, array_index, float(value), pose_bone.name
+
+
+def filter_by_keying_set(keyframes: typing.List[Keyframe],
+                         keying_set: bpy.types.KeyingSet,
+                         armature_ob: bpy.types.Object) -> typing.List[Keyframe]:
+    """Only keep the keyframes of the paths in an absolute keying set."""
+    entire_arrays = set()
+    elements = set()
+    for path in keying_set.paths:
+        if path.id != armature_ob:
+            continue
+        if path.use_entire_array:
+            entire_arrays.add(path.data_path)
+        else:
+            elements.add((path.data_path, path.array_index))
+    return [keyframe for keyframe in keyframes
+            if keyframe[0] in entire_arrays or keyframe[:2] in elements]
+
+
+def insert_keyframes(armature_ob: bpy.types.Object,
+                     keyframes: typing.Iterable[Keyframe],
+                     frame: float,
+                     *, only_available=False, only_needed=False) -> int:
+    """Insert the keyframes into the active action of the armature.
+
+    Creates the action and F-Curves when necessary, unless only_available
+    is set.
+
+    :returns: the number of inserted keyframes.
+    """
+    return insert_keyframe_sequence(armature_ob, [(frame, keyframes)],
+                                    only_available=only_available, only_needed=only_needed)
+
+
+def insert_keyframe_sequence(armature_ob: bpy.types.Object,
+                             sequence: typing.Iterable[typing.Tuple[float,
+                                                                    typing.Iterable[Keyframe]]],
+                             *, only_available=False, only_needed=False) -> int:
+    """Insert keyframes at several frames into the active action of the armature.
+
+    All keyframes of an F-Curve are written in one go. When there are
+    several keyframes for the same channel and frame, the last one wins.
+
+    :param sequence: (frame, keyframes) pairs.
+    :returns: the number of inserted keyframes.
+    """
+    # {(data path, array index): (group name, {frame: value})}
+    batches = collections.OrderedDict()
+    for frame, keyframes in sequence:
+        for data_path, array_index, value, group_name in keyframes:
+            key = (data_path, array_index)
+            try:
+                batch = batches[key]
+            except KeyError:
+                batch = batches[key] = (group_name, collections.OrderedDict())
+            batch[1][frame] = value
+    if not batches:
+        return 0
+
+    action = _active_action(armature_ob, create=not only_available)
+    if action is None:
+        return 0
+
+    edit_prefs = bpy.context.user_preferences.edit
+    new_keyframe = (edit_prefs.keyframe_new_interpolation_type,
+                    edit_prefs.keyframe_new_handle_type)
+    fcurves = action.fcurves
+    inserted = 0
+    for (data_path, array_index), (group_name, values) in batches.items():
+        fcurve = fcurves.find(data_path, array_index)
+        if fcurve is None:
+            if only_available:
+                continue
+            fcurve = fcurves.new(data_path, array_index, group_name)
+        elif only_needed:
+            values = {frame: value for frame, value in values.items()
+                      if abs(fcurve.evaluate(frame) - value) >= NEEDED_THRESHOLD}
+            if not values:
+                continue
+        _insert_keyframes(fcurve, list(values.keys()), list(values.values()), new_keyframe)
+        inserted += len(values)
+    if inserted:
+        # The action may be a pose library, e.g. while editing its poses.
+        evaluation.invalidate(action)
+    return inserted
+
+
+def _active_action(armature_ob: bpy.types.Object, *, create: bool) \
+        -> typing.Optional[bpy.types.Action]:
+    anim_data = armature_ob.animation_data
+    action = anim_data.action if anim_data is not None else None
+    if action is not None or not create:
+        return action
+    if anim_data is None:
+        anim_data = armature_ob.animation_data_create()
+    action = bpy.data.actions.new(armature_ob.name + 'Action')
+    anim_data.action = action
+    return action
+
+
+def _read_points(keyframe_points, name: str) -> numpy.ndarray:
+    values = numpy.empty(len(keyframe_points) * 2, dtype=numpy.float32)
+    if len(keyframe_points):
+        keyframe_points.foreach_get(name, values)
+    return values.reshape((len(keyframe_points), 2))
+
+
+def _new_handles(key_frames: numpy.ndarray, added: numpy.ndarray) \
+        -> typing.Tuple[numpy.ndarray, numpy.ndarray]:
+    """Return the left and right handles of new keyframes.
+
+    Like keyframe_points.insert(), the handles are flat and reach a third of
+    the way to the neighbouring keyframes, or a third of a frame when there
+    is no neighbour on that side.
+
+    :param key_frames: the sorted frames of all keyframes, including the new ones.
+    :param added: (frame, value) of the new keyframes.
+    """
+    frames = added[:, 0]
+    before = numpy.searchsorted(key_frames, frames, side='left') - 1
+    after = numpy.searchsorted(key_frames, frames, side='right')
+    previous = numpy.where(before >= 0, key_frames[before.clip(0, None)], frames - 1)
+    following = numpy.where(after < len(key_frames),
+                            key_frames[after.clip(None, len(key_frames) - 1)], frames + 1)
+    handles_left = added.copy()
+    handles_left[:, 0] -= (frames - previous) / 3
+    handles_right = added.copy()
+    handles_right[:, 0] += (following - frames) / 3
+    return handles_left, handles_right
+
+
+def _insert_keyframes(fcurve: bpy.types.FCurve,
+                      frames: typing.List[float], values: typing.List[float],
+                      new_keyframe: typing.Tuple[str, str]):
+    """Insert or replace keyframes, like keyframe_points.insert() does for one keyframe.
+
+    Replaced keyframes keep the shape of their handles; new keyframes get
+    the interpolation and handle type of the user preferences.
+    """
+    points = fcurve.keyframe_points
+    count = len(points)
+    coordinates = _read_points(points, 'co')
+    handles_left = _read_points(points, 'handle_left')
+    handles_right = _read_points(points, 'handle_right')
+    keyframes = numpy.column_stack((numpy.array(frames, dtype=numpy.float32),
+                                    numpy.array(values, dtype=numpy.float32)))
+
+    replace = numpy.zeros(len(keyframes), dtype=bool)
+    if count:
+        distances = numpy.abs(keyframes[:, 0, None] - coordinates[None, :, 0])
+        nearest = distances.argmin(axis=1)
+        replace = distances[numpy.arange(len(keyframes)), nearest] < KEYFRAME_THRESHOLD
+        rows = nearest[replace]
+        deltas = keyframes[replace, 1] - coordinates[rows, 1]
+        coordinates[rows, 1] = keyframes[replace, 1]
+        handles_left[rows, 1] += deltas
+        handles_right[rows, 1] += deltas
+
+    added = keyframes[~replace]
+    if len(added):
+        points.add(len(added))
+    key_frames = numpy.sort(numpy.concatenate((coordinates[:, 0], added[:, 0])))
+    added_left, added_right = _new_handles(key_frames, added)
+    for name, existing, new in (('co', coordinates, added),
+                                ('handle_left', handles_left, added_left),
+                                ('handle_right', handles_right, added_right)):
+        points.foreach_set(name, numpy.concatenate((existing, new)).ravel())
+
+    interpolation, handle_type = new_keyframe
+    if (interpolation, handle_type) != NEW_KEYFRAME_DEFAULTS:
+        for index in range(count, count + len(added)):
+            point = points[index]
+            point.interpolation = interpolation
+            point.handle_left_type = point.handle_right_type = handle_type
+    # Sorts the keyframes and recalculates automatic handles.
+    fcurve.update()
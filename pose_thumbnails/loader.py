@@ -0,0 +1,349 @@
+"""Background loading of thumbnail images.
+
+Blender's preview API may only be used from the main thread, so the work is
+split in two: the slow file system access (existence check and reading the
+file into the OS cache, which dominates on network storage) runs on a thread
+pool, and the finished images are decoded into the preview collection on the
+main thread. Decoding is spread over several main-thread ticks, at most
+PROCESS_MAX_IMAGES images per tick, so that a large directory doesn't stall
+the UI in a single redraw. The enum items that were waiting for the image get
+their icon swapped in place, after which the thumbnail panels are redrawn.
+"""
+
+import collections
+import concurrent.futures
+import logging
+import os
+import time
+import typing
+
+import bpy
+import bpy.utils.previews
+
+from . import atlas, manifest, proxies
+
+logger = logging.getLogger(__name__)
+
+READ_CHUNK_SIZE = 1024 * 1024
+PROCESS_TIME_BUDGET = 0.02
+"""Maximum time in seconds spent per main-thread tick on finished images."""
+PROCESS_MAX_IMAGES = 16
+"""Maximum number of images decoded per main-thread tick."""
+PROCESS_INTERVAL = 0.05
+"""Interval in seconds between main-thread ticks, when bpy.app.timers exists."""
+
+
+def read_file(abspath: str) -> bool:
+    """Read the entire file, so that loading it later is served from the OS cache.
+
+    This only saves the main thread from waiting for the disk; the image is
+    still decoded on the main thread by ThumbnailLoader.process_finished().
+    Runs on a worker thread.
+
+    Returns:
+        whether the file exists.
+    """
+    try:
+        with open(abspath, 'rb') as infile:
+            while infile.read(READ_CHUNK_SIZE):
+                pass
+    except (FileNotFoundError, IsADirectoryError):
+        return False
+    return True
+
+
+def read_thumbnail(abspath: str, *, prefetch=True, known_stat=None) \
+        -> typing.Tuple[typing.Optional[os.stat_result], typing.Optional[proxies.Proxy]]:
+    """Read the proxy of the image, or the image itself if there is no proxy yet.
+
+    Atlas tiles are read from the memory-mapped atlas file.
+    Can be called from any thread.
+
+    :param prefetch: read the image file when there is no proxy, so that
+        loading it later is served from the OS cache.
+    :param known_stat: the state of the file as it was last loaded (see
+        manifest.known_stat()). It is trusted when there is a proxy or atlas
+        for it, so that the file doesn't have to be stat'ed at all.
+    :returns: the os.stat() result of the file (None if it doesn't exist),
+        or the trusted known_stat, and its proxy (or None).
+    """
+    source_path, tile_index = atlas.split_tile_path(abspath)
+    if known_stat is not None:
+        proxy = _read_cached(abspath, source_path, tile_index, known_stat)
+        if proxy is not None:
+            return known_stat, proxy
+
+    try:
+        stat = os.stat(source_path)
+    except FileNotFoundError:
+        return None, None
+    if known_stat is None or (stat.st_mtime_ns, stat.st_size) != tuple(known_stat):
+        proxy = _read_cached(abspath, source_path, tile_index, stat)
+        if proxy is not None:
+            return stat, proxy
+    if tile_index is not None:
+        return None, None
+    if prefetch and not read_file(abspath):
+        return None, None
+    return stat, None
+
+
+def _read_cached(abspath: str, source_path: str, tile_index: typing.Optional[int], stat) \
+        -> typing.Optional[proxies.Proxy]:
+    """Return the atlas tile or proxy of the file in the given state, or None."""
+    if tile_index is not None:
+        try:
+            tile_atlas = atlas.open_atlas(source_path, stat)
+            pixels = tile_atlas.tile(tile_index)
+        except OSError:
+            return None
+        except (ValueError, IndexError) as ex:
+            logger.warning('Unable to read thumbnail %s: %s', abspath, ex)
+            return None
+        return proxies.Proxy(tile_atlas.tile_size, tile_atlas.tile_size, pixels)
+
+    if proxies.proxy_cache.enabled:
+        return proxies.proxy_cache.read(abspath, stat)
+    return None
+
+
+class ThumbnailLoader:
+    """Loads thumbnail images on a thread pool and swaps them into enum items."""
+
+    def __init__(self):
+        self._executor = None
+        self.worker_count = 0
+        self._futures = collections.OrderedDict()  # {abspath: Future}
+        # {abspath: [(flipped, enum items, position, enum identifier), ...]}
+        self._waiting = collections.defaultdict(list)
+        self._pcoll = None
+
+    @property
+    def enabled(self) -> bool:
+        return self.worker_count > 0
+
+    def set_worker_count(self, worker_count: int):
+        """Set the number of worker threads; 0 disables background loading."""
+        if worker_count == self.worker_count:
+            return
+        had_pending = bool(self._waiting)
+        self.cancel()
+        if self._executor is not None:
+            self._executor.shutdown(wait=False)
+            self._executor = None
+        self.worker_count = worker_count
+        if had_pending:
+            # The cached enum items of the cancelled requests still have the
+            # placeholder icon; requesting them again needs fresh enum items.
+            from .common import clear_cached_pose_thumbnails
+            clear_cached_pose_thumbnails()
+
+    def request(self,
+                pcoll: bpy.utils.previews.ImagePreviewCollection,
+                abspath: str,
+                flipped: bool,
+                enum_items: list,
+                position: int):
+        """Load the image in the background and patch its icon into enum_items[position].
+
+        When flipped is True, the icon of the mirrored variant is patched in.
+        """
+
+        ident = enum_items[position][0]
+        self._waiting[abspath].append((flipped, enum_items, position, ident))
+        self._submit(pcoll, abspath)
+
+    def prefetch(self,
+                 pcoll: bpy.utils.previews.ImagePreviewCollection,
+                 abspath: str):
+        """Load the image in the background, without patching any enum items.
+
+        Used to load images before they are shown, for example the next page
+        of thumbnails.
+        """
+        if abspath in pcoll:
+            return
+        self._submit(pcoll, abspath)
+
+    def _submit(self,
+                pcoll: bpy.utils.previews.ImagePreviewCollection,
+                abspath: str):
+        if self._executor is None:
+            self._executor = concurrent.futures.ThreadPoolExecutor(
+                max_workers=self.worker_count)
+        self._pcoll = pcoll
+        if abspath not in self._futures:
+            source_path, _ = atlas.split_tile_path(abspath)
+            self._futures[abspath] = self._executor.submit(
+                read_thumbnail, abspath, known_stat=manifest.known_stat(source_path))
+        call_on_main_thread(self.process_finished)
+
+    def process_finished(self) -> bool:
+        """Put finished images into the preview collection.
+
+        Must be called from the main thread. Stops when PROCESS_MAX_IMAGES
+        images have been decoded or PROCESS_TIME_BUDGET has been used up; the
+        rest is done on the next tick.
+
+        Returns:
+            whether there is still work pending.
+        """
+        from . import core
+
+        if not self._futures:
+            return False
+
+        start = time.monotonic()
+        swapped = 0
+        decoded = 0
+        for abspath, future in list(self._futures.items()):
+            if not future.done():
+                continue
+            del self._futures[abspath]
+            waiting = self._waiting.pop(abspath, [])
+
+            try:
+                stat, proxy = future.result()
+            except Exception:
+                logger.exception('Error reading thumbnail %s', abspath)
+                stat, proxy = None, None
+
+            if abspath in self._pcoll:
+                # Loaded on the main thread in the mean time.
+                image = self._pcoll[abspath]
+            elif proxy is not None:
+                image = core.load_proxy(self._pcoll, abspath, proxy, stat)
+                decoded += 1
+            elif stat is not None:
+                image = core.load_preview(self._pcoll, abspath, stat)
+                decoded += 1
+            else:
+                image = core.get_no_thumbnail_image(self._pcoll)
+            exists = abspath in self._pcoll
+
+            for flipped, enum_items, position, ident in waiting:
+                position = _find_enum_item(enum_items, position, ident)
+                if position is None:
+                    continue
+                if flipped and exists:
+                    icon_id = core.get_flipped_image(self._pcoll, abspath, image).icon_id
+                else:
+                    icon_id = image.icon_id
+                _, name, description, _, number = enum_items[position]
+                enum_items[position] = (ident, name, description, icon_id, number)
+            swapped += len(waiting)
+
+            if decoded >= PROCESS_MAX_IMAGES or time.monotonic() - start > PROCESS_TIME_BUDGET:
+                break
+
+        if swapped:
+            logger.debug('Swapped in %d thumbnails, %d images pending',
+                         swapped, len(self._futures))
+            redraw_thumbnail_panels()
+        return bool(self._futures)
+
+    def run_in_background(self, func: typing.Callable, *args):
+        """Run func(*args) on the thread pool, or right away when background loading is off."""
+        if not self.enabled:
+            func(*args)
+            return
+        if self._executor is None:
+            self._executor = concurrent.futures.ThreadPoolExecutor(
+                max_workers=self.worker_count)
+        self._executor.submit(func, *args)
+
+    def cancel(self):
+        """Forget about all pending images."""
+        for future in self._futures.values():
+            future.cancel()
+        self._futures.clear()
+        self._waiting.clear()
+
+    def shutdown(self):
+        self.cancel()
+        if self._executor is not None:
+            self._executor.shutdown(wait=False)
+            self._executor = None
+        self._pcoll = None
+
+
+def _find_enum_item(enum_items: list, position: int, ident: str) -> typing.Optional[int]:
+    """Return the current position of the enum item, which may have moved since the request."""
+    if position < len(enum_items) and enum_items[position][0] == ident:
+        return position
+    for position, item in enumerate(enum_items):
+        if item[0] == ident:
+            return position
+    return None
+
+
+def redraw_thumbnail_panels():
+    """Tag all areas that can show pose thumbnails for redraw."""
+    for window in bpy.context.window_manager.windows:
+        for area in window.screen.areas:
+            if area.type in {'PROPERTIES', 'VIEW_3D'}:
+                area.tag_redraw()
+
+
+_main_thread_callbacks = set()
+
+
+def call_on_main_thread(callback: typing.Callable[[], bool]):
+    """Repeatedly call callback() on the main thread, until it returns False.
+
+    Must itself be called from the main thread.
+    """
+    _main_thread_callbacks.add(callback)
+    _schedule_processing()
+
+
+def _process_callbacks() -> bool:
+    for callback in list(_main_thread_callbacks):
+        try:
+            keep_going = callback()
+        except Exception:
+            logger.exception('Error in %s', callback)
+            keep_going = False
+        if not keep_going:
+            _main_thread_callbacks.discard(callback)
+    return bool(_main_thread_callbacks)
+
+
+def _process_timer() -> typing.Optional[float]:
+    if _process_callbacks():
+        return PROCESS_INTERVAL
+    return None
+
+
+def _process_handler(scene):
+    if _main_thread_callbacks:
+        _process_callbacks()
+
+
+def _schedule_processing():
+    # bpy.app.timers only exists since Blender 2.80; before that the
+    # scene_update_post handler is called on every main loop iteration.
+    timers = getattr(bpy.app, 'timers', None)
+    if timers is not None:
+        if not timers.is_registered(_process_timer):
+            timers.register(_process_timer, first_interval=PROCESS_INTERVAL)
+    elif _process_handler not in bpy.app.handlers.scene_update_post:
+        bpy.app.handlers.scene_update_post.append(_process_handler)
+
+
+def _unschedule_processing():
+    timers = getattr(bpy.app, 'timers', None)
+    if timers is not None:
+        if timers.is_registered(_process_timer):
+            timers.unregister(_process_timer)
+    elif _process_handler in bpy.app.handlers.scene_update_post:
+        bpy.app.handlers.scene_update_post.remove(_process_handler)
+
+
+thumbnail_loader = ThumbnailLoader()
+
+
+def unregister():
+    thumbnail_loader.shutdown()
+    _main_thread_callbacks.clear()
+    _unschedule_processing()
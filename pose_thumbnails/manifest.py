@@ -0,0 +1,214 @@
+"""Per pose library manifest of the thumbnail files, to speed up opening blend files.
+
+For every thumbnail of a pose library, the manifest stores the resolved
+absolute path, and the modification time and size of the image file as it
+was when the thumbnail was last loaded. It is saved in the proxy cache
+directory, so that when the blend file is opened again the thumbnail paths
+don't have to be resolved again.
+
+When the blend file is opened again, that remembered state is trusted: the
+proxy (or atlas) of each thumbnail is looked up by it, without stat'ing the
+image file (see loader.read_thumbnail()). Only when there is no such proxy is
+the file itself checked. Files are checked again when they are known to have
+changed: when the thumbnail watcher notices a change, or when the thumbnails
+are refreshed, which also picks up images that were overwritten while
+Blender wasn't running. The manifest is only saved again when the state of
+one of its own files changed.
+"""
+
+import collections
+import hashlib
+import json
+import logging
+import os
+import time
+import typing
+
+import bpy
+
+from . import atlas
+
+logger = logging.getLogger(__name__)
+
+MANIFEST_VERSION = 2
+SAVE_DELAY = 2.0
+"""Seconds without changes before changed manifests are saved."""
+
+
+# The parts of os.stat_result that are used to detect changed files.
+FileStat = collections.namedtuple('FileStat', ['st_mtime_ns', 'st_size'])
+
+
+_manifests = {}  # {(blend file, library file, action name): Manifest}
+_last_change = 0.0
+
+
+class Manifest:
+    """The thumbnail paths of one pose library, and the state of their files."""
+
+    def __init__(self, path: str):
+        self.path = path  # where the manifest is stored, or '' if it is not stored
+        self.thumbnails = {}  # {thumbnail filepath: abspath}
+        self.stats = {}  # {image or atlas file path: FileStat} as last loaded
+        self.dirty = False
+        self._sources = set()  # the image and atlas files of the thumbnails
+
+    def load(self):
+        """Load the manifest from disk."""
+        if not self.path:
+            return
+        try:
+            with open(self.path) as infile:
+                data = json.load(infile)
+        except FileNotFoundError:
+            return
+        except (OSError, ValueError) as ex:
+            logger.warning('Ignoring unreadable thumbnail manifest %s: %s', self.path, ex)
+            return
+        if data.get('version') != MANIFEST_VERSION:
+            return
+
+        # Absolute paths only depend on the blend file, which is part of the
+        # manifest key, so they are always valid.
+        self.thumbnails = data['thumbnails']
+        self._sources = {atlas.split_tile_path(abspath)[0]
+                         for abspath in self.thumbnails.values()}
+        self.stats = {path: FileStat(mtime, size)
+                      for path, (mtime, size) in data['stats'].items()}
+        logger.debug('Loaded thumbnail manifest %s with %d thumbnails',
+                     self.path, len(self.thumbnails))
+
+    def save(self):
+        if not self.path:
+            self.dirty = False
+            return
+        data = {
+            'version': MANIFEST_VERSION,
+            'thumbnails': self.thumbnails,
+            'stats': {path: stat for path, stat in self.stats.items() if path in self._sources},
+        }
+
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        temp_path = self.path + '.tmp'
+        with open(temp_path, 'w') as outfile:
+            json.dump(data, outfile)
+        os.replace(temp_path, self.path)
+        self.dirty = False
+
+    def abspath(self, poselib: bpy.types.Action, filepath: str) -> str:
+        """Return the normalized absolute path of a thumbnail of the pose library."""
+        try:
+            return self.thumbnails[filepath]
+        except KeyError:
+            pass
+        abspath = os.path.normpath(bpy.path.abspath(filepath, library=poselib.library))
+        self.thumbnails[filepath] = abspath
+        self._sources.add(atlas.split_tile_path(abspath)[0])
+        self._changed()
+        return abspath
+
+    def uses(self, path: str) -> bool:
+        """Return whether a thumbnail of the pose library is the file (or a tile of it)."""
+        return path in self._sources
+
+    def remember_stat(self, path: str, file_stat: FileStat):
+        """Remember the state of one of the files, marking the manifest dirty if it changed."""
+        if self.stats.get(path) == file_stat:
+            return
+        self.stats[path] = file_stat
+        self._changed()
+
+    def forget_stat(self, path: str):
+        """Forget the state of one of the files, so that it is checked on the next load."""
+        if self.stats.pop(path, None) is not None:
+            self._changed()
+
+    def _changed(self):
+        global _last_change
+        from .loader import call_on_main_thread
+
+        self.dirty = True
+        _last_change = time.monotonic()
+        call_on_main_thread(_save_when_idle)
+
+
+def _manifest_path(key: typing.Tuple[str, str, str]) -> str:
+    from .proxies import proxy_cache
+
+    if not key[0] or not proxy_cache.directory:
+        # Relative paths can't be resolved in unsaved files anyway.
+        return ''
+    digest = hashlib.sha1('\0'.join(key).encode('utf8', 'surrogateescape')).hexdigest()
+    return os.path.join(proxy_cache.directory, 'manifests', digest + '.json')
+
+
+def for_poselib(poselib: bpy.types.Action) -> Manifest:
+    """Return the manifest of the pose library, loading it when necessary."""
+    library_path = poselib.library.filepath if poselib.library else ''
+    key = (bpy.data.filepath, library_path, poselib.name)
+    try:
+        return _manifests[key]
+    except KeyError:
+        pass
+    manifest = Manifest(_manifest_path(key))
+    manifest.load()
+    _manifests[key] = manifest
+    return manifest
+
+
+def remember_stat(path: str, stat: os.stat_result):
+    """Remember the state of an image or atlas file, as found when loading it.
+
+    Only the manifests of the pose libraries that use the file are changed.
+    Must be called from the main thread.
+    """
+    file_stat = FileStat(stat.st_mtime_ns, stat.st_size)
+    for manifest in _manifests.values():
+        if manifest.uses(path):
+            manifest.remember_stat(path, file_stat)
+
+
+def known_stat(path: str) -> typing.Optional[FileStat]:
+    """Return the remembered state of an image or atlas file, or None if unknown.
+
+    Must be called from the main thread.
+    """
+    for manifest in _manifests.values():
+        if manifest.uses(path):
+            file_stat = manifest.stats.get(path)
+            if file_stat is not None:
+                return file_stat
+    return None
+
+
+def forget_stat(path: str):
+    """Forget the remembered state of an image or atlas file, because it changed.
+
+    Must be called from the main thread.
+    """
+    for manifest in _manifests.values():
+        manifest.forget_stat(path)
+
+
+def _save_when_idle() -> bool:
+    if time.monotonic() - _last_change < SAVE_DELAY:
+        return True
+    save_manifests()
+    return False
+
+
+def save_manifests():
+    """Save all changed manifests."""
+    for manifest in _manifests.values():
+        if not manifest.dirty:
+            continue
+        try:
+            manifest.save()
+        except OSError as ex:
+            logger.warning('Unable to save thumbnail manifest %s: %s', manifest.path, ex)
+            manifest.dirty = False
+
+
+def forget_manifests():
+    """Forget all manifests; they are loaded again when needed."""
+    _manifests.clear()
@@ -0,0 +1,184 @@
+"""Precomputed tables of all poses of a pose library.
+
+Evaluating a pose from the F-Curves of the pose library costs one call per
+F-Curve (see evaluation.evaluate_pose()). When scrubbing through hundreds of
+poses, all poses of the library are evaluated once into a PoseTable instead:
+a dense (poses x keyed bones x channels) array of values, plus a mask of
+the channels that are applied by each pose. Looking up a pose is then an
+array slice, which snapshot.capture_indices() reads as-is.
+
+Tables are rebuilt lazily, whenever the layout of the pose library changes
+(see evaluation.library_layout()).
+
+The tables are kept within a memory budget, dropping the least recently
+used table first. A library that doesn't fit in the budget on its own isn't
+cached; its poses are evaluated on demand.
+"""
+
+import collections
+import logging
+import typing
+
+import bpy
+import numpy
+
+from . import evaluation, profiling
+
+logger = logging.getLogger(__name__)
+
+
+class PoseTable:
+    """The values of all poses of a pose library."""
+
+    def __init__(self, layout: evaluation.LibraryLayout,
+                 bone_rows: typing.Mapping[str, int],
+                 columns: typing.Mapping[typing.Tuple[str, int], int]):
+        pose_count = len(layout.pose_masks)
+        shape = (pose_count, len(bone_rows), len(columns))
+        self.layout = layout  # the layout the table was built from
+        self.bone_rows = bone_rows  # {bone name: row}
+        self.columns = columns  # {(channel, array index): column}
+        self.values = numpy.zeros(shape, dtype=numpy.float32)
+        self.keyed = numpy.zeros(shape, dtype=bool)
+
+    @property
+    def nbytes(self) -> int:
+        return self.values.nbytes + self.keyed.nbytes
+
+    def pose_values(self, pose_index: int) -> evaluation.PoseValues:
+        """Return the values of the pose, like evaluation.evaluate_pose() does.
+
+        The values are views on the table, not copies.
+        """
+        return evaluation.PoseValues(self.bone_rows, self.columns,
+                                     self.values[pose_index], self.keyed[pose_index])
+
+
+def estimate_nbytes(pose_count: int, bone_count: int, column_count: int) -> int:
+    # float32 values plus a bool mask.
+    return 5 * pose_count * bone_count * column_count
+
+
+@profiling.timed('posetable.build')
+def build(poselib: bpy.types.Action, layout: evaluation.LibraryLayout,
+          max_bytes: int) -> typing.Optional[PoseTable]:
+    """Evaluate all poses of the pose library.
+
+    Returns None when the table would use more than max_bytes.
+    """
+    bone_rows = collections.OrderedDict()  # {bone name: row}
+    columns = collections.OrderedDict()  # {(channel, array index): column}
+    fcurves = []
+    for fcurve_index, bone_name, channel in layout.fcurves:
+        fcurve = poselib.fcurves[fcurve_index]
+        bone_row = bone_rows.setdefault(bone_name, len(bone_rows))
+        column = columns.setdefault((channel, fcurve.array_index), len(columns))
+        fcurves.append((fcurve, bone_name, bone_row, column))
+
+    pose_count = len(layout.pose_masks)
+    if estimate_nbytes(pose_count, len(bone_rows), len(columns)) > max_bytes:
+        return None
+
+    table = PoseTable(layout, bone_rows, columns)
+    frames = [marker.frame for marker in poselib.pose_markers]
+    for fcurve, bone_name, bone_row, column in fcurves:
+        poses = [pose_index for pose_index, mask in enumerate(layout.pose_masks)
+                 if bone_name in mask]
+        table.values[poses, bone_row, column] = [fcurve.evaluate(frames[pose_index])
+                                                 for pose_index in poses]
+        table.keyed[poses, bone_row, column] = True
+    return table
+
+
+class PoseTableCache:
+    """Keeps the pose tables of recently used pose libraries within a memory budget."""
+
+    def __init__(self):
+        self.max_bytes = 0
+        self.resident_bytes = 0
+        self._tables = collections.OrderedDict()  # {poselib pointer: PoseTable}
+        # {poselib pointer: layout} of libraries that were too large.
+        self._too_large = {}
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_bytes > 0
+
+    def configure(self, max_bytes: int):
+        """Set the memory budget; 0 disables the pose tables."""
+        self.max_bytes = max_bytes
+        self._too_large.clear()
+        self._evict()
+
+    def clear(self):
+        self._tables.clear()
+        self._too_large.clear()
+        self.resident_bytes = 0
+
+    def stats(self) -> typing.Dict[str, int]:
+        return {
+            'tables': len(self._tables),
+            'resident_bytes': self.resident_bytes,
+            'max_bytes': self.max_bytes,
+        }
+
+    def pose_values(self, poselib: bpy.types.Action, pose_index: int,
+                    armature_ob: bpy.types.Object = None) -> evaluation.PoseValues:
+        """Return the values of a pose of the pose library.
+
+        Taken from the pose table when possible, otherwise evaluated from
+        the F-Curves.
+
+        :param armature_ob: the armature using the pose library, see
+            evaluation.library_layout().
+        """
+        table = self.table(poselib, armature_ob) if self.enabled else None
+        if table is None:
+            return evaluation.evaluate_pose(poselib, pose_index, armature_ob)
+        return table.pose_values(pose_index)
+
+    def table(self, poselib: bpy.types.Action,
+              armature_ob: bpy.types.Object = None) -> typing.Optional[PoseTable]:
+        """Return the up to date pose table of the pose library, building it when needed.
+
+        Returns None when the table doesn't fit in the memory budget.
+        """
+        key = poselib.as_pointer()
+        layout = evaluation.library_layout(poselib, armature_ob)
+        if self._too_large.get(key) is layout:
+            profiling.count('posetable.too_large')
+            return None
+
+        table = self._tables.get(key)
+        if table is not None and table.layout is layout:
+            profiling.count('posetable.hits')
+            self._tables.move_to_end(key)
+            return table
+
+        profiling.count('posetable.misses')
+        self._discard(key)
+        table = build(poselib, layout, self.max_bytes)
+        if table is None:
+            logger.debug('Pose table of %s exceeds the memory budget', poselib.name)
+            self._too_large[key] = layout
+            return None
+
+        self._tables[key] = table
+        self.resident_bytes += table.nbytes
+        self._evict()
+        logger.debug('Built pose table of %s: %d poses, %d bones, %d bytes',
+                     poselib.name, len(table.values), len(table.bone_rows), table.nbytes)
+        return table
+
+    def _discard(self, key: int):
+        table = self._tables.pop(key, None)
+        if table is not None:
+            self.resident_bytes -= table.nbytes
+
+    def _evict(self):
+        while self._tables and self.resident_bytes > self.max_bytes:
+            _, table = self._tables.popitem(last=False)
+            self.resident_bytes -= table.nbytes
+
+
+pose_tables = PoseTableCache()
@@ -1,5 +1,6 @@
 import functools
 import re
+import types
 
 import bpy
 
@@ -8,6 +9,44 @@ def clear_charnamere_cache(self: 'PoseThumbnailsPreferences', context):
     self.character_name_re.cache_clear()
 
 
+def resize_enum_items_cache(self: 'PoseThumbnailsPreferences', context):
+    from . import core
+    core.get_enum_items.cache_resize(self.enum_cache_size)
+
+
+def set_loader_threads(self: 'PoseThumbnailsPreferences', context):
+    from . import loader
+    loader.thumbnail_loader.set_worker_count(self.loader_threads)
+
+
+def configure_proxy_cache(self: 'PoseThumbnailsPreferences', context):
+    from . import proxies
+    directory = (bpy.path.abspath(self.proxy_cache_directory) or
+                 proxies.default_directory())
+    proxies.proxy_cache.configure(directory, self.proxy_cache_size * 1024 * 1024)
+
+
+def set_preview_memory_budget(self: 'PoseThumbnailsPreferences', context):
+    from . import store
+    store.preview_store.configure(self.preview_memory_budget * 1024 * 1024)
+
+
+def set_pose_table_memory(self: 'PoseThumbnailsPreferences', context):
+    from . import posetable
+    posetable.pose_tables.configure(self.pose_table_memory * 1024 * 1024)
+
+
+def set_watch_thumbnails(self: 'PoseThumbnailsPreferences', context):
+    from . import watcher
+    watcher.thumbnail_watcher.set_enabled(self.watch_thumbnails)
+
+
+def set_profiling_mode(self: 'PoseThumbnailsPreferences', context):
+    from . import profiling
+    profiling.set_enabled(self.profiling_mode != 'OFF',
+                          use_cprofile=self.profiling_mode == 'CPROFILE')
+
+
 def for_addon(context=None) -> 'PoseThumbnailsPreferences':
     """Return preferences for this add-on.
 
@@ -17,6 +56,33 @@ def for_addon(context=None) -> 'PoseThumbnailsPreferences':
     return context.user_preferences.addons[__package__].preferences
 
 
+def default_preferences() -> types.SimpleNamespace:
+    """Return the default values of the preferences.
+
+    Used when the add-on is enabled for the first time, and there are no
+    stored preferences yet.
+    """
+    return types.SimpleNamespace(**{
+        prop.identifier: prop.default
+        for prop in PoseThumbnailsPreferences.bl_rna.properties
+        if hasattr(prop, 'default')
+    })
+
+
+def configure(addon_prefs, context=None):
+    """Configure the caches, loader, watcher and profiling from the preferences.
+
+    :param addon_prefs: the preferences of the add-on, or default_preferences().
+    """
+    resize_enum_items_cache(addon_prefs, context)
+    set_loader_threads(addon_prefs, context)
+    configure_proxy_cache(addon_prefs, context)
+    set_watch_thumbnails(addon_prefs, context)
+    set_preview_memory_budget(addon_prefs, context)
+    set_pose_table_memory(addon_prefs, context)
+    set_profiling_mode(addon_prefs, context)
+
+
 class PoseThumbnailsPreferences(bpy.types.AddonPreferences):
     bl_idname = __package__
     add_3dview_prop_panel = bpy.props.BoolProperty(
@@ -31,6 +97,76 @@ class PoseThumbnailsPreferences(bpy.types.AddonPreferences):
         min=0.1,
         max=5.0,
     )
+    enum_cache_size = bpy.props.IntProperty(
+        name='Cached Pose Libraries',
+        description='Number of pose libraries (and display options) for which the '
+                    'thumbnail list is kept in memory',
+        default=10,
+        min=1,
+        max=100,
+        update=resize_enum_items_cache,
+    )
+    loader_threads = bpy.props.IntProperty(
+        name='Loader Threads',
+        description='Number of background threads that read thumbnail images; the placeholder '
+                    'is shown until an image is loaded. Use 0 to load images while drawing',
+        default=4,
+        min=0,
+        max=32,
+        update=set_loader_threads,
+    )
+    proxy_cache_directory = bpy.props.StringProperty(
+        name='Proxy Cache Directory',
+        description='Directory to store small versions of the thumbnail images in, so that '
+                    'they load faster. Leave empty to use the default location',
+        default='',
+        subtype='DIR_PATH',
+        update=configure_proxy_cache,
+    )
+    proxy_cache_size = bpy.props.IntProperty(
+        name='Proxy Cache Size (MB)',
+        description='Maximum size of the proxy cache; the least recently used proxies are '
+                    'removed when it grows larger. Use 0 to disable the proxy cache',
+        default=512,
+        min=0,
+        update=configure_proxy_cache,
+    )
+    preview_memory_budget = bpy.props.IntProperty(
+        name='Thumbnail Memory (MB)',
+        description='Maximum memory used by loaded thumbnails; the least recently shown '
+                    'thumbnails are unloaded when more is used. Use 0 for no limit',
+        default=256,
+        min=0,
+        update=set_preview_memory_budget,
+    )
+    pose_table_memory = bpy.props.IntProperty(
+        name='Pose Table Memory (MB)',
+        description='Maximum memory used to keep all poses of recently used pose libraries '
+                    'evaluated, for instant pose application. Larger pose libraries are '
+                    'evaluated on demand. Use 0 to always evaluate poses on demand',
+        default=64,
+        min=0,
+        update=set_pose_table_memory,
+    )
+    watch_thumbnails = bpy.props.BoolProperty(
+        name='Reload Changed Thumbnails',
+        description='Watch the thumbnail files of the shown pose library, and reload them '
+                    'automatically when they change on disk',
+        default=False,
+        update=set_watch_thumbnails,
+    )
+    profiling_mode = bpy.props.EnumProperty(
+        name='Profiling',
+        description='Record where time is spent, to attach to reports about a slow UI',
+        items=[
+            ('OFF', 'Off', 'Do not record anything'),
+            ('TIMERS', 'Timers', 'Record the time spent in the slowest parts of the add-on'),
+            ('CPROFILE', 'Timers and cProfile',
+             'Also profile everything that runs in Blender; this slows Blender down'),
+        ],
+        default='OFF',
+        update=set_profiling_mode,
+    )
     character_name_regexp = bpy.props.StringProperty(
         name='Character Name Regexp',
         description='Obtains the character name from the object name',
@@ -57,10 +193,43 @@ class PoseThumbnailsPreferences(bpy.types.AddonPreferences):
         """
         return re.compile(self.character_name_regexp)
 
+    def draw_preview_memory(self, layout):
+        from . import store
+        stats = store.preview_store.stats()
+        row = layout.row()
+        row.prop(self, 'preview_memory_budget')
+        row.label('{count} thumbnails use {mb:.1f} MB, {evicted} unloaded so far'.format(
+            count=stats['thumbnails'],
+            mb=stats['resident_bytes'] / 1024 / 1024,
+            evicted=stats['evicted'],
+        ))
+
+    def draw_pose_table_memory(self, layout):
+        from . import posetable
+        stats = posetable.pose_tables.stats()
+        row = layout.row()
+        row.prop(self, 'pose_table_memory')
+        row.label('{count} pose libraries use {mb:.1f} MB'.format(
+            count=stats['tables'],
+            mb=stats['resident_bytes'] / 1024 / 1024,
+        ))
+
     def draw(self, context):
         layout = self.layout
         layout.prop(self, 'thumbnail_size')
         layout.prop(self, 'add_3dview_prop_panel')
+        layout.prop(self, 'enum_cache_size')
+        layout.prop(self, 'loader_threads')
+        row = layout.row()
+        row.prop(self, 'proxy_cache_directory')
+        row.prop(self, 'proxy_cache_size')
+        self.draw_preview_memory(layout)
+        self.draw_pose_table_memory(layout)
+        layout.prop(self, 'watch_thumbnails')
+        row = layout.row(align=True)
+        row.prop(self, 'profiling_mode')
+        row.operator('poselib.export_profile', icon='EXPORT')
+        row.operator('poselib.reset_profile', icon='X', text='')
 
         layout.separator()
         col = layout.box()
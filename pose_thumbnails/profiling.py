@@ -0,0 +1,161 @@
+"""Instrumentation of the hot paths of the add-on.
+
+Functions decorated with timed() record their number of calls and the time
+spent in them, and count() increments named counters (for example cache hits
+and misses). All of this is only recorded while profiling is enabled in the
+add-on preferences; when disabled, a decorated function costs one extra
+function call and a check of a module-level flag.
+
+Optionally cProfile runs at the same time, for a complete picture of the
+main thread. The collected data can be exported as JSON or as a cProfile
+dump, for example to attach to a report about a slow UI.
+"""
+
+import collections
+import cProfile
+import functools
+import json
+import logging
+import time
+import typing
+
+logger = logging.getLogger(__name__)
+
+enabled = False
+_timers = {}  # {name: [calls, total seconds, maximum seconds]}
+_counters = collections.Counter()
+_profile = None  # cProfile.Profile, while profiling with cProfile
+_use_cprofile = False  # whether cProfile records while enabled
+
+
+def set_enabled(enable: bool, *, use_cprofile=False):
+    """Start or stop recording; the recorded data is kept until reset()."""
+    global enabled, _profile, _use_cprofile
+
+    enabled = enable
+    _use_cprofile = use_cprofile
+    if _profile is not None:
+        _profile.disable()
+    if enable and use_cprofile:
+        if _profile is None:
+            _profile = cProfile.Profile()
+        _profile.enable()
+
+
+def reset():
+    """Forget all recorded data."""
+    global _profile
+
+    _timers.clear()
+    _counters.clear()
+    if _profile is not None:
+        _profile.disable()
+        _profile = cProfile.Profile()
+        if enabled and _use_cprofile:
+            _profile.enable()
+
+
+def _record(name: str, duration: float):
+    try:
+        timer = _timers[name]
+    except KeyError:
+        _timers[name] = [1, duration, duration]
+        return
+    timer[0] += 1
+    timer[1] += duration
+    if duration > timer[2]:
+        timer[2] = duration
+
+
+def timed(name: str):
+    """Decorator, records the calls and duration of the decorated function."""
+
+    def decorator(wrapped):
+        @functools.wraps(wrapped)
+        def wrapper(*args, **kwargs):
+            if not enabled:
+                return wrapped(*args, **kwargs)
+            start = time.perf_counter()
+            try:
+                return wrapped(*args, **kwargs)
+            finally:
+                _record(name, time.perf_counter() - start)
+
+        return wrapper
+
+    return decorator
+
+
+def timed_callback(name: str):
+    """Decorator like timed(), for Blender callbacks taking (self, context).
+
+    Blender checks the number of positional arguments of callbacks such as
+    Panel.draw() and EnumProperty items, so (*args, **kwargs) can't be used.
+    """
+
+    def decorator(wrapped):
+        @functools.wraps(wrapped)
+        def wrapper(self, context):
+            if not enabled:
+                return wrapped(self, context)
+            start = time.perf_counter()
+            try:
+                return wrapped(self, context)
+            finally:
+                _record(name, time.perf_counter() - start)
+
+        return wrapper
+
+    return decorator
+
+
+def count(name: str, amount=1):
+    """Increment a counter."""
+    if enabled:
+        _counters[name] += amount
+
+
+def report() -> dict:
+    """Return the recorded timers and counters, in a JSON-compatible form."""
+    timers = {}
+    for name, (calls, total, maximum) in sorted(_timers.items()):
+        timers[name] = {
+            'calls': calls,
+            'total_ms': total * 1000,
+            'mean_ms': total * 1000 / calls,
+            'max_ms': maximum * 1000,
+        }
+    return {
+        'timers': timers,
+        'counters': dict(sorted(_counters.items())),
+    }
+
+
+def has_cprofile_data() -> bool:
+    return _profile is not None
+
+
+def export_json(filepath: str, extra_info: typing.Dict[str, typing.Any] = None):
+    """Write the report to a JSON file.
+
+    :param extra_info: added to the top level of the report, for example
+        version information.
+    """
+    data = dict(extra_info or {})
+    data.update(report())
+    with open(filepath, 'w') as outfile:
+        json.dump(data, outfile, indent=4)
+
+
+def export_cprofile(filepath: str):
+    """Write the cProfile data to a file, for use with pstats or snakeviz.
+
+    :raises ValueError: when cProfile was never enabled.
+    """
+    if _profile is None:
+        raise ValueError('No cProfile data was recorded')
+    _profile.create_stats()
+    _profile.dump_stats(filepath)
+    if enabled and _use_cprofile:
+        # create_stats() disables the profiler.
+        _profile.enable()
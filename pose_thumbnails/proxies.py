@@ -0,0 +1,223 @@
+"""On-disk cache of small proxies for thumbnail images.
+
+Thumbnails often point at full-resolution renders, which are slow to decode
+while only a small icon is ever drawn. The first time an image is loaded the
+pixels of its preview are written to a proxy file, and subsequent loads read
+the proxy instead of decoding the source image.
+
+Proxies are keyed on the absolute path, modification time and size of the
+source file, so changing the source image automatically results in a new
+proxy. A proxy file is a small header followed by the raw preview pixels,
+which means reading one needs no decoding and can be done on any thread.
+The least recently used proxies are removed when the cache grows beyond its
+maximum size. The sizes and last use of the proxies are kept in memory,
+after scanning the cache directory once; reading a proxy only updates the
+in-memory index. The times of last use are written to the proxy files (as
+their modification time) during eviction sweeps, so that other Blender
+instances evict in the same order. Proxies written by other Blender
+instances are only seen after the cache is configured again.
+"""
+
+import array
+import hashlib
+import logging
+import os
+import struct
+import threading
+import time
+import typing
+
+import bpy
+
+logger = logging.getLogger(__name__)
+
+PROXY_EXTENSION = '.thumb'
+PROXY_MAGIC = b'PTHB'
+PROXY_HEADER = struct.Struct('<4sII')  # magic, width, height
+
+
+class Proxy:
+    """Pixels of a preview image, as stored in ImagePreview.image_pixels."""
+
+    __slots__ = ('width', 'height', 'pixels')
+
+    def __init__(self, width: int, height: int, pixels: array.array):
+        self.width = width
+        self.height = height
+        self.pixels = pixels
+
+    @property
+    def size_in_bytes(self) -> int:
+        return PROXY_HEADER.size + self.pixels.itemsize * len(self.pixels)
+
+
+def default_directory() -> str:
+    return bpy.utils.user_resource('DATAFILES', path='pose_thumbnails_cache')
+
+
+class ProxyCache:
+    """Cache of proxy files in one directory, limited in total size.
+
+    All methods can be called from worker threads.
+    """
+
+    def __init__(self):
+        self.directory = ''
+        self.max_bytes = 0
+        self._lock = threading.Lock()
+        self._index = None  # {proxy path: [last use, size]}, None until scanned
+        self._used = {}  # {proxy path: last use} of reads since the last sweep
+        self._total_bytes = 0
+        self._write_error_logged = False
+
+    @property
+    def enabled(self) -> bool:
+        return bool(self.directory) and self.max_bytes > 0
+
+    def configure(self, directory: str, max_bytes: int):
+        with self._lock:
+            self.directory = directory
+            self.max_bytes = max_bytes
+            self._index = None
+            self._used.clear()
+            self._total_bytes = 0
+            self._write_error_logged = False
+
+    def proxy_path(self, abspath: str, stat: os.stat_result = None) -> str:
+        """Return the path of the proxy for the source file.
+
+        :param stat: the os.stat() result of the source file, if already known.
+        :raises FileNotFoundError: when the source file does not exist.
+        """
+        if stat is None:
+            stat = os.stat(abspath)
+        key = '%s\0%d\0%d' % (abspath, stat.st_mtime_ns, stat.st_size)
+        digest = hashlib.sha1(key.encode('utf8', 'surrogateescape')).hexdigest()
+        return os.path.join(self.directory, digest[:2], digest + PROXY_EXTENSION)
+
+    def read(self, abspath: str, stat: os.stat_result = None) -> typing.Optional[Proxy]:
+        """Return the proxy of the source file, or None if it is not cached.
+
+        :param stat: the os.stat() result of the source file, if already known.
+        :raises FileNotFoundError: when the source file does not exist.
+        """
+        proxy_path = self.proxy_path(abspath, stat)
+        try:
+            with open(proxy_path, 'rb') as infile:
+                data = infile.read()
+        except OSError:
+            return None
+
+        try:
+            magic, width, height = PROXY_HEADER.unpack_from(data)
+        except struct.error:
+            magic = width = height = None
+        pixel_data = data[PROXY_HEADER.size:]
+        if magic != PROXY_MAGIC or len(pixel_data) != 4 * width * height:
+            logger.warning('Ignoring corrupt thumbnail proxy %s', proxy_path)
+            return None
+        pixels = array.array('i')
+        pixels.frombytes(pixel_data)
+
+        with self._lock:
+            self._used[proxy_path] = time.time()
+        return Proxy(width, height, pixels)
+
+    def write(self, abspath: str, proxy: Proxy):
+        """Store the proxy of the source file, evicting old proxies if needed.
+
+        Failing to write the proxy, for example because the cache directory
+        is not writable or the disk is full, is logged once and otherwise
+        ignored; the thumbnail is then just not cached.
+        """
+        try:
+            proxy_path = self.proxy_path(abspath)
+        except FileNotFoundError:
+            return
+
+        # Write to a temporary file first, so that other Blender instances
+        # never read a half-written proxy.
+        temp_path = '%s.%d.tmp' % (proxy_path, threading.get_ident())
+        try:
+            os.makedirs(os.path.dirname(proxy_path), exist_ok=True)
+            with open(temp_path, 'wb') as outfile:
+                outfile.write(PROXY_HEADER.pack(PROXY_MAGIC, proxy.width, proxy.height))
+                outfile.write(proxy.pixels.tobytes())
+            os.replace(temp_path, proxy_path)
+        except OSError as ex:
+            with self._lock:
+                if not self._write_error_logged:
+                    self._write_error_logged = True
+                    logger.warning('Unable to write thumbnail proxies to %s: %s',
+                                   self.directory, ex)
+            try:
+                os.unlink(temp_path)
+            except OSError:
+                pass
+            return
+
+        with self._lock:
+            if self._index is None:
+                # Also picks up the proxy that was just written.
+                self._scan()
+            else:
+                previous = self._index.get(proxy_path)
+                if previous is not None:
+                    self._total_bytes -= previous[1]
+                self._index[proxy_path] = [time.time(), proxy.size_in_bytes]
+                self._total_bytes += proxy.size_in_bytes
+            if self._total_bytes > self.max_bytes:
+                self._evict()
+
+    def _scan(self):
+        """Build the index of the proxies in the cache directory.
+
+        Must be called with self._lock held.
+        """
+        self._index = {}
+        for dirpath, _, filenames in os.walk(self.directory):
+            for filename in filenames:
+                if not filename.endswith(PROXY_EXTENSION):
+                    continue
+                path = os.path.join(dirpath, filename)
+                try:
+                    stat = os.stat(path)
+                except FileNotFoundError:
+                    continue
+                self._index[path] = [stat.st_mtime, stat.st_size]
+        self._total_bytes = sum(size for _, size in self._index.values())
+
+    def _evict(self):
+        """Remove least recently used proxies until the cache fits its maximum size.
+
+        Must be called with self._lock held.
+        """
+        for path, last_use in self._used.items():
+            entry = self._index.get(path)
+            if entry is None or entry[0] >= last_use:
+                continue
+            entry[0] = last_use
+            try:
+                os.utime(path, (last_use, last_use))
+            except OSError:
+                pass
+        self._used.clear()
+
+        # Leave some room, so that we don't have to evict again on the next write.
+        target_bytes = self.max_bytes * 0.9
+        evicted = 0
+        by_last_use = sorted(self._index.items(), key=lambda item: item[1][0])
+        for path, (_, size) in by_last_use:
+            if self._total_bytes <= target_bytes:
+                break
+            try:
+                os.unlink(path)
+            except FileNotFoundError:
+                pass
+            del self._index[path]
+            self._total_bytes -= size
+            evicted += 1
+        logger.debug('Evicted %d thumbnail proxies, %d bytes remain', evicted, self._total_bytes)
+
+
+proxy_cache = ProxyCache()
@@ -0,0 +1,419 @@
+"""Compact snapshots of the pose of an armature.
+
+A PoseSnapshot stores the transforms of a set of pose bones as contiguous
+arrays with one row per bone, indexed by the position of the bone in
+armature.pose.bones. The arrays are read from and written to all bones at
+once with foreach_get() / foreach_set(), instead of creating a Matrix and
+a dict per bone.
+
+Rotations are stored as quaternions, whatever the rotation mode of the
+bone; Euler and axis-angle bones are converted when reading and writing.
+Numeric custom properties are stored in an array as well; other custom
+properties (strings, arrays, groups) are kept as Python values.
+"""
+
+import functools
+import logging
+import typing
+
+import bpy
+import mathutils
+import numpy
+
+from . import evaluation, flip
+
+logger = logging.getLogger(__name__)
+
+# Flipping over the YZ-plane negates the X of the location, and the Y and Z
+# of the quaternion axis; see flip.matrix().
+LOCATION_FLIP = numpy.array([-1.0, 1.0, 1.0], dtype=numpy.float32)
+QUATERNION_FLIP = numpy.array([1.0, 1.0, -1.0, -1.0], dtype=numpy.float32)
+
+
+class PoseSnapshot:
+    """Transforms and custom properties of a set of pose bones."""
+
+    def __init__(self, armature_ob: bpy.types.Object, bone_indices: typing.Sequence[int]):
+        count = len(bone_indices)
+        self.armature_ob = armature_ob
+        self.bone_indices = numpy.array(bone_indices, dtype=numpy.intp)
+        self.location = numpy.zeros((count, 3), dtype=numpy.float32)
+        self.rotation = numpy.zeros((count, 4), dtype=numpy.float32)  # quaternions
+        self.scale = numpy.ones((count, 3), dtype=numpy.float32)
+        # Rows of the bones in quaternion rotation mode; the others are
+        # converted one by one.
+        self.is_quaternion = numpy.ones(count, dtype=bool)
+
+        # Numeric custom properties: (row, key) for each value.
+        self.prop_keys = []  # type: typing.List[typing.Tuple[int, str]]
+        self.prop_values = numpy.zeros(0, dtype=numpy.float64)
+        self.prop_is_float = numpy.zeros(0, dtype=bool)
+        # Other custom properties, as (row, key, value).
+        self.other_props = []  # type: typing.List[typing.Tuple[int, str, typing.Any]]
+
+    def __len__(self) -> int:
+        return len(self.bone_indices)
+
+    def pose_bones(self) -> typing.List[bpy.types.PoseBone]:
+        all_pose_bones = self.armature_ob.pose.bones
+        return [all_pose_bones[index] for index in self.bone_indices]
+
+    def rows_matching(self, other: 'PoseSnapshot') -> typing.Tuple[numpy.ndarray, numpy.ndarray]:
+        """Return the rows of self and other that refer to the same bones.
+
+        Both snapshots are usually taken of the same bones, in which case
+        this is just all rows.
+        """
+        if numpy.array_equal(self.bone_indices, other.bone_indices):
+            rows = numpy.arange(len(self))
+            return rows, rows
+        other_rows = {bone_index: row for row, bone_index in enumerate(other.bone_indices)}
+        pairs = [(row, other_rows[bone_index])
+                 for row, bone_index in enumerate(self.bone_indices)
+                 if bone_index in other_rows]
+        if not pairs:
+            empty = numpy.zeros(0, dtype=numpy.intp)
+            return empty, empty
+        own, others = zip(*pairs)
+        return numpy.array(own, dtype=numpy.intp), numpy.array(others, dtype=numpy.intp)
+
+    def copy(self) -> 'PoseSnapshot':
+        snapshot = PoseSnapshot(self.armature_ob, self.bone_indices)
+        snapshot.location[:] = self.location
+        snapshot.rotation[:] = self.rotation
+        snapshot.scale[:] = self.scale
+        snapshot.is_quaternion[:] = self.is_quaternion
+        snapshot.prop_keys = list(self.prop_keys)
+        snapshot.prop_values = self.prop_values.copy()
+        snapshot.prop_is_float = self.prop_is_float.copy()
+        snapshot.other_props = list(self.other_props)
+        return snapshot
+
+
+def _read_channel(pose_bones, name: str, width: int) -> numpy.ndarray:
+    values = numpy.empty(len(pose_bones) * width, dtype=numpy.float32)
+    pose_bones.foreach_get(name, values)
+    return values.reshape((len(pose_bones), width))
+
+
+def _write_channel(pose_bones, name: str, width: int,
+                   bone_indices: numpy.ndarray, rows: numpy.ndarray):
+    """Write rows of channel values to the bones at bone_indices, leaving other bones as-is."""
+    if not len(bone_indices):
+        return
+    values = _read_channel(pose_bones, name, width)
+    values[bone_indices] = rows
+    pose_bones.foreach_set(name, values.ravel())
+
+
+def _to_quaternion(pose_bone: bpy.types.PoseBone,
+                   keyed: typing.Dict[int, float] = None) -> mathutils.Quaternion:
+    """Return the rotation of the bone as quaternion.
+
+    :param keyed: {array index: value} that replace the values of the
+        rotation channel of the bone.
+    """
+    mode = pose_bone.rotation_mode
+    channel = evaluation.rotation_channel(mode)
+    values = list(getattr(pose_bone, channel))
+    for index, value in (keyed or {}).items():
+        values[index] = value
+
+    if mode == 'QUATERNION':
+        return mathutils.Quaternion(values).normalized()
+    if mode == 'AXIS_ANGLE':
+        angle, x, y, z = values
+        return mathutils.Quaternion((x, y, z), angle)
+    return mathutils.Euler(values, mode).to_quaternion()
+
+
+def rotation_values(pose_bone: bpy.types.PoseBone,
+                    quaternion: mathutils.Quaternion) -> typing.Sequence[float]:
+    """Convert the quaternion to the values of the rotation channel of the bone."""
+    mode = pose_bone.rotation_mode
+    if mode == 'QUATERNION':
+        return quaternion
+    if mode == 'AXIS_ANGLE':
+        axis, angle = quaternion.to_axis_angle()
+        return angle, axis[0], axis[1], axis[2]
+    # Stay close to the current rotation, to prevent flips in the animation.
+    return quaternion.to_euler(mode, pose_bone.rotation_euler)
+
+
+def _set_rotation(pose_bone: bpy.types.PoseBone, quaternion: mathutils.Quaternion):
+    channel = evaluation.rotation_channel(pose_bone.rotation_mode)
+    setattr(pose_bone, channel, rotation_values(pose_bone, quaternion))
+
+
+def _plain_value(value):
+    """Convert ID property arrays and groups to plain Python values."""
+    if hasattr(value, 'to_dict'):
+        return value.to_dict()
+    if hasattr(value, 'to_list'):
+        return value.to_list()
+    return value
+
+
+_skeletons = {}  # {armature pointer: names of its pose bones}
+
+
+def skeleton(armature_ob: bpy.types.Object) -> typing.Tuple[str, ...]:
+    """Return the names of the pose bones of the armature, in order.
+
+    Cached per armature while its number of bones stays the same, so that
+    the names aren't read and hashed again on every call.
+    """
+    key = armature_ob.as_pointer()
+    all_pose_bones = armature_ob.pose.bones
+    bone_names = _skeletons.get(key)
+    if bone_names is None or len(bone_names) != len(all_pose_bones):
+        bone_names = _skeletons[key] = tuple(all_pose_bones.keys())
+    return bone_names
+
+
+def forget_skeletons():
+    _skeletons.clear()
+
+
+@functools.lru_cache(maxsize=16)
+def _positions(skeleton: typing.Tuple[str, ...]) -> typing.Dict[str, int]:
+    return {bone_name: index for index, bone_name in enumerate(skeleton)}
+
+
+@functools.lru_cache(maxsize=16)
+def _bone_indices(skeleton: typing.Tuple[str, ...],
+                  bone_names: typing.Tuple[str, ...]) -> typing.Tuple[int, ...]:
+    positions = _positions(skeleton)
+    return tuple(positions[bone_name] for bone_name in bone_names if bone_name in positions)
+
+
+def bone_indices(armature_ob: bpy.types.Object,
+                 bone_names: typing.Iterable[str]) -> typing.Tuple[int, ...]:
+    """Return the indices in armature_ob.pose.bones of the named bones.
+
+    Bones that the armature doesn't have are left out. Cached by the bone
+    names of the armature, so armatures of the same rig share the result.
+    """
+    return _bone_indices(skeleton(armature_ob), tuple(bone_names))
+
+
+def mirrored_indices(armature_ob: bpy.types.Object,
+                     bone_names: typing.Iterable[str]) -> typing.List[int]:
+    """Return the indices in armature_ob.pose.bones of the bones on the other side.
+
+    Named bones that the armature doesn't have are mirrored by name, so that
+    a library keyed on 'hand.L' flips onto a rig that only has 'hand.R'.
+    Bones without a bone on the other side are left out.
+    """
+    all_bone_names = skeleton(armature_ob)
+    mirror_indices = flip.mirror_indices(all_bone_names)
+    positions = _positions(all_bone_names)
+    indices = []
+    for bone_name in bone_names:
+        try:
+            index = mirror_indices[positions[bone_name]]
+        except KeyError:
+            index = positions.get(flip.name(bone_name), -1)
+        if index >= 0:
+            indices.append(index)
+    return indices
+
+
+def capture(armature_ob: bpy.types.Object,
+            pose_bones: typing.Iterable[bpy.types.PoseBone],
+            *, flipped=False,
+            pose_values: evaluation.PoseValues = None) -> PoseSnapshot:
+    """Take a snapshot of the pose bones.
+
+    :param flipped: take the transforms from the bones on the other side,
+        mirrored over the YZ-plane. Bones without a bone on the other side
+        are left out, unless pose_values has that bone; then only its pose
+        values are mirrored on to the bone. Custom properties are always
+        taken from the bones themselves.
+    :param pose_values: values of a library pose (see evaluation.evaluate_pose())
+        that replace the current values of the bones, as if the pose was
+        applied first. When flipped, custom properties are only replaced
+        for bones that are their own mirror, as the pose is applied to the
+        bones on the other side.
+    """
+    all_pose_bones = armature_ob.pose.bones
+    indices = [all_pose_bones.find(pose_bone.name) for pose_bone in pose_bones]
+    return capture_indices(armature_ob, indices, flipped=flipped, pose_values=pose_values)
+
+
+def capture_indices(armature_ob: bpy.types.Object,
+                    bone_indices: typing.Iterable[int],
+                    *, flipped=False,
+                    pose_values: evaluation.PoseValues = None) -> PoseSnapshot:
+    """Take a snapshot of the pose bones at the given indices; see capture()."""
+    all_pose_bones = armature_ob.pose.bones
+    all_bone_names = skeleton(armature_ob)
+    if flipped:
+        mirror_indices = flip.mirror_indices(all_bone_names)
+
+    target_indices = []
+    source_indices = []
+    value_bone_names = []  # per row, the bone to take the pose values of
+    unmirrored_rows = []  # rows of bones whose other side the armature doesn't have
+    for target_index in bone_indices:
+        source_index = mirror_indices[target_index] if flipped else target_index
+        if source_index >= 0:
+            value_bone_name = all_bone_names[source_index]
+        else:
+            # Only the pose values can be mirrored on to this bone, if they
+            # have the bone on the other side.
+            value_bone_name = flip.name(all_bone_names[target_index])
+            if pose_values is None or value_bone_name not in pose_values.bone_rows:
+                continue
+            source_index = target_index
+            unmirrored_rows.append(len(target_indices))
+        target_indices.append(target_index)
+        source_indices.append(source_index)
+        value_bone_names.append(value_bone_name)
+
+    snapshot = PoseSnapshot(armature_ob, target_indices)
+    if not target_indices:
+        return snapshot
+    sources = numpy.array(source_indices, dtype=numpy.intp)
+    is_unmirrored = numpy.zeros(len(target_indices), dtype=bool)
+    is_unmirrored[unmirrored_rows] = True
+
+    snapshot.location[:] = _read_channel(all_pose_bones, 'location', 3)[sources]
+    snapshot.scale[:] = _read_channel(all_pose_bones, 'scale', 3)[sources]
+    snapshot.rotation[:] = _read_channel(all_pose_bones, 'rotation_quaternion', 4)[sources]
+    # Flipped twice, the values that the pose doesn't key stay as they are.
+    snapshot.location[is_unmirrored] *= LOCATION_FLIP
+    snapshot.rotation[is_unmirrored] *= QUATERNION_FLIP
+    if pose_values is not None:
+        rows = pose_values.rows(value_bone_names)
+        pose_values.put(snapshot.location, rows, 'location')
+        pose_values.put(snapshot.scale, rows, 'scale')
+        value_rows = rows.tolist()
+    else:
+        value_rows = [-1] * len(source_indices)
+
+    prop_keys = []
+    prop_values = []
+    prop_is_float = []
+    for row, (target_index, source_index) in enumerate(zip(target_indices, source_indices)):
+        source_pb = all_pose_bones[source_index]
+        value_row = value_rows[row]
+        keyed_rotation = None
+        if value_row >= 0:
+            keyed_rotation = pose_values.channel(
+                value_row, evaluation.rotation_channel(source_pb.rotation_mode))
+        if source_pb.rotation_mode != 'QUATERNION' or keyed_rotation:
+            snapshot.rotation[row] = _to_quaternion(source_pb, keyed_rotation)
+            if not keyed_rotation and is_unmirrored[row]:
+                snapshot.rotation[row] *= QUATERNION_FLIP
+
+        target_pb = all_pose_bones[target_index]
+        snapshot.is_quaternion[row] = target_pb.rotation_mode == 'QUATERNION'
+        keyed_props = {}
+        if source_index == target_index and value_row >= 0 and not is_unmirrored[row]:
+            keyed_props = pose_values.properties(value_row)
+
+        for key, value in target_pb.items():
+            if key == '_RNA_UI':
+                continue
+            if key in keyed_props and isinstance(value, (int, float)):
+                value = type(value)(keyed_props[key])
+            if isinstance(value, (int, float)) and not isinstance(value, bool):
+                prop_keys.append((row, key))
+                prop_values.append(value)
+                prop_is_float.append(isinstance(value, float))
+            else:
+                snapshot.other_props.append((row, key, _plain_value(value)))
+
+    if flipped:
+        snapshot.location *= LOCATION_FLIP
+        snapshot.rotation *= QUATERNION_FLIP
+
+    snapshot.prop_keys = prop_keys
+    snapshot.prop_values = numpy.array(prop_values, dtype=numpy.float64)
+    snapshot.prop_is_float = numpy.array(prop_is_float, dtype=bool)
+    return snapshot
+
+
+def _changed_rows(values: numpy.ndarray, previous: typing.Optional[PoseSnapshot],
+                  name: str) -> numpy.ndarray:
+    """Return a boolean array of the rows that differ from the previous snapshot."""
+    if previous is None:
+        return numpy.ones(len(values), dtype=bool)
+    return (values != getattr(previous, name)).any(axis=1)
+
+
+def apply(snapshot: PoseSnapshot, previous: PoseSnapshot = None):
+    """Write the snapshot to its armature.
+
+    :param previous: the snapshot that was last written to the same bones;
+        when given, only the values that differ from it are written.
+    """
+    if not len(snapshot):
+        return
+    if previous is not None and not numpy.array_equal(previous.bone_indices,
+                                                      snapshot.bone_indices):
+        previous = None
+
+    all_pose_bones = snapshot.armature_ob.pose.bones
+    indices = snapshot.bone_indices
+    rotation = snapshot.rotation
+    location_rows = _changed_rows(snapshot.location, previous, 'location')
+    scale_rows = _changed_rows(snapshot.scale, previous, 'scale')
+    rotation_rows = _changed_rows(rotation, previous, 'rotation')
+    quaternion_rows = snapshot.is_quaternion & rotation_rows
+    other_rotation_rows = ~snapshot.is_quaternion & rotation_rows
+
+    _write_channel(all_pose_bones, 'location', 3,
+                   indices[location_rows], snapshot.location[location_rows])
+    _write_channel(all_pose_bones, 'scale', 3,
+                   indices[scale_rows], snapshot.scale[scale_rows])
+    _write_channel(all_pose_bones, 'rotation_quaternion', 4,
+                   indices[quaternion_rows], rotation[quaternion_rows])
+    for row in numpy.flatnonzero(other_rotation_rows):
+        pose_bone = all_pose_bones[indices[row]]
+        _set_rotation(pose_bone, mathutils.Quaternion(rotation[row]))
+    changed = bool(location_rows.any() or scale_rows.any() or rotation_rows.any())
+
+    same_props = (previous is not None and previous.prop_keys == snapshot.prop_keys)
+    for index, ((row, key), value, is_float) in enumerate(zip(
+            snapshot.prop_keys, snapshot.prop_values, snapshot.prop_is_float)):
+        if same_props and previous.prop_values[index] == value:
+            continue
+        all_pose_bones[indices[row]][key] = float(value) if is_float else int(value)
+        changed = True
+    same_others = previous is not None and len(previous.other_props) == len(snapshot.other_props)
+    for index, (row, key, value) in enumerate(snapshot.other_props):
+        if same_others and previous.other_props[index] == (row, key, value):
+            continue
+        all_pose_bones[indices[row]][key] = value
+        changed = True
+
+    if changed:
+        # foreach_set() doesn't tag the armature for re-evaluation.
+        snapshot.armature_ob.update_tag(refresh={'DATA'})
+
+
+@bpy.app.handlers.persistent
+def _forget_skeletons_handler(*args):
+    # After undo or loading a file, the armature at an address can have
+    # other bones, with the same number of them.
+    forget_skeletons()
+
+
+_handler_lists = ('load_post', 'undo_post', 'redo_post')
+
+
+def register():
+    for name in _handler_lists:
+        handlers = getattr(bpy.app.handlers, name)
+        if _forget_skeletons_handler not in handlers:
+            handlers.append(_forget_skeletons_handler)
+
+
+def unregister():
+    for name in _handler_lists:
+        handlers = getattr(bpy.app.handlers, name)
+        if _forget_skeletons_handler in handlers:
+            handlers.remove(_forget_skeletons_handler)
+    forget_skeletons()
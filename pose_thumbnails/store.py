@@ -0,0 +1,139 @@
+"""Memory budget for the thumbnail previews.
+
+Every thumbnail image that is shown stays in the preview collection, so
+switching between many pose libraries makes it grow without bounds. The
+preview store keeps track of the memory used by each thumbnail (including
+its mirrored variant) and unloads the least recently drawn thumbnails when
+more than the budget is used. Thumbnails referred to by any of the cached
+enum items are never unloaded, as they may be shown in any panel, page or
+flipped list; only thumbnails of enum items that dropped out of the cache
+(see the 'Cached Pose Libraries' preference) are unloaded.
+"""
+
+import collections
+import logging
+import typing
+
+from . import loader
+
+logger = logging.getLogger(__name__)
+
+
+class PreviewStore:
+    """Tracks the memory used by thumbnail previews and evicts the least recently drawn."""
+
+    def __init__(self):
+        self.max_bytes = 0
+        self.resident_bytes = 0
+        self.evicted_count = 0
+        # {thumbnail abspath: {preview name: size in bytes}}, least recently drawn first.
+        self._entries = collections.OrderedDict()
+        self._icons = {}  # {icon ID: thumbnail abspath}
+        self._displayed = None  # the enum items that were last drawn
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_bytes > 0
+
+    def configure(self, max_bytes: int):
+        """Set the memory budget; 0 means unlimited."""
+        self.max_bytes = max_bytes
+        self._schedule_eviction()
+
+    def add(self, abspath: str, name: str, image):
+        """Register a preview of a thumbnail.
+
+        :param abspath: the absolute path of the thumbnail image.
+        :param name: the name of the preview in the preview collection, which
+            differs from abspath for the mirrored variant.
+        """
+        width, height = image.image_size
+        size_in_bytes = 4 * width * height
+        previews = self._entries.setdefault(abspath, {})
+        self.resident_bytes += size_in_bytes - previews.get(name, 0)
+        previews[name] = size_in_bytes
+        self._entries.move_to_end(abspath)
+        self._icons[image.icon_id] = abspath
+        self._schedule_eviction()
+
+    def touch(self, enum_items: list):
+        """Mark the thumbnails of the enum items as drawn.
+
+        Cheap to call on every redraw, as the enum items are only walked
+        when a different list is drawn.
+        """
+        if enum_items is self._displayed:
+            return
+        self._displayed = enum_items
+        for item in enum_items:
+            abspath = self._icons.get(item[3])
+            if abspath is not None:
+                self._entries.move_to_end(abspath)
+
+    def clear(self):
+        """Forget all previews; call when the preview collection is cleared."""
+        self._entries.clear()
+        self._icons.clear()
+        self._displayed = None
+        self.resident_bytes = 0
+
+    def stats(self) -> typing.Dict[str, int]:
+        return {
+            'thumbnails': len(self._entries),
+            'resident_bytes': self.resident_bytes,
+            'max_bytes': self.max_bytes,
+            'evicted': self.evicted_count,
+        }
+
+    def _schedule_eviction(self):
+        if self.enabled and self.resident_bytes > self.max_bytes:
+            # Evict on the next tick, when the enum items that are being
+            # built now are the displayed ones.
+            loader.call_on_main_thread(self.evict)
+
+    def evict(self) -> bool:
+        """Unload the least recently drawn thumbnails until the budget is met.
+
+        Must be called from the main thread.
+
+        Returns:
+            False, so that it can be used with loader.call_on_main_thread().
+        """
+        from . import core
+
+        if not self.enabled or self.resident_bytes <= self.max_bytes:
+            return False
+        pcoll = core.preview_collections.get('pose_library')
+        if pcoll is None:
+            return False
+
+        displayed_icons = {item[3] for item in pcoll.pose_thumbnails}
+        for enum_items in core.get_enum_items.cache_values():
+            displayed_icons.update(item[3] for item in enum_items)
+        evicted_icons = set()
+        evicted = 0
+        for abspath, previews in list(self._entries.items()):
+            if self.resident_bytes <= self.max_bytes:
+                break
+            icon_ids = {pcoll[name].icon_id for name in previews if name in pcoll}
+            if icon_ids & displayed_icons:
+                continue
+            for name, size_in_bytes in previews.items():
+                if name in pcoll:
+                    del pcoll[name]
+                self.resident_bytes -= size_in_bytes
+            core.loaded_image_stats.pop(abspath, None)
+            del self._entries[abspath]
+            evicted_icons |= icon_ids
+            evicted += 1
+
+        self.evicted_count += evicted
+        if not evicted:
+            return False
+        for icon_id in evicted_icons:
+            self._icons.pop(icon_id, None)
+        logger.debug('Evicted %d thumbnails, %d bytes remain', evicted, self.resident_bytes)
+        return False
+
+
+preview_store = PreviewStore()
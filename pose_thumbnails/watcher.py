@@ -0,0 +1,313 @@
+"""Hot reloading of thumbnail images that change on disk.
+
+A background thread watches the thumbnail files of the pose library that is
+shown in the UI. On Linux it uses inotify on the directories containing the
+thumbnails; elsewhere (or when inotify is unavailable) it periodically
+compares the modification times of the files.
+
+Changes are debounced: a path is only handed to the main thread once no new
+events arrived for DEBOUNCE_DELAY seconds, so a render writing many files
+results in one batch. The main thread then reloads the changed images with
+core.reload_image(), spending at most PROCESS_TIME_BUDGET per tick.
+"""
+
+import ctypes
+import ctypes.util
+import logging
+import os
+import select
+import struct
+import sys
+import threading
+import time
+import typing
+
+import bpy
+
+from . import atlas, common, loader, manifest
+
+logger = logging.getLogger(__name__)
+
+DEBOUNCE_DELAY = 0.5
+"""Seconds without new events before changed files are reloaded."""
+POLL_INTERVAL = 2.0
+"""Seconds between modification time checks, when inotify is not available."""
+PROCESS_TIME_BUDGET = 0.02
+"""Maximum time in seconds spent per main-thread tick on reloading images."""
+
+# From <sys/inotify.h>
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_Q_OVERFLOW = 0x00004000
+IN_NONBLOCK = os.O_NONBLOCK
+IN_CLOEXEC = getattr(os, 'O_CLOEXEC', 0o2000000)
+INOTIFY_MASK = IN_CLOSE_WRITE | IN_MOVED_TO | IN_CREATE | IN_DELETE
+INOTIFY_EVENT = struct.Struct('iIII')  # wd, mask, cookie, len
+
+
+class Inotify:
+    """Minimal ctypes wrapper around the Linux inotify API."""
+
+    def __init__(self):
+        libc_name = ctypes.util.find_library('c')
+        if not libc_name:
+            raise OSError('libc not found')
+        self._libc = ctypes.CDLL(libc_name, use_errno=True)
+        self.fd = self._libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self.fd < 0:
+            errno = ctypes.get_errno()
+            raise OSError(errno, os.strerror(errno))
+        self._directories = {}  # {watch descriptor: directory}
+
+    def watch(self, directories: typing.Set[str]):
+        """Watch exactly the given directories."""
+        for wd, directory in list(self._directories.items()):
+            if directory not in directories:
+                self._libc.inotify_rm_watch(self.fd, wd)
+                del self._directories[wd]
+        watched = set(self._directories.values())
+        for directory in directories - watched:
+            wd = self._libc.inotify_add_watch(self.fd, os.fsencode(directory), INOTIFY_MASK)
+            if wd < 0:
+                errno = ctypes.get_errno()
+                logger.warning('Unable to watch %s: %s', directory, os.strerror(errno))
+                continue
+            self._directories[wd] = directory
+
+    def read(self, timeout: float) -> typing.Tuple[typing.Set[str], bool]:
+        """Wait at most timeout seconds for events.
+
+        Returns:
+            the paths of the changed files, and whether events were lost
+            because the kernel queue overflowed.
+        """
+        readable, _, _ = select.select([self.fd], [], [], timeout)
+        if not readable:
+            return set(), False
+        try:
+            data = os.read(self.fd, 64 * 1024)
+        except BlockingIOError:
+            return set(), False
+
+        paths = set()
+        overflow = False
+        offset = 0
+        while offset + INOTIFY_EVENT.size <= len(data):
+            wd, mask, _, name_length = INOTIFY_EVENT.unpack_from(data, offset)
+            offset += INOTIFY_EVENT.size
+            name = data[offset:offset + name_length].rstrip(b'\0')
+            offset += name_length
+
+            if mask & IN_Q_OVERFLOW:
+                overflow = True
+                continue
+            directory = self._directories.get(wd)
+            if directory is not None and name:
+                paths.add(os.path.join(directory, os.fsdecode(name)))
+        return paths, overflow
+
+    def close(self):
+        os.close(self.fd)
+
+
+class ThumbnailWatcher:
+    """Watches thumbnail files and reloads them on the main thread when they change."""
+
+    def __init__(self):
+        self.enabled = False
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._thread = None
+        self._stop = False
+
+        self._watch_key = None
+        self._poselib_name = ''
+        self._abspaths = frozenset()  # watched files
+        self._frames = {}  # {thumbnail abspath: [frame, ...]}
+        self._thumbnails = {}  # {watched file: {thumbnail abspath, ...}}
+
+        self._ready = set()  # changed paths, handed to the main thread
+
+    def set_enabled(self, enabled: bool):
+        self.enabled = enabled
+        if not enabled:
+            self.stop()
+
+    def watch(self, poselib: bpy.types.Action):
+        """Watch the thumbnail files of the pose library.
+
+        Cheap to call on every redraw; the thumbnail paths are only gathered
+        again when the pose library or its number of thumbnails changed.
+        """
+        if not self.enabled:
+            return
+        key = (poselib.as_pointer(), len(poselib.pose_thumbnails))
+        if key == self._watch_key:
+            return
+        self._watch_key = key
+
+        frames = {}
+        thumbnails = {}
+        for thumbnail in poselib.pose_thumbnails:
+            abspath = common.get_thumbnail_abspath(poselib, thumbnail.filepath)
+            frames.setdefault(abspath, []).append(thumbnail.frame)
+            # Atlas tiles share one file.
+            source_path, _ = atlas.split_tile_path(abspath)
+            thumbnails.setdefault(source_path, set()).add(abspath)
+
+        with self._lock:
+            self._poselib_name = poselib.name
+            self._frames = frames
+            self._thumbnails = thumbnails
+            self._abspaths = frozenset(thumbnails)
+            self._ready.clear()
+        self._wakeup.set()
+
+        if self._thread is None:
+            self._stop = False
+            self._thread = threading.Thread(target=self._run, name='pose-thumbnails-watcher',
+                                            daemon=True)
+            self._thread.start()
+        loader.call_on_main_thread(self.process_changes)
+
+    def forget(self):
+        """Gather the thumbnail paths again on the next call to watch()."""
+        self._watch_key = None
+
+    def stop(self):
+        self._watch_key = None
+        if self._thread is None:
+            return
+        self._stop = True
+        self._wakeup.set()
+        self._thread.join()
+        self._thread = None
+        with self._lock:
+            self._ready.clear()
+
+    def _run(self):
+        inotify = None
+        if sys.platform.startswith('linux'):
+            try:
+                inotify = Inotify()
+            except (OSError, AttributeError):
+                logger.info('inotify unavailable, polling thumbnail files for changes')
+        try:
+            if inotify is not None:
+                self._run_inotify(inotify)
+            else:
+                self._run_polling()
+        except Exception:
+            logger.exception('Thumbnail watcher stopped')
+        finally:
+            if inotify is not None:
+                inotify.close()
+
+    def _run_inotify(self, inotify: Inotify):
+        pending = set()
+        last_event = 0.0
+        abspaths = frozenset()
+        while not self._stop:
+            if self._wakeup.is_set():
+                self._wakeup.clear()
+                with self._lock:
+                    abspaths = self._abspaths
+                inotify.watch({os.path.dirname(abspath) for abspath in abspaths})
+                pending.clear()
+
+            paths, overflow = inotify.read(DEBOUNCE_DELAY / 2)
+            if overflow:
+                # Events were lost; let reload_image() figure out what changed.
+                paths = abspaths
+            paths = paths & abspaths
+            if paths:
+                pending |= paths
+                last_event = time.monotonic()
+            elif pending and time.monotonic() - last_event > DEBOUNCE_DELAY:
+                self._hand_over(pending)
+                pending = set()
+
+    def _run_polling(self):
+        mtimes = {}
+        abspaths = frozenset()
+        while not self._stop:
+            if self._wakeup.is_set():
+                self._wakeup.clear()
+                with self._lock:
+                    abspaths = self._abspaths
+                mtimes = {abspath: mtimes.get(abspath, _mtime(abspath))
+                          for abspath in abspaths}
+
+            changed = set()
+            for abspath in abspaths:
+                if self._stop or self._wakeup.is_set():
+                    break
+                mtime = _mtime(abspath)
+                if mtime != mtimes[abspath]:
+                    mtimes[abspath] = mtime
+                    changed.add(abspath)
+            if changed:
+                self._hand_over(changed)
+            self._wakeup.wait(POLL_INTERVAL)
+
+    def _hand_over(self, paths: typing.Set[str]):
+        logger.debug('%d thumbnail files changed on disk', len(paths))
+        with self._lock:
+            self._ready |= paths
+
+    def process_changes(self) -> bool:
+        """Reload changed images; called on the main thread.
+
+        Returns:
+            whether the watcher is still running.
+        """
+        from . import core
+
+        if self._thread is None:
+            return False
+        with self._lock:
+            if not self._ready:
+                return True
+            ready = set()
+            for path in self._ready:
+                ready |= self._thumbnails.get(path, set())
+            self._ready = set()
+            frames = self._frames
+            poselib_name = self._poselib_name
+
+        poselib = bpy.data.actions.get(poselib_name)
+        if poselib is None:
+            return True
+
+        pcoll = core.preview_collections['pose_library']
+        start = time.monotonic()
+        new_frames = []
+        while ready and time.monotonic() - start < PROCESS_TIME_BUDGET:
+            abspath = ready.pop()
+            if abspath in pcoll:
+                core.reload_image(pcoll, abspath)
+            else:
+                # The image could not be loaded before, e.g. because it didn't exist.
+                manifest.forget_stat(atlas.split_tile_path(abspath)[0])
+                new_frames.extend(frames.get(abspath, ()))
+        if new_frames:
+            core.update_enum_items(poselib, new_frames)
+
+        if ready:
+            # Out of time, continue on the next tick.
+            with self._lock:
+                self._ready |= {atlas.split_tile_path(abspath)[0] for abspath in ready}
+        loader.redraw_thumbnail_panels()
+        return True
+
+
+def _mtime(abspath: str) -> typing.Optional[int]:
+    try:
+        return os.stat(abspath).st_mtime_ns
+    except OSError:
+        return None
+
+
+thumbnail_watcher = ThumbnailWatcher()
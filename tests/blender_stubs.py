@@ -0,0 +1,56 @@
+"""Minimal stand-ins for the Blender modules, to import the add-on outside Blender.
+
+Only what is needed to import the modules of the add-on is provided: any
+attribute of bpy exists, classes derived from bpy.types are plain classes
+and property definitions evaluate to None. Tests and benchmarks that need
+Blender data build their own fakes on top of this.
+"""
+
+import sys
+import types
+
+
+class _Anything:
+    """Has every attribute, can be called, and iterates as an empty sequence."""
+
+    def __getattr__(self, name):
+        if name[:1].isupper():
+            return type(name, (), {})
+        return _Anything()
+
+    def __call__(self, *args, **kwargs):
+        return _Anything()
+
+    def __iter__(self):
+        return iter(())
+
+
+class _Props:
+    def __getattr__(self, name):
+        return lambda *args, **kwargs: None
+
+
+def _module(name: str, **attributes) -> types.ModuleType:
+    module = types.ModuleType(name)
+    module.__dict__.update(attributes)
+    sys.modules[name] = module
+    return module
+
+
+def install():
+    """Put the stand-ins in sys.modules, unless the real bpy is available."""
+    if 'bpy' in sys.modules:
+        return
+
+    previews = _module('bpy.utils.previews', ImagePreviewCollection=dict,
+                       new=lambda: _Anything(), remove=lambda pcoll: None)
+    utils = _module('bpy.utils', previews=previews)
+    _module('bpy', types=_Anything(), props=_Props(), path=_Anything(), app=_Anything(),
+            context=_Anything(), ops=_Anything(), data=_Anything(), utils=utils)
+
+    io_utils = _module('bpy_extras.io_utils',
+                       ImportHelper=type('ImportHelper', (), {}),
+                       ExportHelper=type('ExportHelper', (), {}))
+    _module('bpy_extras', io_utils=io_utils)
+    _module('mathutils', Matrix=type('Matrix', (), {}), Quaternion=type('Quaternion', (), {}),
+            Vector=type('Vector', (), {}), Euler=type('Euler', (), {}))
@@ -0,0 +1,85 @@
+import os
+import struct
+
+import pytest
+
+from pose_thumbnails import atlas
+
+TILE_SIZE = 4
+
+
+def tile_bytes(value: int) -> bytes:
+    return bytes([value]) * (4 * TILE_SIZE * TILE_SIZE)
+
+
+@pytest.fixture(autouse=True)
+def forget_atlases():
+    yield
+    atlas.forget_atlases()
+
+
+def test_tile_path_round_trip():
+    path = atlas.tile_path('//poses.thumbatlas', 12)
+    assert atlas.split_tile_path(path) == ('//poses.thumbatlas', 12)
+    assert atlas.split_tile_path('//poses/smile.png') == ('//poses/smile.png', None)
+
+
+def test_tiles_round_trip(tmp_path):
+    path = str(tmp_path / 'poses.thumbatlas')
+    atlas.write_atlas(path, TILE_SIZE, [(10, tile_bytes(1)), (20, tile_bytes(2)),
+                                        (30, tile_bytes(3))])
+
+    tile_atlas = atlas.Atlas(path)
+    assert tile_atlas.tile_size == TILE_SIZE
+    assert tile_atlas.tile_count == 3
+    assert tile_atlas.frames() == [10, 20, 30]
+    for tile_index, value in enumerate((1, 2, 3)):
+        pixels = tile_atlas.tile(tile_index)
+        assert len(pixels) == TILE_SIZE * TILE_SIZE
+        assert pixels.tobytes() == tile_bytes(value)
+    with pytest.raises(IndexError):
+        tile_atlas.tile(3)
+
+
+def test_write_rejects_wrong_tile_size(tmp_path):
+    path = str(tmp_path / 'poses.thumbatlas')
+    with pytest.raises(ValueError):
+        atlas.write_atlas(path, TILE_SIZE, [(10, b'\0' * 3)])
+
+
+def test_corrupt_atlas(tmp_path):
+    path = str(tmp_path / 'poses.thumbatlas')
+    with open(path, 'wb') as outfile:
+        outfile.write(b'not an atlas at all')
+    with pytest.raises(ValueError):
+        atlas.Atlas(path)
+
+    atlas.write_atlas(path, TILE_SIZE, [(10, tile_bytes(1)), (20, tile_bytes(2))])
+    with open(path, 'r+b') as outfile:
+        outfile.truncate(os.path.getsize(path) - 1)
+    with pytest.raises(ValueError):
+        atlas.Atlas(path)
+
+
+def test_open_atlas_reuses_mapping_until_changed(tmp_path):
+    path = str(tmp_path / 'poses.thumbatlas')
+    atlas.write_atlas(path, TILE_SIZE, [(10, tile_bytes(1))])
+    first = atlas.open_atlas(path)
+    assert atlas.open_atlas(path) is first
+
+    atlas.write_atlas(path, TILE_SIZE, [(10, tile_bytes(1)), (20, tile_bytes(2))])
+    stat = os.stat(path)
+    os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1000000))
+    second = atlas.open_atlas(path)
+    assert second is not first
+    assert second.frames() == [10, 20]
+
+
+def test_header_layout(tmp_path):
+    path = str(tmp_path / 'poses.thumbatlas')
+    atlas.write_atlas(path, TILE_SIZE, [(7, tile_bytes(1))])
+    with open(path, 'rb') as infile:
+        data = infile.read()
+    assert atlas.ATLAS_HEADER.unpack_from(data) == (atlas.ATLAS_MAGIC, atlas.ATLAS_VERSION,
+                                                    TILE_SIZE, 1)
+    assert struct.unpack_from('<i', data, atlas.ATLAS_HEADER.size) == (7,)
@@ -0,0 +1,114 @@
+import math
+
+import numpy
+import pytest
+
+from pose_thumbnails import blending, snapshot
+
+
+def make_pose(bone_indices, location=None, rotation=None, props=()):
+    """Return a snapshot with the given values; props are (row, key, value) tuples."""
+    pose = snapshot.PoseSnapshot(None, bone_indices)
+    if location is not None:
+        pose.location[:] = location
+    if rotation is not None:
+        pose.rotation[:] = rotation
+    else:
+        pose.rotation[:, 0] = 1.0
+    pose.prop_keys = [(row, key) for row, key, _ in props]
+    pose.prop_values = numpy.array([value for _, _, value in props], dtype=numpy.float64)
+    pose.prop_is_float = numpy.array([isinstance(value, float) for _, _, value in props],
+                                     dtype=bool)
+    return pose
+
+
+def z_rotation(angle: float):
+    return [math.cos(angle / 2), 0.0, 0.0, math.sin(angle / 2)]
+
+
+def test_slerp_halfway():
+    result = blending.slerp(numpy.array([z_rotation(0.0)]),
+                            numpy.array([z_rotation(math.pi / 2)]), 0.5)
+    numpy.testing.assert_allclose(result, [z_rotation(math.pi / 4)], atol=1e-6)
+
+
+def test_slerp_takes_shortest_path():
+    negated = -numpy.array([z_rotation(math.pi / 2)])
+    result = blending.slerp(numpy.array([z_rotation(0.0)]), negated, 1.0)
+    numpy.testing.assert_allclose(result, [z_rotation(math.pi / 2)], atol=1e-6)
+
+
+def test_pose_mix():
+    pose_a = make_pose([0, 1], location=[[0, 0, 0], [1, 1, 1]],
+                       props=[(0, 'blink', 0.0), (0, 'mode', 1)])
+    pose_b = make_pose([0, 1], location=[[2, 0, 0], [1, 1, 1]],
+                       rotation=[z_rotation(math.pi / 2), z_rotation(0.0)],
+                       props=[(0, 'blink', 1.0), (0, 'mode', 3)])
+    pose_mix = blending.PoseMix(pose_a, pose_b)
+
+    mixed = pose_mix(0.25)
+    numpy.testing.assert_allclose(mixed.location, [[0.5, 0, 0], [1, 1, 1]])
+    numpy.testing.assert_allclose(mixed.rotation[0], z_rotation(math.pi / 8), atol=1e-6)
+    assert mixed.prop_values.tolist() == [0.25, 1]
+
+    mixed = pose_mix(0.75)
+    assert mixed.prop_values.tolist() == [0.75, 3]
+
+
+def test_pose_mix_keeps_bones_only_in_pose_a():
+    pose_a = make_pose([0, 1], location=[[0, 0, 0], [1, 1, 1]])
+    pose_b = make_pose([1], location=[[3, 3, 3]])
+    mixed = blending.PoseMix(pose_a, pose_b)(1.0)
+    numpy.testing.assert_allclose(mixed.location, [[0, 0, 0], [3, 3, 3]])
+
+
+@pytest.mark.parametrize('factor', [0.0, 0.3, 1.0])
+def test_mix_reuses_pose_mix(factor):
+    pose_a = make_pose([0], location=[[0, 0, 0]])
+    pose_b = make_pose([0], location=[[1, 0, 0]])
+    try:
+        first = blending.mix(pose_a, pose_b, factor)
+        assert blending.mix(pose_a, pose_b, factor) is first
+        assert first.location[0, 0] == pytest.approx(factor)
+    finally:
+        blending.forget_mixes()
+
+
+def test_pose_weights_give_the_base_pose_what_is_left():
+    applies = numpy.ones((2, 3), dtype=bool)
+    weights = blending.PoseBlend._pose_weights(numpy.array([0.6, 0.3]), applies)
+    numpy.testing.assert_allclose(weights, [[0.1] * 3, [0.6] * 3, [0.3] * 3])
+
+
+def test_pose_weights_are_scaled_down_per_bone():
+    applies = numpy.array([[True, True], [True, False]])
+    weights = blending.PoseBlend._pose_weights(numpy.array([0.8, 0.8]), applies)
+    # Both poses apply to the first bone, only the first pose to the second.
+    numpy.testing.assert_allclose(weights, [[0.0, 0.2], [0.5, 0.8], [0.5, 0.0]])
+    numpy.testing.assert_allclose(weights.sum(axis=0), [1.0, 1.0])
+
+
+def test_pose_blend():
+    base = make_pose([0, 1], location=[[0, 0, 0], [0, 0, 0]], props=[(0, 'mode', 1)])
+    smile = make_pose([0, 1], location=[[10, 0, 0], [10, 0, 0]], props=[(0, 'mode', 2)])
+    squint = make_pose([0, 1], location=[[0, 10, 0], [0, 10, 0]], props=[(0, 'mode', 3)])
+    pose_blend = blending.PoseBlend(base, [smile, squint], masks=[None, [0]])
+
+    blended = pose_blend([0.6, 0.3])
+    numpy.testing.assert_allclose(blended.location, [[6, 3, 0], [6, 0, 0]])
+    assert blended.prop_values.tolist() == [2]
+
+    # Overweight poses don't overshoot, and negative weights count as zero.
+    blended = pose_blend([1.5, 1.5])
+    numpy.testing.assert_allclose(blended.location, [[5, 5, 0], [10, 0, 0]])
+    blended = pose_blend([-1.0, 0.0])
+    numpy.testing.assert_allclose(blended.location, base.location)
+    assert blended.prop_values.tolist() == [1]
+
+
+def test_blend_rotations_are_normalized():
+    base = make_pose([0], rotation=[z_rotation(0.0)])
+    turned = make_pose([0], rotation=[z_rotation(math.pi / 2)])
+    blended = blending.blend(base, [turned], [0.5])
+    numpy.testing.assert_allclose(blended.rotation, [z_rotation(math.pi / 4)], atol=1e-6)
+    assert numpy.linalg.norm(blended.rotation[0]) == pytest.approx(1.0)
@@ -0,0 +1,48 @@
+import array
+
+from pose_thumbnails import common
+
+
+class Item:
+    def __init__(self, frame):
+        self.frame = frame
+
+
+class Collection(list):
+    def foreach_get(self, name, values):
+        values[:] = array.array(values.typecode, (getattr(item, name) for item in self))
+
+
+class Action:
+    def __init__(self, frames):
+        self.pose_markers = Collection(Item(frame) for frame in frames)
+
+    def as_pointer(self) -> int:
+        return id(self)
+
+
+def test_frame_index():
+    action = Action([10, 20, 20, 30])
+    index = common.FrameIndex('pose_markers')
+    assert index.index(action, 20) == 1
+    assert index.get(action, 30) is action.pose_markers[3]
+    assert index.index(action, 40) is None
+    assert index.index(None, 10) is None
+
+
+def test_frame_index_follows_changes():
+    action = Action([10, 20, 30])
+    index = common.FrameIndex('pose_markers')
+    assert index.index(action, 30) == 2
+
+    action.pose_markers.append(Item(40))
+    index.item_added(action)
+    assert index.index(action, 40) == 3
+
+    # Re-framing an item doesn't change the length of the collection.
+    action.pose_markers[0].frame = 15
+    assert index.index(action, 15) == 0
+    assert index.index(action, 10) is None
+
+    del action.pose_markers[1]
+    assert index.index(action, 30) == 1
@@ -0,0 +1,144 @@
+import types
+
+import numpy
+import pytest
+
+from pose_thumbnails import evaluation
+
+
+class KeyframePoints:
+    def __init__(self, frames):
+        self.co = [(frame, 1.0) for frame in frames]
+
+    def __len__(self):
+        return len(self.co)
+
+    def foreach_get(self, name, values):
+        values[:] = [value for point in getattr(self, name) for value in point]
+
+
+class FCurve:
+    def __init__(self, data_path, frames, array_index=0):
+        self.data_path = data_path
+        self.array_index = array_index
+        self.mute = False
+        self.keyframe_points = KeyframePoints(frames)
+
+
+class Action:
+    name = 'poselib'
+    is_updated = False
+    is_updated_data = False
+
+    def __init__(self, fcurves, pose_frames):
+        self.fcurves = fcurves
+        self.pose_markers = [types.SimpleNamespace(frame=frame) for frame in pose_frames]
+
+    def as_pointer(self) -> int:
+        return id(self)
+
+
+class Armature:
+    def __init__(self, bone_names):
+        self.pose = types.SimpleNamespace(
+            bones=[types.SimpleNamespace(name=name) for name in bone_names])
+
+    def as_pointer(self) -> int:
+        return id(self)
+
+
+@pytest.fixture(autouse=True)
+def forget_layouts():
+    yield
+    evaluation.forget_layouts()
+
+
+def test_pose_masks():
+    poselib = Action([
+        FCurve('pose.bones["hand.L"].location', [0, 10]),
+        FCurve('pose.bones["hand.L"].location', [0, 10], array_index=1),
+        FCurve('pose.bones["eye.L"]["blink"]', [9.6, 20]),
+        FCurve('location', [0, 10, 20]),
+    ], pose_frames=[0, 10, 20])
+
+    layout = evaluation.library_layout(poselib)
+    assert layout.bone_names == {'hand.L', 'eye.L'}
+    assert layout.pose_masks == [
+        {'hand.L': {'location'}},
+        {'hand.L': {'location'}, 'eye.L': {'["blink"]'}},
+        {'eye.L': {'["blink"]'}},
+    ]
+    assert list(layout.pose_fcurves(2)) == [(2, 'eye.L', '["blink"]')]
+    assert evaluation.library_layout(poselib) is layout
+
+
+def test_bone_index_paths_are_resolved_through_the_armature():
+    poselib = Action([
+        FCurve('pose.bones[1].rotation_quaternion', [0]),
+        FCurve('pose.bones["spine"].location', [0]),
+    ], pose_frames=[0])
+    armature = Armature(['root', 'hand.L'])
+
+    layout = evaluation.library_layout(poselib, armature)
+    assert layout.bone_names == {'hand.L', 'spine'}
+    assert layout.fcurves[0] == (0, 'hand.L', 'rotation_quaternion')
+    # Without an armature, the layout resolved earlier is still valid.
+    assert evaluation.library_layout(poselib) is layout
+
+    other = evaluation.library_layout(poselib, Armature(['root', 'hips']))
+    assert other.bone_names == {'hips', 'spine'}
+
+
+def test_bone_index_paths_without_armature_are_skipped():
+    poselib = Action([
+        FCurve('pose.bones[1].location', [0]),
+        FCurve('pose.bones[7].location', [0]),
+    ], pose_frames=[0])
+    assert evaluation.library_layout(poselib).bone_names == frozenset()
+    layout = evaluation.library_layout(poselib, Armature(['root', 'hand.L']))
+    assert layout.bone_names == {'hand.L'}
+
+
+def test_changed_action_invalidates_layout():
+    poselib = Action([FCurve('pose.bones["hand.L"].location', [0, 10])],
+                     pose_frames=[0, 20])
+    layout = evaluation.library_layout(poselib)
+    assert layout.pose_masks[1] == {}
+
+    # Moving a keyframe is only noticed once Blender marks the action as updated.
+    poselib.fcurves[0].keyframe_points.co[1] = (20, 1.0)
+    assert evaluation.library_layout(poselib) is layout
+    evaluation.invalidate_updated([poselib])
+    assert evaluation.library_layout(poselib) is layout
+    poselib.is_updated = True
+    evaluation.invalidate_updated([poselib])
+    assert evaluation.library_layout(poselib).pose_masks[1] == {'hand.L': {'location'}}
+
+
+def test_added_pose_invalidates_layout():
+    poselib = Action([FCurve('pose.bones["hand.L"].location', [0, 10])], pose_frames=[0])
+    layout = evaluation.library_layout(poselib)
+    poselib.pose_markers.append(types.SimpleNamespace(frame=10))
+    assert evaluation.library_layout(poselib) is not layout
+    assert len(evaluation.library_layout(poselib).pose_masks) == 2
+
+
+def test_pose_values():
+    pose_values = evaluation.PoseValues.from_entries([
+        ('hand.L', 'location', 0, 1.0),
+        ('hand.L', 'location', 2, 3.0),
+        ('hand.L', 'rotation_quaternion', 0, 0.5),
+        ('eye.L', '["blink"]', 0, 0.25),
+    ])
+    rows = pose_values.rows(['eye.L', 'spine', 'hand.L'])
+    assert rows.tolist() == [1, -1, 0]
+
+    location = numpy.zeros((3, 3), dtype=numpy.float32)
+    pose_values.put(location, rows, 'location')
+    numpy.testing.assert_allclose(location, [[0, 0, 0], [0, 0, 0], [1, 0, 3]])
+
+    assert pose_values.channel(0, 'rotation_quaternion') == {0: 0.5}
+    assert pose_values.channel(1, 'rotation_quaternion') == {}
+    assert pose_values.channel(-1, 'location') == {}
+    assert pose_values.properties(1) == {'blink': 0.25}
+    assert pose_values.properties(0) == {}
@@ -0,0 +1,157 @@
+import array
+import os
+import types
+
+import pytest
+
+from pose_thumbnails import loader, manifest, proxies
+
+
+class PoseLibrary:
+    library = None
+
+
+@pytest.fixture(autouse=True)
+def fake_blender(monkeypatch, tmp_path):
+    """Resolve '//' against tmp_path, and don't schedule saving on a timer."""
+    def abspath(path, library=None):
+        if path.startswith('//'):
+            return os.path.join(str(tmp_path), path[2:])
+        return path
+
+    monkeypatch.setattr(manifest.bpy, 'path', types.SimpleNamespace(abspath=abspath),
+                        raising=False)
+    monkeypatch.setattr(loader, 'call_on_main_thread', lambda callback: None)
+    yield
+    manifest.forget_manifests()
+
+
+def write_image(path: str, content: bytes) -> os.stat_result:
+    with open(path, 'wb') as outfile:
+        outfile.write(content)
+    return os.stat(path)
+
+
+def test_save_and_load(tmp_path):
+    image_path = str(tmp_path / 'smile.png')
+    stat = write_image(image_path, b'smile')
+    manifest_path = str(tmp_path / 'manifests' / 'lib.json')
+
+    saved = manifest.Manifest(manifest_path)
+    assert saved.abspath(PoseLibrary(), '//smile.png') == image_path
+    saved.remember_stat(image_path, manifest.FileStat(stat.st_mtime_ns, stat.st_size))
+    assert saved.dirty
+    saved.save()
+    assert not saved.dirty
+
+    loaded = manifest.Manifest(manifest_path)
+    loaded.load()
+    assert loaded.thumbnails == {'//smile.png': image_path}
+    assert loaded.stats == {image_path: (stat.st_mtime_ns, stat.st_size)}
+    assert loaded.uses(image_path)
+    assert not loaded.dirty
+
+
+def test_unusable_manifest_is_ignored(tmp_path):
+    manifest_path = str(tmp_path / 'lib.json')
+    with open(manifest_path, 'w') as outfile:
+        outfile.write('{"version": 1, "thumbnails": {"//a.png": "/a.png"}}')
+    old_version = manifest.Manifest(manifest_path)
+    old_version.load()
+    assert old_version.thumbnails == {}
+
+    with open(manifest_path, 'w') as outfile:
+        outfile.write('not json')
+    corrupt = manifest.Manifest(manifest_path)
+    corrupt.load()
+    assert corrupt.thumbnails == {}
+
+
+def test_unsaved_manifest_is_not_written(tmp_path):
+    unsaved = manifest.Manifest('')
+    unsaved.abspath(PoseLibrary(), '//smile.png')
+    unsaved.save()
+    assert not unsaved.dirty
+    assert os.listdir(str(tmp_path)) == []
+
+
+def test_only_manifests_using_the_file_become_dirty(tmp_path, monkeypatch):
+    first = manifest.Manifest('')
+    second = manifest.Manifest('')
+    monkeypatch.setattr(manifest, '_manifests', {'first': first, 'second': second})
+    first.abspath(PoseLibrary(), '//first.png')
+    second.abspath(PoseLibrary(), '//second.png')
+    first.dirty = second.dirty = False
+
+    stat = write_image(str(tmp_path / 'first.png'), b'first')
+    manifest.remember_stat(str(tmp_path / 'first.png'), stat)
+    assert first.dirty
+    assert not second.dirty
+
+    # Remembering the same state again doesn't change anything.
+    first.dirty = False
+    manifest.remember_stat(str(tmp_path / 'first.png'), stat)
+    assert not first.dirty
+
+
+def test_overwritten_image_is_not_read_from_outdated_proxy(tmp_path, monkeypatch):
+    cache = proxies.ProxyCache()
+    cache.configure(str(tmp_path / 'cache'), 1024 * 1024)
+    monkeypatch.setattr(proxies, 'proxy_cache', cache)
+
+    image_path = str(tmp_path / 'smile.png')
+    write_image(image_path, b'smile')
+    cache.write(image_path, proxies.Proxy(1, 1, array.array('i', [1])))
+    stat, proxy = loader.read_thumbnail(image_path)
+    assert proxy is not None
+
+    # Overwriting the file in place doesn't change the mtime of the directory.
+    directory_mtime = os.stat(str(tmp_path)).st_mtime_ns
+    with open(image_path, 'r+b') as outfile:
+        outfile.write(b'frown, larger')
+    assert os.stat(str(tmp_path)).st_mtime_ns == directory_mtime
+
+    new_stat, proxy = loader.read_thumbnail(image_path)
+    assert new_stat.st_size != stat.st_size
+    assert proxy is None
+
+
+def test_known_stat_is_trusted_until_forgotten(tmp_path, monkeypatch):
+    cache = proxies.ProxyCache()
+    cache.configure(str(tmp_path / 'cache'), 1024 * 1024)
+    monkeypatch.setattr(proxies, 'proxy_cache', cache)
+    library = manifest.Manifest('')
+    monkeypatch.setattr(manifest, '_manifests', {'lib': library})
+
+    image_path = library.abspath(PoseLibrary(), '//smile.png')
+    stat = write_image(image_path, b'smile')
+    cache.write(image_path, proxies.Proxy(1, 1, array.array('i', [1])))
+    manifest.remember_stat(image_path, stat)
+    known_stat = manifest.known_stat(image_path)
+    assert known_stat == (stat.st_mtime_ns, stat.st_size)
+
+    def no_stat(path):
+        raise AssertionError('%s was stat\'ed' % path)
+
+    with monkeypatch.context() as patch:
+        patch.setattr(loader.os, 'stat', no_stat)
+        found_stat, proxy = loader.read_thumbnail(image_path, known_stat=known_stat)
+    assert found_stat == known_stat
+    assert proxy is not None
+
+    # Once the file is known to have changed, it is checked again.
+    write_image(image_path, b'frown, larger')
+    manifest.forget_stat(image_path)
+    assert manifest.known_stat(image_path) is None
+    found_stat, proxy = loader.read_thumbnail(image_path, known_stat=None)
+    assert found_stat.st_size == len(b'frown, larger')
+    assert proxy is None
+
+
+def test_known_stat_without_proxy_falls_back_to_the_file(tmp_path):
+    image_path = str(tmp_path / 'smile.png')
+    stat = write_image(image_path, b'smile')
+    outdated = manifest.FileStat(stat.st_mtime_ns - 1, stat.st_size)
+    found_stat, proxy = loader.read_thumbnail(image_path, known_stat=outdated)
+    assert found_stat.st_mtime_ns == stat.st_mtime_ns
+    assert proxy is None
@@ -0,0 +1,27 @@
+import sys
+
+import pytest
+
+from pose_thumbnails import profiling
+
+
+@pytest.fixture(autouse=True)
+def stop_profiling():
+    yield
+    profiling.set_enabled(False)
+    profiling.reset()
+
+
+@pytest.mark.skipif(sys.version_info >= (3, 12),
+                    reason='cProfile uses sys.monitoring instead of sys.setprofile()')
+def test_export_does_not_restart_cprofile_after_switching_to_timers(tmp_path):
+    profiling.set_enabled(True, use_cprofile=True)
+    assert sys.getprofile() is not None
+    profiling.set_enabled(True)
+    assert sys.getprofile() is None
+
+    profiling.export_cprofile(str(tmp_path / 'profile.prof'))
+    assert sys.getprofile() is None
+    profiling.reset()
+    assert sys.getprofile() is None
+
@@ -0,0 +1,37 @@
+import array
+import logging
+
+from pose_thumbnails import proxies
+
+
+def write_image(path: str):
+    with open(path, 'wb') as outfile:
+        outfile.write(b'smile')
+
+
+def test_write_and_read(tmp_path):
+    image_path = str(tmp_path / 'smile.png')
+    write_image(image_path)
+    cache = proxies.ProxyCache()
+    cache.configure(str(tmp_path / 'cache'), 1024 * 1024)
+
+    assert cache.read(image_path) is None
+    cache.write(image_path, proxies.Proxy(2, 1, array.array('i', [1, 2])))
+    proxy = cache.read(image_path)
+    assert (proxy.width, proxy.height, proxy.pixels.tolist()) == (2, 1, [1, 2])
+
+
+def test_unwritable_cache_is_skipped(tmp_path, caplog):
+    image_path = str(tmp_path / 'smile.png')
+    write_image(image_path)
+    # A file where the cache directory should be makes every write fail.
+    not_a_directory = str(tmp_path / 'cache')
+    write_image(not_a_directory)
+    cache = proxies.ProxyCache()
+    cache.configure(not_a_directory, 1024 * 1024)
+
+    with caplog.at_level(logging.WARNING, logger=proxies.__name__):
+        for _ in range(3):
+            cache.write(image_path, proxies.Proxy(1, 1, array.array('i', [1])))
+    assert len(caplog.records) == 1
+    assert cache.read(image_path) is None
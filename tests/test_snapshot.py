@@ -0,0 +1,72 @@
+import numpy
+import pytest
+
+from pose_thumbnails import evaluation, snapshot
+
+
+class PoseBone:
+    def __init__(self, name, location=(0.0, 0.0, 0.0), rotation=(1.0, 0.0, 0.0, 0.0)):
+        self.name = name
+        self.location = list(location)
+        self.rotation_quaternion = list(rotation)
+        self.scale = [1.0, 1.0, 1.0]
+        self.rotation_mode = 'QUATERNION'
+
+    def items(self):
+        return []
+
+
+class PoseBones(list):
+    def keys(self):
+        return [pose_bone.name for pose_bone in self]
+
+    def foreach_get(self, name, values):
+        values[:] = [value for pose_bone in self for value in getattr(pose_bone, name)]
+
+
+class Armature:
+    def __init__(self, pose_bones):
+        self.pose = type('Pose', (), {})()
+        self.pose.bones = PoseBones(pose_bones)
+
+    def as_pointer(self) -> int:
+        return id(self)
+
+
+@pytest.fixture(autouse=True)
+def forget_skeletons():
+    yield
+    snapshot.forget_skeletons()
+
+
+def test_skeleton_is_cached_per_bone_count():
+    armature = Armature([PoseBone('spine'), PoseBone('hand.L')])
+    bone_names = snapshot.skeleton(armature)
+    assert bone_names == ('spine', 'hand.L')
+    assert snapshot.skeleton(armature) is bone_names
+
+    armature.pose.bones.append(PoseBone('hand.R'))
+    assert snapshot.skeleton(armature) == ('spine', 'hand.L', 'hand.R')
+
+
+def test_mirrored_indices_fall_back_to_flipped_names():
+    armature = Armature([PoseBone('spine'), PoseBone('arm.L'), PoseBone('arm.R'),
+                         PoseBone('hand.R'), PoseBone('foot.L')])
+    # The library keys hand.L, which this rig doesn't have; foot.L has no other side.
+    indices = snapshot.mirrored_indices(armature, ['spine', 'arm.L', 'hand.L', 'foot.L'])
+    assert indices == [0, 2, 3]
+
+
+def test_flipped_capture_mirrors_library_values_without_other_side():
+    armature = Armature([PoseBone('hand.R', location=(4.0, 5.0, 6.0))])
+    pose_values = evaluation.PoseValues.from_entries([
+        ('hand.L', 'location', 0, 1.0),
+        ('hand.L', 'location', 1, 2.0),
+    ])
+    pose = snapshot.capture_indices(armature, [0], flipped=True, pose_values=pose_values)
+    # The keyed channels are mirrored, the others keep their current value.
+    numpy.testing.assert_allclose(pose.location, [[-1.0, 2.0, 6.0]])
+    numpy.testing.assert_allclose(pose.rotation, [[1.0, 0.0, 0.0, 0.0]])
+
+    # Without values for the other side, the bone is left out.
+    assert len(snapshot.capture_indices(armature, [0], flipped=True)) == 0
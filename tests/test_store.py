@@ -0,0 +1,54 @@
+import types
+
+import pytest
+
+from pose_thumbnails import core, loader, store
+
+
+class Previews(dict):
+    pose_thumbnails = ()
+
+
+def enum_item(icon_id: int) -> tuple:
+    return ('%d' % icon_id, 'pose %d' % icon_id, '', icon_id, icon_id)
+
+
+@pytest.fixture
+def pcoll(monkeypatch):
+    pcoll = Previews()
+    monkeypatch.setitem(core.preview_collections, 'pose_library', pcoll)
+    monkeypatch.setattr(loader, 'call_on_main_thread', lambda callback: None)
+    return pcoll
+
+
+def add_preview(preview_store, pcoll, icon_id: int):
+    image = types.SimpleNamespace(icon_id=icon_id, image_size=(8, 8))
+    pcoll['/thumb%d.png' % icon_id] = image
+    preview_store.add('/thumb%d.png' % icon_id, '/thumb%d.png' % icon_id, image)
+
+
+def test_evicts_least_recently_drawn(pcoll, monkeypatch):
+    monkeypatch.setattr(core, 'get_enum_items', types.SimpleNamespace(cache_values=list))
+    preview_store = store.PreviewStore()
+    preview_store.configure(2 * 4 * 8 * 8)
+    for icon_id in (1, 2, 3):
+        add_preview(preview_store, pcoll, icon_id)
+
+    preview_store.evict()
+    assert sorted(pcoll) == ['/thumb2.png', '/thumb3.png']
+    assert preview_store.evicted_count == 1
+
+
+def test_keeps_thumbnails_of_all_cached_enum_items(pcoll, monkeypatch):
+    # One list is drawn, another (e.g. a flipped list or another page) is cached.
+    pcoll.pose_thumbnails = [enum_item(1)]
+    cached = [pcoll.pose_thumbnails, [enum_item(2)]]
+    monkeypatch.setattr(core, 'get_enum_items',
+                        types.SimpleNamespace(cache_values=lambda: cached))
+    preview_store = store.PreviewStore()
+    preview_store.configure(4 * 8 * 8)
+    for icon_id in (1, 2, 3):
+        add_preview(preview_store, pcoll, icon_id)
+
+    preview_store.evict()
+    assert sorted(pcoll) == ['/thumb1.png', '/thumb2.png']